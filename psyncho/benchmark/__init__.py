@@ -0,0 +1,13 @@
+'''
+End to end synch benchmarks on generated trees.
+
+Run from the psyncho directory:
+
+    python -m benchmark --files 10000 --fs memory --fs osfs
+
+Config resolution has its own micro benchmark in benchmark.config:
+
+    python -m benchmark.config --layers 1,5,20 --rules 10,1000,10000
+'''
+from benchmark.tree import TreeSpec, generate_tree
+from benchmark.scenarios import SCENARIOS, run_scenarios
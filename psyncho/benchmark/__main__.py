@@ -0,0 +1,59 @@
+import os
+import sys
+import json
+import shutil
+import tempfile
+import pod
+
+from optparse import OptionParser
+
+from benchmark.tree import TreeSpec
+from benchmark.scenarios import SIDES, run_scenarios
+
+def main():
+    parser= OptionParser("usage: python -m benchmark [options]")
+    parser.add_option("--files", type="int", default=1000, help="Files in generated tree.")
+    parser.add_option("--depth", type="int", default=3, help="Deepest directory level of files.")
+    parser.add_option("--fanout", type="int", default=8, help="Subdirectories of a directory.")
+    parser.add_option("--sizes", help="Size distribution as size:weight,... in bytes.")
+    parser.add_option("--symlink-ratio", type="float", default=0.02, dest="symlink_ratio",
+                      help="Part of files, that also get a link.")
+    parser.add_option("--seed", type="int", default=1, help="Seed of tree generator.")
+    parser.add_option("--fs", action="append", choices=sorted(SIDES),
+                      help="Opener of both sides, can be repeated (default: memory and osfs).")
+    parser.add_option("--index-backend", action="append", choices=["pod", "sqlite"], dest="index_backend",
+                      help="Index backend, can be repeated (default: pod).")
+    parser.add_option("-j", "--jobs", type="int", default=1, help="Directories listed in parallel.")
+    parser.add_option("--copy-jobs", type="int", default=0, dest="copy_jobs", help="Copy worker threads.")
+    parser.add_option("--latency", type="float", help="Seconds every opener call of both sides waits.")
+    parser.add_option("--bandwidth", type="float", help="Bytes per second of file data of every side.")
+    parser.add_option("-o", "--output", help="Write JSON results to file instead of stdout.")
+    (options, args)= parser.parse_args()
+    
+    sizes= None
+    if options.sizes:
+        sizes= [tuple(int(value) for value in pair.split(":")) for pair in options.sizes.split(",")]
+    latency= None
+    if options.latency!=None or options.bandwidth!=None:
+        latency= {"latency": options.latency or 0.0, "bandwidth": options.bandwidth}
+    spec= TreeSpec(options.files, options.depth, options.fanout, sizes, options.symlink_ratio, options.seed)
+    
+    work_dir= tempfile.mkdtemp(prefix= "psyncho-bench-")
+    try:
+        db= pod.Db(file= os.path.join(work_dir, "bench.db"), dynamic_index= True)
+        results= []
+        for fs_name in options.fs or ["memory", "osfs"]:
+            for index_backend in options.index_backend or ["pod"]:
+                results.append(run_scenarios(db, spec, fs_name, index_backend, options.jobs, options.copy_jobs, work_dir,
+                                              latency))
+    finally:
+        shutil.rmtree(work_dir)
+    
+    out= sys.stdout
+    if options.output:
+        out= open(options.output, "w")
+    json.dump(results, out, indent= 2, sort_keys= True)
+    out.write("\n")
+    
+if __name__ == '__main__':
+    main()
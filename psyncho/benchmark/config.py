@@ -0,0 +1,217 @@
+'''
+Micro benchmarks of layered config resolution.
+
+Builds config layer chains with generated literal, {regex} and |regex|
+rules and times status lookups of generated paths. Run from the
+psyncho directory:
+
+    python -m benchmark.config --layers 1,5,20 --rules 10,1000,10000
+'''
+import os
+import sys
+import gc
+import json
+import random
+import shutil
+import resource
+import tempfile
+import pod
+
+from time import time
+from optparse import OptionParser
+
+from lib.psyncho import ConfigLayer, PathStatus
+from lib.rules import InvalidateRules
+
+#Parts of generated rules, the rest are literal ones.
+SEGMENT_RATIO= 0.2
+SUBPATH_RATIO= 0.05
+EXTENSIONS= ["txt", "py", "jpg", "tmp", "log", "o", "c", "h"]
+
+def _dir_name(rnd, fanout):
+    return "d%d" % (rnd.randrange(fanout))
+
+def _file_name(rnd, files):
+    return "f%d.%s" % (rnd.randrange(files), rnd.choice(EXTENSIONS))
+
+def _segment_rule(rnd, fanout):
+    #Matches one path part, like a glob of the configuration.
+    kind= rnd.randrange(3)
+    if kind==0:
+        return "{d%d\d*}" % (rnd.randrange(10))
+    elif kind==1:
+        return "{.*\.%s}" % (rnd.choice(EXTENSIONS))
+    return "{f%d\d}" % (rnd.randrange(10))
+
+def _subpath_rule(rnd, fanout):
+    #Matches rest of the path at once.
+    if rnd.randrange(2):
+        return "|.*?/%s|" % (_dir_name(rnd, fanout))
+    return "|.*?\.%s|" % (rnd.choice(EXTENSIONS))
+
+def generate_rules(rnd, count, depth, fanout):
+    '''
+    @return: (path, PathStatus)[], paths start with root path part
+    '''
+    rules= []
+    for i in xrange(count):
+        path= ["root"]
+        for level in xrange(rnd.randint(1, depth)):
+            path.append(_dir_name(rnd, fanout))
+        kind= rnd.random()
+        if kind<SUBPATH_RATIO:
+            path[-1]= _subpath_rule(rnd, fanout)
+        elif kind<SUBPATH_RATIO+SEGMENT_RATIO:
+            path[-1]= _segment_rule(rnd, fanout)
+        status= rnd.choice([PathStatus.include, PathStatus.include, PathStatus.ignore, PathStatus.ignore, PathStatus.stop])
+        rules.append((path, status))
+    return rules
+
+def generate_paths(rnd, count, depth, fanout, files= 1000):
+    '''
+    Generates paths sorted like a walk of the tree visits them.
+    @return: path[], paths start with root path part
+    '''
+    paths= []
+    for i in xrange(count):
+        path= ["root"]
+        for level in xrange(rnd.randint(0, depth)):
+            path.append(_dir_name(rnd, fanout))
+        path.append(_file_name(rnd, files))
+        paths.append(path)
+    paths.sort()
+    return paths
+
+def build_chain(name, layers, rules, depth, fanout, seed):
+    '''
+    Builds chain of config layers, every one with its own rules.
+    @return: Leaf ConfigLayer
+    '''
+    rnd= random.Random(seed)
+    layer= None
+    for i in xrange(layers):
+        layer= ConfigLayer("%s-%d" % (name, i), None, PathStatus.include if layer==None else PathStatus.undef, layer)
+        for path, status in generate_rules(rnd, rules, depth, fanout):
+            layer.paths.GetPathPart(path, True).PathStatus= status
+    InvalidateRules()
+    return layer
+
+def rss():
+    '''
+    Resident memory of this process, Linux only.
+    @return: Bytes or None
+    '''
+    try:
+        with open("/proc/self/statm") as f:
+            return int(f.read().split()[1])*resource.getpagesize()
+    except (IOError, ValueError, IndexError):
+        return None
+
+def peak_rss():
+    #ru_maxrss is in kilobytes on Linux.
+    return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss*1024
+
+def tree_size(path_part):
+    '''
+    Shallow sizes of all path parts of tree and their attributes.
+    @return: (path parts, bytes)
+    '''
+    count= 0
+    size= 0
+    stack= [path_part]
+    while stack:
+        part= stack.pop()
+        count+= 1
+        size+= sys.getsizeof(part)+sys.getsizeof(part.__dict__)+sys.getsizeof(part.name)
+        size+= sys.getsizeof(part.children)+sys.getsizeof(part.GetChildrenByName())
+        stack.extend(part.children)
+    return (count, size)
+
+def time_lookups(lookup, paths, max_seconds):
+    '''
+    Calls lookup for paths, until all are done or time is up.
+    @return: JSON serializable results
+    '''
+    done= 0
+    start= time()
+    end= start+max_seconds
+    for i in xrange(0, len(paths), 1024):
+        for path in paths[i:i+1024]:
+            lookup(path)
+        done+= len(paths[i:i+1024])
+        if time()>end:
+            break
+    seconds= time()-start
+    return {"lookups": done, "seconds": seconds, "per_second": done/seconds if seconds else None}
+
+def run_chain(layers, rules, paths, depth, fanout, seed, max_seconds):
+    gc.collect()
+    before= rss()
+    start= time()
+    layer= build_chain("bench-%d-%d" % (layers, rules), layers, rules, depth, fanout, seed)
+    built= time()-start
+    gc.collect()
+    after= rss()
+
+    parts= 0
+    size= 0
+    chain= layer
+    while chain:
+        (count, tree_bytes)= tree_size(chain.paths)
+        parts+= count
+        size+= tree_bytes
+        chain= chain.parent
+
+    start= time()
+    compiled= layer.Compiled()
+    compiled_in= time()-start
+    gc.collect()
+    compiled_rss= rss()
+
+    result= {"layers": layers, "rules": rules, "path_parts": parts, "tree_bytes": size,
+             "build_seconds": built, "compile_seconds": compiled_in,
+             "tree_rss": after-before if before!=None and after!=None else None,
+             "compiled_rss": compiled_rss-after if after!=None and compiled_rss!=None else None,
+             "peak_rss": peak_rss()}
+    result["last_part"]= time_lookups(lambda path: layer.paths.GetLastPart(path, True), paths, max_seconds)
+    result["layer"]= time_lookups(lambda path: layer.GetPathStatus(path, True), paths, max_seconds)
+    result["compiled"]= time_lookups(lambda path: compiled.GetPathStatus(path, True), paths, max_seconds)
+    result["peak_rss"]= peak_rss()
+    return result
+
+def _int_list(value):
+    return [int(item) for item in value.split(",")]
+
+def main():
+    parser= OptionParser("usage: python -m benchmark.config [options]")
+    parser.add_option("--layers", default="1,5,20", help="Depths of layer chains, comma separated.")
+    parser.add_option("--rules", default="10,1000,10000", help="Rules of every layer, comma separated.")
+    parser.add_option("--paths", type="int", default=1000000, help="Looked up paths.")
+    parser.add_option("--depth", type="int", default=6, help="Deepest directory level of rules and paths.")
+    parser.add_option("--fanout", type="int", default=20, help="Directory names of a level.")
+    parser.add_option("--seed", type="int", default=1, help="Seed of rule and path generators.")
+    parser.add_option("--max-seconds", type="float", default=10.0, dest="max_seconds",
+                      help="Time limit of one kind of lookups, slow ones do not get through all paths.")
+    parser.add_option("-o", "--output", help="Write JSON results to file instead of stdout.")
+    (options, args)= parser.parse_args()
+
+    paths= generate_paths(random.Random(options.seed), options.paths, options.depth, options.fanout)
+    work_dir= tempfile.mkdtemp(prefix= "psyncho-bench-")
+    try:
+        db= pod.Db(file= os.path.join(work_dir, "bench.db"), dynamic_index= True)
+        results= []
+        for layers in _int_list(options.layers):
+            for rules in _int_list(options.rules):
+                results.append(run_chain(layers, rules, paths, options.depth, options.fanout,
+                                         options.seed, options.max_seconds))
+    finally:
+        shutil.rmtree(work_dir)
+
+    out= sys.stdout
+    if options.output:
+        out= open(options.output, "w")
+    json.dump(results, out, indent= 2, sort_keys= True)
+    out.write("\n")
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,148 @@
+import os
+
+from time import time
+from threading import Lock
+
+from fs.wrapfs import WrapFS
+
+#Opener calls, that MeteredFS counts.
+COUNTED= ["listdir", "listdirinfo", "getinfo", "exists", "isdir", "isfile", "open",
+          "makedir", "remove", "removedir", "rename", "chmod", "symlink", "readlink", "opendir"]
+
+def read_proc_io():
+    '''
+    I/O counters of this process, Linux only.
+    @return: {name: value} or None
+    '''
+    try:
+        with open("/proc/self/io") as f:
+            return dict((name, int(value)) for name, value in (line.split(":") for line in f))
+    except (IOError, ValueError):
+        return None
+
+class Counters(object):
+    '''
+    Opener calls and bytes of all MeteredFS views of one side.
+    '''
+    def __init__(self):
+        self.lock= Lock()
+        self.calls= {}
+        self.bytes_read= 0
+        self.bytes_written= 0
+
+    def Call(self, name):
+        with self.lock:
+            self.calls[name]= self.calls.get(name, 0)+1
+
+    def Bytes(self, read= 0, written= 0):
+        with self.lock:
+            self.bytes_read+= read
+            self.bytes_written+= written
+
+    def Snapshot(self):
+        with self.lock:
+            return (dict(self.calls), self.bytes_read, self.bytes_written)
+
+class MeteredFile(object):
+    def __init__(self, f, counters):
+        self.f= f
+        self.counters= counters
+
+    def read(self, *args):
+        data= self.f.read(*args)
+        self.counters.Bytes(read= len(data))
+        return data
+
+    def write(self, data):
+        self.counters.Bytes(written= len(data))
+        return self.f.write(data)
+
+    def __getattr__(self, name):
+        return getattr(self.f, name)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *args):
+        self.f.close()
+
+def _counted(name):
+    def call(self, *args, **kwds):
+        self.counters.Call(name)
+        return getattr(WrapFS, name)(self, *args, **kwds)
+    call.__name__= name
+    return call
+
+class MeteredFS(WrapFS):
+    '''
+    Counts opener calls and bytes of opened files. Local listings and
+    copies go around it through system paths, /proc counters see those.
+
+    Subdirectories are metered views of the wrapped opener subdirectory,
+    so calls of the forked pyfilesystem (chmod, symlink, readlink) keep
+    their paths. On openers without them chmod does nothing.
+    '''
+    def __init__(self, fs, counters= None):
+        WrapFS.__init__(self, fs)
+        self.counters= counters or Counters()
+
+    def _file_wrap(self, f, mode):
+        return MeteredFile(f, self.counters)
+
+    def opendir(self, path):
+        self.counters.Call("opendir")
+        return MeteredFS(self.wrapped_fs.opendir(path), self.counters)
+
+    def chmod(self, path, mode):
+        self.counters.Call("chmod")
+        if hasattr(self.wrapped_fs, "chmod"):
+            self.wrapped_fs.chmod(path, mode)
+
+    def symlink(self, target, path):
+        self.counters.Call("symlink")
+        self.wrapped_fs.symlink(target, path)
+
+    def readlink(self, path):
+        self.counters.Call("readlink")
+        return self.wrapped_fs.readlink(path)
+
+for _name in COUNTED:
+    if _name not in MeteredFS.__dict__:
+        setattr(MeteredFS, _name, _counted(_name))
+
+class Meter(object):
+    '''
+    Measures one phase: wall time, /proc I/O counters and opener calls
+    of metered sides.
+    '''
+    def __init__(self, sides):
+        '''
+        @param sides: {name: MeteredFS}
+        '''
+        self.sides= sides
+
+    def Start(self):
+        self.start= (time(), read_proc_io(), dict((name, fs.counters.Snapshot()) for name, fs in self.sides.items()))
+
+    def Stop(self):
+        '''
+        @return: dict of differences since Start
+        '''
+        (start_time, start_io, start_sides)= self.start
+        result= {"wall": time()-start_time}
+        io= read_proc_io()
+        if io!=None and start_io!=None:
+            result["syscalls"]= {"read": io["syscr"]-start_io["syscr"], "write": io["syscw"]-start_io["syscw"]}
+            result["bytes"]= {"read": io["rchar"]-start_io["rchar"], "written": io["wchar"]-start_io["wchar"]}
+        else:
+            result["syscalls"]= None
+            result["bytes"]= {}
+        result["fs_calls"]= {}
+        for name, fs in self.sides.items():
+            (calls, bytes_read, bytes_written)= fs.counters.Snapshot()
+            (start_calls, start_read, start_written)= start_sides[name]
+            result["fs_calls"][name]= dict((call, count-start_calls.get(call, 0)) for call, count in calls.items()
+                                           if count!=start_calls.get(call, 0))
+            result["bytes"][name+"_read"]= bytes_read-start_read
+            result["bytes"][name+"_written"]= bytes_written-start_written
+        return result
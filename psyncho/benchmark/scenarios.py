@@ -0,0 +1,102 @@
+import os
+import shutil
+import tempfile
+
+from datetime import datetime
+
+from fs.osfs import OSFS
+from fs.memoryfs import MemoryFS
+
+from lib.psyncho import FileSync, FileSyncConfig, ConfigLayer, PathStatus
+from lib.index_store import IndexStore
+from lib.latency import LatencyFS
+from benchmark.tree import generate_tree, change_files, rename_dirs
+from benchmark.metrics import MeteredFS, Meter
+
+def _unchanged(sides, files):
+    pass
+
+def _change(sides, files):
+    change_files(sides["src"], files, 0.01)
+
+def _rename(sides, files):
+    rename_dirs(sides["src"])
+
+#Scenarios run in this order on the same pair of sides.
+SCENARIOS= [("cold", _unchanged), ("noop", _unchanged), ("change_1pct", _change), ("mass_rename", _rename)]
+
+class MemorySides(object):
+    def Open(self):
+        return (MemoryFS(), MemoryFS())
+
+    def Close(self):
+        pass
+
+class OSFSSides(object):
+    def Open(self):
+        self.root= tempfile.mkdtemp(prefix= "psyncho-bench-")
+        for side in ["src", "dst"]:
+            os.mkdir(os.path.join(self.root, side))
+        return (OSFS(os.path.join(self.root, "src")), OSFS(os.path.join(self.root, "dst")))
+
+    def Close(self):
+        shutil.rmtree(self.root)
+
+SIDES= {"memory": MemorySides, "osfs": OSFSSides}
+
+def _phase(file_sync, src, dst, meter):
+    #Times plan and execute of one synch separately.
+    file_sync.start_time= datetime.now()
+    meter.Start()
+    plan= file_sync.Plan(src, dst, ["root"], False)
+    planned= meter.Stop()
+    meter.Start()
+    file_sync.Execute(plan, src, dst, False)
+    executed= meter.Stop()
+    (counts, size)= plan.Summary()
+    return {"plan": planned, "execute": executed, "wall": planned["wall"]+executed["wall"],
+            "actions": counts, "planned_bytes": size}
+
+def run_scenarios(db, spec, fs_name= "memory", index_backend= "pod", jobs= 1, copy_jobs= 0, work_dir= None,
+                  latency= None):
+    '''
+    Generates tree of spec on source side and runs all scenarios.
+    @param db: Throwaway pod.Db for configs and pod indexes, they are not deleted
+    @param fs_name: Key of SIDES
+    @param work_dir: Directory for sqlite index, temp directory when None
+    @param latency: Keyword arguments of LatencyFS, both sides behave like
+                    remote ones with them, None for sides as they are
+    @return: JSON serializable results
+    '''
+    sides= SIDES[fs_name]()
+    (src, dst)= sides.Open()
+    if latency!=None:
+        (src, dst)= (LatencyFS(src, **latency), LatencyFS(dst, **latency))
+    metered= {"src": MeteredFS(src), "dst": MeteredFS(dst)}
+    index_dir= work_dir or tempfile.mkdtemp(prefix= "psyncho-bench-index-")
+    index_store= None
+    name= "bench-%s-%s-%d" % (fs_name, index_backend, spec.seed)
+    if index_backend=="sqlite":
+        index_store= IndexStore(os.path.join(index_dir, name+".db"))
+    layer= ConfigLayer(name, None, PathStatus.include)
+    fsc= FileSyncConfig(fs_name+":src", fs_name+":dst", layer, name, index_backend)
+    results= {"fs": fs_name, "index_backend": index_backend, "jobs": jobs, "copy_jobs": copy_jobs,
+              "latency": latency, "tree": spec.ToDict(), "scenarios": []}
+    try:
+        files= generate_tree(metered["src"], spec)
+        file_sync= FileSync(fsc, db, index_store)
+        file_sync.jobs= jobs
+        file_sync.copy_jobs= copy_jobs
+        meter= Meter(metered)
+        for scenario, prepare in SCENARIOS:
+            prepare(metered, files)
+            result= _phase(file_sync, metered["src"], metered["dst"], meter)
+            result["scenario"]= scenario
+            results["scenarios"].append(result)
+    finally:
+        if index_store:
+            index_store.Close()
+        if work_dir==None:
+            shutil.rmtree(index_dir)
+        sides.Close()
+    return results
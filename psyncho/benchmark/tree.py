@@ -0,0 +1,93 @@
+import random
+
+from fs.wrapfs import WrapFS
+
+#(size, weight) pairs, most files are small and a few are large.
+DEFAULT_SIZES= [(0, 5), (512, 40), (4*1024, 35), (64*1024, 15), (1024*1024, 5)]
+
+class TreeSpec(object):
+    '''
+    Shape of a generated tree. Same spec and seed always make the same tree.
+    '''
+    def __init__(self, files= 1000, depth= 3, fanout= 8, sizes= None, symlink_ratio= 0.02, seed= 1):
+        '''
+        @param files: Number of files
+        @param depth: Deepest directory level of files, 0 puts all of them in root
+        @param fanout: Subdirectories of a directory
+        @param sizes: (size, weight)[], a file gets between half and all
+                      of a size picked by weight
+        @param symlink_ratio: Part of files, that also get a link to them
+        '''
+        self.files= files
+        self.depth= depth
+        self.fanout= fanout
+        self.sizes= sizes or DEFAULT_SIZES
+        self.symlink_ratio= symlink_ratio
+        self.seed= seed
+
+    def PickSize(self, rng):
+        total= sum(weight for size, weight in self.sizes)
+        pick= rng.uniform(0, total)
+        for size, weight in self.sizes:
+            pick-= weight
+            if pick<=0:
+                break
+        return rng.randint(size//2, size)
+
+    def ToDict(self):
+        return {"files": self.files, "depth": self.depth, "fanout": self.fanout,
+                "sizes": self.sizes, "symlink_ratio": self.symlink_ratio, "seed": self.seed}
+
+def file_data(path, size):
+    line= "%s\n" % (path)
+    return (line*(size//len(line)+1))[:size]
+
+def has_links(fs):
+    while isinstance(fs, WrapFS):
+        fs= fs.wrapped_fs
+    return hasattr(fs, "symlink")
+
+def generate_tree(fs, spec):
+    '''
+    Makes files of spec in fs. Links are only made when opener has symlink.
+    @return: paths of files, links not included
+    '''
+    rng= random.Random(spec.seed)
+    links= has_links(fs)
+    dirs= set([""])
+    files= []
+    for number in range(spec.files):
+        parts= ["d%02d" % (rng.randrange(spec.fanout)) for level in range(rng.randint(0, spec.depth))]
+        dir_path= "/".join(parts)
+        if dir_path not in dirs:
+            fs.makedir(dir_path, recursive= True, allow_recreate= True)
+            dirs.add(dir_path)
+        name= "f%06d.dat" % (number)
+        path= dir_path+"/"+name if dir_path else name
+        fs.setcontents(path, file_data(path, spec.PickSize(rng)))
+        files.append(path)
+        if rng.random()<spec.symlink_ratio and links:
+            fs.symlink(name, path+".lnk")
+    return files
+
+def change_files(fs, files, ratio, seed= 2):
+    '''
+    Rewrites part of files with longer content.
+    @return: paths of changed files
+    '''
+    rng= random.Random(seed)
+    changed= rng.sample(files, max(1, int(len(files)*ratio)))
+    for path in changed:
+        fs.setcontents(path, fs.getcontents(path)+"changed\n")
+    return changed
+
+def rename_dirs(fs):
+    '''
+    Renames every top level directory.
+    @return: (old, new)[] names
+    '''
+    renamed= []
+    for name in sorted(fs.listdir(dirs_only= True)):
+        fs.rename(name, name+"_renamed")
+        renamed.append((name, name+"_renamed"))
+    return renamed
@@ -4,6 +4,7 @@ from optparse import OptionParser
 import cProfile
 
 from lib.command import PsynchoCommand
+from lib.compression import codec_names
 
 def main():
     usage = "usage: psyncho [options] args"
@@ -18,6 +19,8 @@ def main():
                       help="Deletes config layer, args: name", action="store_true", dest="del_config_layer")
     parser.add_option("--del-indexes",
                       help="Deletes indexes, args: name", action="store_true", dest="del_indexes")
+    parser.add_option("--upgrade-db",
+                      help="Upgrades config file made by older version.", action="store_true", dest="upgrade_db")
     parser.add_option("--rename-config-layer",
                       help="Deletes config layer, args: name", action="store_true", dest="rename_config_layer")
     parser.add_option("--dup-config-layer",
@@ -32,10 +35,38 @@ def main():
                       help="Deletes path startus, args: path", action="store_true", dest="del_path_status")
     parser.add_option("--new-synch",
                       help="Adds new synch, args: name, src, dst, [config_name]", action="store_true", dest="new_synch")
+    parser.add_option("--index-backend", default="pod", choices=["pod", "sqlite"],
+                      help="Where new synch keeps file indexes, pod objects or sqlite table.", dest="index_backend")
+    parser.add_option("--compression",
+                      help="Compression of new synch for sides served by psyncho-agent, like zlib:6 (codecs: %s)." % (", ".join(codec_names())), dest="compression")
     parser.add_option("--print-synch",
                       help="Prints all synch configs.", action="store_true", dest="print_synch")
     parser.add_option("-s", "--synch",
                       help="Starts sync, args: name, [base_path]", action="store_true", dest="synch")
+    parser.add_option("-w", "--watch",
+                      help="Synchs and keeps synching changed directories until interrupted, args: name", action="store_true", dest="watch")
+    parser.add_option("--settle", type="float", default=1.0,
+                      help="Seconds without changes before watch synchs them.", dest="settle")
+    parser.add_option("-j", "--jobs", type="int", default=1,
+                      help="Number of threads listing directories while synching.", dest="jobs")
+    parser.add_option("--copy-jobs", type="int", default=0,
+                      help="Number of threads copying files while synching.", dest="copy_jobs")
+    parser.add_option("--delta-threshold", type="int",
+                      help="Updates files of at least this many bytes by writing only changed blocks.", dest="delta_threshold")
+    parser.add_option("--compact-index",
+                      help="Loads file indexes into compact arrays before synching, uses less memory on large trees.", action="store_true", dest="compact_index")
+    parser.add_option("--dry-run",
+                      help="Prints what synch would do, without changing anything.", action="store_true", dest="dry_run")
+    parser.add_option("--plan-file",
+                      help="Writes plan of a dry run to file instead of printing it.", dest="plan_file")
+    parser.add_option("--resume",
+                      help="Continues stopped synch from its last checkpoint.", action="store_true", dest="resume")
+    parser.add_option("--time-budget", type="float",
+                      help="Seconds after which synch stops at a checkpoint, continue it with --resume.", dest="time_budget")
+    parser.add_option("--index-batch-size", type="int", default=1000,
+                      help="Number of sqlite index changes written in one batch.", dest="index_batch_size")
+    parser.add_option("--index-latency", type="float", default=1.0,
+                      help="Seconds after which sqlite index changes are written, even if batch is not full.", dest="index_latency")
     parser.add_option("-i", "--init",
                       help="Initializes sync in current folder, args: name", action="store_true", dest="init")
     parser.add_option("-a", "--add",
@@ -56,12 +87,12 @@ def main():
     ps= None
     if options.config_file:
         print "Config file "+options.config_file
-        ps= PsynchoCommand(options.config_file)
+        ps= PsynchoCommand(options.config_file, options.index_batch_size, options.index_latency)
     elif curr_path:
         print "Config file "+curr_path+"/psyncho_config.db"
-        ps= PsynchoCommand(curr_path+"/psyncho_config.db")
+        ps= PsynchoCommand(curr_path+"/psyncho_config.db", options.index_batch_size, options.index_latency)
     else:
-        ps= PsynchoCommand()
+        ps= PsynchoCommand("psyncho_config.db", options.index_batch_size, options.index_latency)
         
     if options.new_config_layer and len(args)>0:
         name= args[0]
@@ -81,6 +112,8 @@ def main():
     elif options.del_indexes and len(args)>0:
         name= args[0]
         ps.ClearIndexes(name)
+    elif options.upgrade_db:
+        ps.UpgradeDb()
     elif options.dup_config_layer and len(args)>0:
         name= args[0]
         ps.DuplicateConfig(name)
@@ -108,7 +141,7 @@ def main():
         src= args[1]
         dst= args[2]
         config_name= args[3]
-        ps.NewSynch( name, src, dst, config_name )  
+        ps.NewSynch( name, src, dst, config_name, options.index_backend, options.compression )  
     elif options.print_synch:
         print ps.GenSynchList()
     elif options.synch and len(args)>0:
@@ -116,7 +149,13 @@ def main():
         path= "root"
         if len(args)>1:
             path= args[1]
-        ps.Synch(name,path)
+        ps.Synch(name,path,options.jobs,options.copy_jobs,options.dry_run,options.plan_file,options.compact_index,options.delta_threshold,options.resume,options.time_budget)
+    elif options.watch and len(args)>0:
+        name= args[0]
+        try:
+            ps.Watch(name,options.jobs,options.copy_jobs,options.compact_index,options.delta_threshold,options.settle)
+        except KeyboardInterrupt:
+            pass
     elif options.init:
         open('.psyncho', 'w').close() 
     elif options.add and len(args)>2:
@@ -0,0 +1,808 @@
+import os
+import sys
+import stat
+import errno
+import shutil
+import struct
+import marshal
+import fnmatch
+import subprocess
+
+from datetime import datetime
+from threading import RLock
+from urlparse import urlparse
+
+from fs.base import FS
+from fs.osfs import OSFS
+from fs.path import normpath, pathjoin, dirname, abspath
+from fs.errors import FSError, ResourceNotFoundError, ParentDirectoryMissingError, ResourceInvalidError, \
+                      PermissionDeniedError, DestinationExistsError, convert_os_errors
+from fs.opener import opener, Opener
+
+from extra import is_dir, name_key
+from merkle import dir_digest
+from compression import MIN_SIZE, get_codec, is_compressed_name
+from delta import signatures, make_delta, apply_delta
+
+#Read, that fits in one reply, is also the first read of a file.
+CHUNK_SIZE= 1024*1024
+#Entries streamed in one frame of a scan.
+SCAN_BATCH= 1000
+#Writes sent before their replies are read, replies must not fill the pipe.
+MAX_UNACKED= 64
+
+_frame= struct.Struct("!I")
+#Length bit of frames, that are compressed by the link codec.
+COMPRESSED= 1<<31
+
+#Stat fields of an entry, in the order they are sent.
+STAT_FIELDS= ("st_mode", "st_size", "st_ino", "st_dev", "st_nlink", "st_uid", "st_gid",
+              "st_atime", "st_mtime", "st_ctime")
+
+def write_frame(out, message, codec= None):
+    '''
+    @param codec: Codec of the link, or None to send frame as it is
+    @return: Bytes written
+    '''
+    data= marshal.dumps(message, 2)
+    length= len(data)
+    if codec!=None and len(data)>=MIN_SIZE:
+        try:
+            compressed= codec.Compress(data)
+        except Exception, e:
+            raise IOError(errno.EPROTO, "Can't compress frame: %s" % (e))
+        if len(compressed)<len(data):
+            data= compressed
+            length= len(data) | COMPRESSED
+    out.write(_frame.pack(length))
+    out.write(data)
+    return _frame.size+len(data)
+
+def read_frame(inp, codec= None):
+    '''
+    @return: (message, bytes read), message is None at end of stream
+    '''
+    header= inp.read(_frame.size)
+    if len(header)<_frame.size:
+        return (None, len(header))
+    (length,)= _frame.unpack(header)
+    compressed= length & COMPRESSED
+    length&= ~COMPRESSED
+    data= inp.read(length)
+    if len(data)<length:
+        raise IOError(errno.EPIPE, "Agent stream was cut")
+    size= _frame.size+length
+    if compressed:
+        if codec==None:
+            raise IOError(errno.EPROTO, "Compressed frame without a codec")
+        #Codecs can be registered, so any of their errors is a bad frame.
+        try:
+            data= codec.Decompress(data)
+        except Exception, e:
+            raise IOError(errno.EPROTO, "Can't decompress frame: %s" % (e))
+    return (marshal.loads(data), size)
+
+#Errno of opener errors, so clients get them back as the same opener errors.
+_FS_ERRNO= [(ResourceNotFoundError, errno.ENOENT), (ParentDirectoryMissingError, errno.ENOENT),
+            (ResourceInvalidError, errno.EISDIR), (PermissionDeniedError, errno.EACCES),
+            (DestinationExistsError, errno.EEXIST)]
+
+def fs_error_errno(error):
+    for cls, number in _FS_ERRNO:
+        if isinstance(error, cls):
+            return number
+    return getattr(error, "errno", None) or errno.EIO
+
+def stat_entry(name, stats):
+    return (name,)+tuple(getattr(stats, field) for field in STAT_FIELDS)
+
+def entry_info(entry):
+    '''
+    Makes info dict of the same shape as listing.stat_to_info.
+    @return: (name, info)
+    '''
+    info= dict(zip(STAT_FIELDS, entry[1:]))
+    info['size']= info['st_size']
+    info['created_time']= datetime.fromtimestamp(info['st_ctime'])
+    info['accessed_time']= datetime.fromtimestamp(info['st_atime'])
+    info['modified_time']= datetime.fromtimestamp(info['st_mtime'])
+    return (entry[0], info)
+
+class Agent(object):
+    '''
+    Serves one directory tree over a pair of pipes, usually stdin and
+    stdout of psyncho-agent started by ssh or as a local subprocess.
+
+    Every request is one frame and gets one reply frame, except scan,
+    that streams listings of a whole subtree. Requests are handled in
+    order, so the client can send writes without waiting for replies.
+    '''
+    def __init__(self, root, inp, out):
+        self.root= os.path.abspath(root)
+        self.inp= inp
+        self.out= out
+        self.files= {} # handle: fd
+        self.plain= set() # Handles of compressed files, they are sent as they are.
+        self.next_handle= 0
+        self.codec= None
+        self.digests= None # Directory digests, until something changes.
+        self.local= None # OSFS of root for delta requests.
+
+    def _Path(self, path):
+        if isinstance(path, unicode):
+            path= path.encode("utf-8")
+        path= normpath(path).lstrip("/")
+        if path.startswith("../") or path=="..":
+            raise OSError(errno.EACCES, "Path is outside of agent root", path)
+        return os.path.join(self.root, path)
+
+    def Serve(self):
+        while True:
+            try:
+                (request, size)= read_frame(self.inp, self.codec)
+            except IOError, e:
+                #Bad frame was read whole, so the stream goes on.
+                if e.errno!=errno.EPROTO:
+                    raise
+                write_frame(self.out, ("error", e.errno, str(e.strerror), None))
+                self.out.flush()
+                continue
+            if request==None:
+                break
+            handler= getattr(self, "_Do_"+request[0], None)
+            try:
+                if handler==None:
+                    raise OSError(errno.ENOSYS, "Unknown request %s" % (request[0],))
+                reply= ("ok", handler(*request[1:]))
+            except (OSError, IOError), e:
+                reply= ("error", e.errno or 0, str(e.strerror or e), e.filename)
+            except FSError, e:
+                #Delta requests work on OSFS of root.
+                reply= ("error", fs_error_errno(e), str(e), getattr(e, "path", None))
+            try:
+                write_frame(self.out, reply, self._Codec(request))
+            except IOError, e:
+                #Codec fails before anything is written.
+                if e.errno!=errno.EPROTO:
+                    raise
+                write_frame(self.out, ("error", e.errno, str(e.strerror), None))
+            self.out.flush()
+        for fd in self.files.values():
+            os.close(fd)
+
+    def _Codec(self, request):
+        #Codec of reply, file data is not compressed again.
+        if request[0]=="read" and request[1] in self.plain:
+            return None
+        if request[0]=="open" and is_compressed_name(request[1]):
+            return None
+        return self.codec
+
+    def _Do_codec(self, spec):
+        try:
+            self.codec= get_codec(spec)
+        except ValueError, e:
+            raise OSError(errno.ENOTSUP, str(e))
+
+    def _List(self, sys_path):
+        entries= []
+        for name in os.listdir(sys_path):
+            try: stats= os.lstat(os.path.join(sys_path, name))
+            except OSError: continue #Removed while we were listing.
+            entries.append(stat_entry(name_key(name), stats))
+        return entries
+
+    def _Do_list(self, path):
+        return self._List(self._Path(path))
+
+    def _Do_scan(self, path):
+        #Streams (relative path, entries)[] frames of every directory.
+        base= normpath(path).strip("/")
+        batch= []
+        count= 0
+        stack= [base]
+        while stack:
+            rel= stack.pop()
+            try:
+                entries= self._List(self._Path(rel))
+            except OSError:
+                if rel==base:
+                    raise
+                continue
+            batch.append((rel, entries))
+            count+= len(entries)+1
+            for entry in reversed(entries):
+                if stat.S_ISDIR(entry[1]):
+                    stack.append(pathjoin(rel, entry[0]).lstrip("/"))
+            if count>=SCAN_BATCH:
+                write_frame(self.out, ("dirs", batch), self.codec)
+                batch= []
+                count= 0
+        write_frame(self.out, ("dirs", batch), self.codec)
+
+    def _Do_stat(self, path):
+        return stat_entry("", os.lstat(self._Path(path)))
+
+    def _Do_open(self, path, flags, prefetch):
+        #@return: (handle, first data), handle is None when data is all of file.
+        if flags & (os.O_WRONLY | os.O_RDWR):
+            self.digests= None
+        fd= os.open(self._Path(path), flags, 0666)
+        data= ""
+        if prefetch:
+            data= os.read(fd, prefetch)
+            if len(data)<prefetch and not flags & (os.O_WRONLY | os.O_RDWR):
+                os.close(fd)
+                return (None, data)
+        self.next_handle+= 1
+        self.files[self.next_handle]= fd
+        if is_compressed_name(path):
+            self.plain.add(self.next_handle)
+        return (self.next_handle, data)
+
+    def _Do_read(self, handle, offset, size):
+        fd= self.files[handle]
+        os.lseek(fd, offset, os.SEEK_SET)
+        return os.read(fd, size)
+
+    def _Do_write(self, handle, offset, data):
+        fd= self.files[handle]
+        os.lseek(fd, offset, os.SEEK_SET)
+        while data:
+            data= data[os.write(fd, data):]
+
+    def _Do_truncate(self, handle, size):
+        os.ftruncate(self.files[handle], size)
+
+    def _Do_close(self, handle):
+        os.close(self.files.pop(handle))
+        self.plain.discard(handle)
+
+    def _Do_makedir(self, path, recursive, allow_recreate):
+        self.digests= None
+        sys_path= self._Path(path)
+        if allow_recreate and os.path.isdir(sys_path):
+            return
+        if recursive:
+            os.makedirs(sys_path)
+        else:
+            os.mkdir(sys_path)
+
+    def _Do_remove(self, path):
+        self.digests= None
+        os.remove(self._Path(path))
+
+    def _Do_removedir(self, path, force):
+        self.digests= None
+        if force:
+            shutil.rmtree(self._Path(path))
+        else:
+            os.rmdir(self._Path(path))
+
+    def _Do_rename(self, path, new_path):
+        self.digests= None
+        os.rename(self._Path(path), self._Path(new_path))
+
+    def _Do_chmod(self, path, mode):
+        self.digests= None
+        sys_path= self._Path(path)
+        #Links have no mode of their own.
+        if not os.path.islink(sys_path):
+            os.chmod(sys_path, mode)
+
+    def _Do_symlink(self, target, path):
+        self.digests= None
+        if isinstance(target, unicode):
+            target= target.encode("utf-8")
+        os.symlink(target, self._Path(path))
+
+    def _Do_readlink(self, path):
+        return os.readlink(self._Path(path))
+
+    def _Local(self, path):
+        #@return: (OSFS of root, path in it) for functions working on openers.
+        self._Path(path)
+        if self.local==None:
+            self.local= OSFS(self.root)
+        return (self.local, normpath(path).lstrip("/"))
+
+    def _Do_signatures(self, path, block_size):
+        (fs, path)= self._Local(path)
+        return signatures(fs, path, block_size)
+
+    def _Do_delta(self, path, sigs, block_size, max_literal):
+        (fs, path)= self._Local(path)
+        return make_delta(fs, path, sigs, block_size, max_literal)
+
+    def _Do_patch(self, path, ops, block_size):
+        self.digests= None
+        (fs, path)= self._Local(path)
+        apply_delta(fs, path, ops, block_size)
+
+    def _Do_digest(self, path):
+        #Digests of all directories are made in one pass and kept.
+        if self.digests==None:
+            self.digests= {}
+            self._Digest(self.root, ())
+        return self.digests.get(tuple(path[1:]))
+
+    def _Digest(self, sys_path, path):
+        entries= [entry_info(entry) for entry in self._List(sys_path)]
+        subdir_digests= {}
+        for name, info in entries:
+            if is_dir(info):
+                subdir_digests[name]= self._Digest(os.path.join(sys_path, name), path+(name,))
+        digest= dir_digest(entries, subdir_digests)
+        self.digests[path]= digest
+        return digest
+
+class AgentError(IOError):
+    pass
+
+class AgentConnection(object):
+    '''
+    Client end of psyncho-agent pipes, shared by all AgentFS views of
+    one tree. Calls from several threads are serialized.
+    '''
+    def __init__(self, command):
+        self.process= subprocess.Popen(command, stdin=subprocess.PIPE, stdout=subprocess.PIPE, bufsize=64*1024)
+        self.lock= RLock()
+        self.unacked= [] # Handles of sent writes, whose replies were not read.
+        self.failed= {} # handle: first failed reply of its writes
+        self.listings= {} # Scanned directories, until they are listed.
+        self.scan= True # First listing scans the whole subtree.
+        self.scanned= []
+        self.codec= None
+        #Bytes, that went through the pipes.
+        self.sent= 0
+        self.received= 0
+
+    def SetCodec(self, spec):
+        '''
+        Compresses frames of the link, when agent knows the codec.
+        @param spec: Codec spec of compression.get_codec
+        @return: True when link is compressed
+        '''
+        codec= get_codec(spec)
+        try:
+            self.Call("codec", spec)
+        except OSError, e:
+            if e.errno!=errno.ENOTSUP:
+                raise
+            return False
+        self.codec= codec
+        return codec!=None
+
+    def _Write(self, request, compress= True):
+        codec= self.codec
+        if not compress:
+            codec= None
+        self.sent+= write_frame(self.process.stdin, request, codec)
+
+    def _Receive(self):
+        (reply, size)= read_frame(self.process.stdout, self.codec)
+        self.received+= size
+        if reply==None:
+            raise AgentError(errno.EPIPE, "Agent has exited")
+        return reply
+
+    def _Result(self, reply):
+        if reply[0]=="error":
+            raise OSError(reply[1], reply[2], reply[3])
+        return reply[1]
+
+    def _Drain(self):
+        #Replies of sent writes, failures are kept for files, that sent
+        #them, other threads' calls must not get them.
+        while self.unacked:
+            handle= self.unacked.pop(0)
+            reply= self._Receive()
+            if reply[0]=="error":
+                self.failed.setdefault(handle, reply)
+
+    def Send(self, handle, request, compress= True):
+        '''
+        Sends request of file without waiting for its reply. Its error
+        is raised by Raise of the handle.
+        @param compress: False sends request uncompressed
+        '''
+        with self.lock:
+            self._Write(request, compress)
+            self.unacked.append(handle)
+            if len(self.unacked)>=MAX_UNACKED:
+                self.process.stdin.flush()
+                self._Drain()
+
+    def Raise(self, handle):
+        '''
+        Raises the first failed request sent for handle, whose reply
+        came already, and forgets it.
+        '''
+        with self.lock:
+            failed= self.failed.pop(handle, None)
+        if failed!=None:
+            self._Result(failed)
+
+    def Call(self, *request):
+        with self.lock:
+            self._Write(request)
+            self.process.stdin.flush()
+            self._Drain()
+            return self._Result(self._Receive())
+
+    def Scan(self, path):
+        '''
+        Keeps listings of every directory under path, so they are not
+        requested one by one.
+        '''
+        with self.lock:
+            self._Write(("scan", path))
+            self.process.stdin.flush()
+            self._Drain()
+            while True:
+                reply= self._Receive()
+                if reply[0]!="dirs":
+                    self._Result(reply)
+                    break
+                for rel, entries in reply[1]:
+                    self.listings[rel]= entries
+            self.scanned.append(path)
+
+    def List(self, path):
+        '''
+        @return: entries of directory
+        '''
+        with self.lock:
+            scanned= [root for root in self.scanned if path==root or root=="" or path.startswith(root+"/")]
+            if not scanned and self.scan:
+                self.Scan(path)
+            #Listing is used once, later listings must see changes.
+            entries= self.listings.pop(path, None)
+            if entries==None:
+                entries= self.Call("list", path)
+            return entries
+
+    def Changed(self, path):
+        '''
+        Drops kept listings of path, its parent and everything under it.
+        '''
+        with self.lock:
+            self.listings.pop(dirname(path).strip("/"), None)
+            for rel in [rel for rel in self.listings if rel==path or rel.startswith(path+"/")]:
+                del self.listings[rel]
+
+    def Close(self):
+        with self.lock:
+            if self.process.poll()==None:
+                self._Drain()
+                self.process.stdin.close()
+                self.process.wait()
+
+class AgentFile(object):
+    '''
+    File opened through an agent. Reads are done in large chunks and
+    writes are buffered and sent without waiting for replies, their
+    failures are raised by flush or close of the file.
+    '''
+    def __init__(self, connection, handle, data, path):
+        self.connection= connection
+        self.handle= handle
+        self.path= path
+        self.pos= 0
+        self.plain= is_compressed_name(path)
+        self.read_buffer= (0, data)
+        self.write_start= 0
+        self.write_buffer= []
+        self.write_size= 0
+
+    def read(self, size= -1):
+        self.flush()
+        parts= []
+        while size!=0:
+            (start, data)= self.read_buffer
+            if start<=self.pos<start+len(data):
+                part= data[self.pos-start:]
+                if size>0:
+                    part= part[:size]
+                    size-= len(part)
+                parts.append(part)
+                self.pos+= len(part)
+                continue
+            if self.handle==None:
+                break
+            data= self.connection.Call("read", self.handle, self.pos, max(size, CHUNK_SIZE))
+            self.read_buffer= (self.pos, data)
+            if not data:
+                break
+        return "".join(parts)
+
+    def write(self, data):
+        if self.write_buffer and self.write_start+self.write_size!=self.pos:
+            self.flush()
+        if not self.write_buffer:
+            self.write_start= self.pos
+        self.write_buffer.append(data)
+        self.write_size+= len(data)
+        self.pos+= len(data)
+        self.read_buffer= (0, "")
+        if self.write_size>=CHUNK_SIZE:
+            self.flush()
+
+    def _Send(self):
+        if self.write_buffer:
+            self.connection.Send(self.handle, ("write", self.handle, self.write_start, "".join(self.write_buffer)), not self.plain)
+            self.write_buffer= []
+            self.write_size= 0
+
+    def flush(self):
+        '''
+        Sends buffered writes and raises failure of earlier ones, whose
+        replies came already.
+        '''
+        self._Send()
+        if self.handle!=None:
+            self.connection.Raise(self.handle)
+
+    def seek(self, offset, whence= os.SEEK_SET):
+        if whence==os.SEEK_CUR:
+            offset+= self.pos
+        elif whence==os.SEEK_END:
+            self.flush()
+            offset+= self.connection.Call("stat", self.path)[STAT_FIELDS.index("st_size")+1]
+        self.pos= offset
+
+    def tell(self):
+        return self.pos
+
+    def truncate(self, size= None):
+        self.flush()
+        if size==None:
+            size= self.pos
+        self.connection.Call("truncate", self.handle, size)
+        self.read_buffer= (0, "")
+
+    def close(self):
+        '''
+        Closes the handle, when any of its writes failed, the first
+        failure is raised after.
+        '''
+        if self.handle!=None:
+            self._Send()
+            (handle, self.handle)= (self.handle, None)
+            try:
+                #Replies of all sent writes come before the one of close.
+                self.connection.Call("close", handle)
+            finally:
+                self.connection.Raise(handle)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *args):
+        self.close()
+
+class AgentFS(FS):
+    '''
+    Filesystem on the far side of psyncho-agent.
+
+    The first listing scans the whole subtree in one streamed reply, so
+    the synch walk lists and diffs directories from memory instead of
+    asking for every directory. AgentFS also answers Digest of a walk
+    path, so it can be one of FileSync.digest_sources, then SetScan
+    turns scanning off, so only directories the walk enters are listed.
+    '''
+    _meta= {"thread_safe": True, "network": True, "virtual": False, "read_only": False,
+            "unicode_paths": True, "case_insensitive_paths": False, "atomic.makedir": True,
+            "atomic.rename": True, "atomic.setcontents": False}
+
+    def __init__(self, command= None, connection= None, root= ""):
+        '''
+        @param command: Command, that starts psyncho-agent
+        @param connection: Connection of the AgentFS, this one is a subdirectory of
+        '''
+        FS.__init__(self, thread_synchronize= False)
+        self.connection= connection or AgentConnection(command)
+        self.owner= connection==None
+        self.root= root
+
+    def __str__(self):
+        return "<AgentFS: %s>" % (self.root or "/")
+
+    def _Path(self, path):
+        return pathjoin(self.root, normpath(path)).strip("/")
+
+    def listdir(self, path="./", wildcard=None, full=False, absolute=False, dirs_only=False, files_only=False):
+        return [name for name, info in self.listdirinfo(path, wildcard, full, absolute, dirs_only, files_only)]
+
+    @convert_os_errors
+    def listdirinfo(self, path="./", wildcard=None, full=False, absolute=False, dirs_only=False, files_only=False):
+        entries= []
+        for entry in self.connection.List(self._Path(path)):
+            (name, info)= entry_info(entry)
+            if dirs_only and not is_dir(info): continue
+            if files_only and is_dir(info): continue
+            if wildcard and not fnmatch.fnmatch(name, wildcard): continue
+            if absolute: name= abspath(pathjoin(path, name))
+            elif full: name= normpath(pathjoin(path, name)).lstrip("/")
+            entries.append((name, info))
+        return entries
+
+    @convert_os_errors
+    def getinfo(self, path):
+        return entry_info(self.connection.Call("stat", self._Path(path)))[1]
+
+    def _Kind(self, path):
+        try:
+            return self.connection.Call("stat", self._Path(path))[1]
+        except OSError, e:
+            if e.errno in (errno.ENOENT, errno.ENOTDIR):
+                return None
+            raise
+
+    def exists(self, path):
+        return self._Kind(path)!=None
+
+    def isdir(self, path):
+        mode= self._Kind(path)
+        return mode!=None and stat.S_ISDIR(mode)
+
+    def isfile(self, path):
+        mode= self._Kind(path)
+        return mode!=None and stat.S_ISREG(mode)
+
+    @convert_os_errors
+    def open(self, path, mode= "r", buffering= -1, encoding= None, errors= None, newline= None, line_buffering= False, **kwargs):
+        if "+" in mode:
+            flags= os.O_RDWR
+        elif "w" in mode or "a" in mode:
+            flags= os.O_WRONLY
+        else:
+            flags= os.O_RDONLY
+        if "w" in mode:
+            flags|= os.O_CREAT | os.O_TRUNC
+        elif "a" in mode:
+            flags|= os.O_CREAT
+        path= self._Path(path)
+        if flags!=os.O_RDONLY:
+            self.connection.Changed(path)
+        prefetch= CHUNK_SIZE
+        if "w" in mode:
+            prefetch= 0
+        (handle, data)= self.connection.Call("open", path, flags, prefetch)
+        f= AgentFile(self.connection, handle, data, path)
+        if "a" in mode:
+            f.seek(0, os.SEEK_END)
+        return f
+
+    @convert_os_errors
+    def makedir(self, path, recursive= False, allow_recreate= False):
+        path= self._Path(path)
+        self.connection.Changed(path)
+        self.connection.Call("makedir", path, recursive, allow_recreate)
+
+    @convert_os_errors
+    def remove(self, path):
+        path= self._Path(path)
+        self.connection.Changed(path)
+        self.connection.Call("remove", path)
+
+    @convert_os_errors
+    def removedir(self, path, recursive= False, force= False):
+        path= self._Path(path)
+        self.connection.Changed(path)
+        self.connection.Call("removedir", path, force)
+
+    @convert_os_errors
+    def rename(self, src, dst):
+        (src, dst)= (self._Path(src), self._Path(dst))
+        self.connection.Changed(src)
+        self.connection.Changed(dst)
+        self.connection.Call("rename", src, dst)
+
+    @convert_os_errors
+    def chmod(self, path, mode):
+        self.connection.Call("chmod", self._Path(path), mode)
+
+    @convert_os_errors
+    def symlink(self, target, path):
+        path= self._Path(path)
+        self.connection.Changed(path)
+        self.connection.Call("symlink", target, path)
+
+    @convert_os_errors
+    def readlink(self, path):
+        return self.connection.Call("readlink", self._Path(path))
+
+    @convert_os_errors
+    def Signatures(self, path, block_size):
+        '''
+        Block signatures of file made by the agent, see delta.signatures.
+        '''
+        return self.connection.Call("signatures", self._Path(path), block_size)
+
+    @convert_os_errors
+    def Delta(self, path, sigs, block_size, max_literal):
+        '''
+        Delta of file against signatures made by the agent, see delta.make_delta.
+        '''
+        return self.connection.Call("delta", self._Path(path), sigs, block_size, max_literal)
+
+    @convert_os_errors
+    def Patch(self, path, ops, block_size):
+        '''
+        Agent rewrites file from its own blocks and literals of ops.
+        '''
+        path= self._Path(path)
+        self.connection.Changed(path)
+        self.connection.Call("patch", path, ops, block_size)
+
+    def SetCompression(self, spec):
+        '''
+        Negotiates compression of file data and listings with the agent.
+        @param spec: Codec spec of compression.get_codec
+        @return: True when agent compresses
+        '''
+        return self.connection.SetCodec(spec)
+
+    def SetScan(self, scan):
+        '''
+        @param scan: False lists directories one by one, when they are
+                     asked for, instead of scanning whole subtree of
+                     the first listed one. Views sharing the connection
+                     are switched too.
+        '''
+        self.connection.scan= scan
+
+    def opendir(self, path):
+        '''
+        @return: AgentFS of subdirectory, that shares the connection
+        '''
+        return AgentFS(connection= self.connection, root= self._Path(path))
+
+    @convert_os_errors
+    def Digest(self, path):
+        '''
+        @param path: Walk path of directory, starting with root name
+        @return: Hex digest of subtree, as merkle.TreeDigester makes it
+        '''
+        path= list(path)
+        if self.root:
+            path[1:1]= self.root.split("/")
+        return self.connection.Call("digest", path)
+
+    def close(self):
+        if self.owner:
+            self.connection.Close()
+        FS.close(self)
+
+class AgentOpener(Opener):
+    names= ["agent"]
+    desc= """Directory served by psyncho-agent.
+
+    examples:
+    * agent:///var/data (local agent subprocess)
+    * agent:ssh://user@host/var/data (agent started over ssh)"""
+
+    @classmethod
+    def get_fs(cls, registry, fs_name, fs_name_params, fs_path, writeable, create_dir):
+        if fs_path.startswith("ssh://"):
+            url= urlparse(fs_path)
+            command= ["ssh", url.netloc, "psyncho-agent", url.path or "."]
+        else:
+            command= [sys.executable, os.path.abspath(__file__.replace(".pyc", ".py")), fs_path]
+        return (AgentFS(command), None)
+
+opener.add(AgentOpener)
+
+def main():
+    if len(sys.argv)!=2:
+        sys.stderr.write("Usage: psyncho-agent <root>\n")
+        sys.exit(2)
+    inp= os.fdopen(os.dup(sys.stdin.fileno()), "rb")
+    out= os.fdopen(os.dup(sys.stdout.fileno()), "wb")
+    #Nothing else may write to the reply stream.
+    sys.stdout= sys.stderr
+    Agent(sys.argv[1], inp, out).Serve()
+
+if __name__ == '__main__':
+    main()
@@ -1,8 +1,15 @@
+import os
+
 from psyncho import *
+from index_store import IndexStore
+from compression import get_codec
 
 class PsynchoCommand(object):
-    def __init__(self, db_file="psyncho_config.db"):        
+    def __init__(self, db_file="psyncho_config.db", index_batch_size=1000, index_latency=1.0):        
+        self.db_file= db_file
         self.db = pod.Db(file = db_file, dynamic_index = True)
+        #Sqlite indexes are committed by a background writer.
+        self.index_store= IndexStore(os.path.splitext(db_file)[0]+"_index.db", index_batch_size, True, index_latency)
         self.config_mgr=None
         self.fs_mgr=None
         
@@ -36,24 +43,55 @@ class PsynchoCommand(object):
         return "undef"           
     
     def Save(self):
+        #Same order as checkpoints of a synch.
+        self.index_store.Commit()
         self.db.commit()  
         
-    def NewSynch(self, name, source_path, dest_path, config_name=None):
+    def NewSynch(self, name, source_path, dest_path, config_name=None, index_backend="pod", compression=None):
         if not config_name:
             config= self.current_config
         else:
             config= self.config_mgr.GetConfigByName(config_name)
+        #Unknown codec fails now, not at the first synch.
+        get_codec(compression)
             
-        self.fs_mgr.AddConfig(FileSyncConfig(source_path, dest_path, config, name))
+        self.fs_mgr.AddConfig(FileSyncConfig(source_path, dest_path, config, name, index_backend, compression))
         
-    def Synch(self, name, base_path_string="root"):
+    def Synch(self, name, base_path_string="root", jobs=1, copy_jobs=0, dry_run=False, plan_file=None, compact_index=False, delta_threshold=None, resume=False, time_budget=None):
         fsc= self.fs_mgr.GetConfigByName(name)
         if not fsc:
             return None
         
         base_path=base_path_string.split("/")
-        fs= FileSync(fsc, self.db)
-        fs.sync(base_path)
+        fs= FileSync(fsc, self.db, self.index_store)
+        fs.jobs= jobs
+        fs.copy_jobs= copy_jobs
+        fs.compact_index= compact_index
+        fs.delta_threshold= delta_threshold
+        fs.time_budget= time_budget
+        fs.resume_file= "%s_%s.plan" % (os.path.splitext(self.db_file)[0], name)
+        if not dry_run:
+            return fs.sync(base_path, True, False, resume)
+        
+        plan= fs.sync(base_path, False, True)
+        if plan_file:
+            with open(plan_file, "w") as out:
+                plan.Dump(out)
+        else:
+            print plan.Format()
+        return plan
+        
+    def Watch(self, name, jobs=1, copy_jobs=0, compact_index=False, delta_threshold=None, settle=1.0):
+        fsc= self.fs_mgr.GetConfigByName(name)
+        if not fsc:
+            return None
+        
+        fs= FileSync(fsc, self.db, self.index_store)
+        fs.jobs= jobs
+        fs.copy_jobs= copy_jobs
+        fs.compact_index= compact_index
+        fs.delta_threshold= delta_threshold
+        fs.watch(settle)
         
     def NewConfig(self, config_name, root_path_status, parent_config_name=None):
         path_status= self._StatusFromString(root_path_status)
@@ -113,12 +151,22 @@ class PsynchoCommand(object):
         
         config.paths.DelPathPart(path)
         
+    def UpgradeDb(self):
+        '''
+        Adds hash-keyed children to path parts and file indexes
+        stored by older versions.
+        '''
+        for path in list(PathPart):
+            path.GetChildrenByName()
+        for index in list(FileIndex):
+            index.GetChildrenByName()
+        
     def ClearIndexes(self, name):
         fsc= self.fs_mgr.GetConfigByName(name)
         if not fsc:
             return None
         
-        fsc.ClearIndexes()
+        fsc.ClearIndexes(self.index_store)
     
     def GenSynchList(self):
         out= "Synch configs:"
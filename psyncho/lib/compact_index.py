@@ -0,0 +1,193 @@
+import sys
+
+from array import array
+
+from extra import name_key
+from index_store import SqlIndexPart
+
+#Value of time, size and inode columns, when entry has none.
+NO_VALUE= -sys.maxint-1
+
+def _column(value):
+    if value==None:
+        return NO_VALUE
+    return value
+
+def _value(column):
+    if column==NO_VALUE:
+        return None
+    return column
+
+class CompactIndex(object):
+    '''
+    Read only file index tree kept in flat arrays.
+
+    Every node is a row of parallel columns (interned name id, parent,
+    mtime, fingerprint and digest) and children of a node are a contiguous range
+    of child_ids, sorted by name, so lookups are binary searches and a
+    node costs about 60 bytes instead of a full object.
+    '''
+    def __init__(self):
+        self.names= []
+        self.name_ids= {}
+        self.name= array('i')
+        self.parent= array('i')
+        self.mtime= array('l')
+        self.mtime_ns= array('l')
+        self.size= array('l')
+        self.ino= array('l')
+        self.ctime_ns= array('l')
+        self.digests= {} # Only directories have them.
+        self.child_start= array('i')
+        self.child_count= array('i')
+        self.child_ids= array('i')
+
+    def _Intern(self, name):
+        name= name_key(name)
+        id= self.name_ids.get(name)
+        if id==None:
+            id= len(self.names)
+            self.names.append(name)
+            self.name_ids[name]= id
+        return id
+
+    def _Add(self, name, parent):
+        self.name.append(self._Intern(name))
+        self.parent.append(parent)
+        self.mtime.append(NO_VALUE)
+        self.mtime_ns.append(NO_VALUE)
+        self.size.append(NO_VALUE)
+        self.ino.append(NO_VALUE)
+        self.ctime_ns.append(NO_VALUE)
+        self.child_start.append(0)
+        self.child_count.append(0)
+        return len(self.name)-1
+
+    def _Close(self, id, children):
+        children.sort(key= lambda child: self.names[self.name[child]])
+        self.child_start[id]= len(self.child_ids)
+        self.child_count[id]= len(children)
+        self.child_ids.extend(children)
+
+    @classmethod
+    def Build(cls, base_path, entries):
+        '''
+        @param base_path: Path of the root node
+        @param entries: (path, mtime, fingerprint, digest) under base_path, all entries
+                        under a directory must come one after another
+                        (depth first or sorted by path string).
+        @return: CompactIndex
+        '''
+        index= cls()
+        base= len(base_path)-1
+        stack= [(index._Add(base_path[-1], -1), name_key(base_path[-1]), [])]
+        for path, mtime, fingerprint, digest in entries:
+            path= path[base:]
+            common= 1
+            while common<len(stack) and common<len(path) and stack[common][1]==name_key(path[common]):
+                common+= 1
+            while len(stack)>common:
+                (id, name, children)= stack.pop()
+                index._Close(id, children)
+            for name in path[len(stack):]:
+                id= index._Add(name, stack[-1][0])
+                stack[-1][2].append(id)
+                stack.append((id, name_key(name), []))
+            id= stack[-1][0]
+            index.mtime[id]= _column(mtime)
+            if fingerprint!=None:
+                index.mtime_ns[id]= _column(fingerprint[0])
+                index.size[id]= _column(fingerprint[1])
+                index.ino[id]= _column(fingerprint[2])
+                index.ctime_ns[id]= _column(fingerprint[3])
+            if digest!=None:
+                index.digests[id]= digest
+        while stack:
+            (id, name, children)= stack.pop()
+            index._Close(id, children)
+        return index
+
+    @classmethod
+    def FromIndex(cls, part):
+        '''
+        Loads subtree of FileIndex or SqlIndexPart.
+        '''
+        if isinstance(part, SqlIndexPart):
+            return cls.Build(part.path, part.store.Entries(part.sync, part.side, part.path))
+        return cls.Build([part.name], _file_index_entries(part, (part.name,)))
+
+    def Root(self):
+        return CompactIndexPart(self, 0)
+
+    def Child(self, id, name):
+        '''
+        @return: id of child with name or None
+        '''
+        name= name_key(name)
+        low= self.child_start[id]
+        high= low+self.child_count[id]
+        while low<high:
+            middle= (low+high)//2
+            child= self.child_ids[middle]
+            child_name= self.names[self.name[child]]
+            if child_name<name: low= middle+1
+            elif child_name>name: high= middle
+            else: return child
+        return None
+
+    def GetFingerprint(self, id):
+        if self.mtime_ns[id]==NO_VALUE:
+            return None
+        return (self.mtime_ns[id], _value(self.size[id]), _value(self.ino[id]), _value(self.ctime_ns[id]))
+
+    def __len__(self):
+        return len(self.name)
+
+def _file_index_entries(root, path):
+    #Depth first, so children of a node come one after another.
+    stack= [(root, path)]
+    while stack:
+        (index, path)= stack.pop()
+        yield (path, index.CreationTime, getattr(index, "Fingerprint", None), getattr(index, "Digest", None))
+        for child in reversed(list(index.children)):
+            stack.append((child, path+(child.name,)))
+
+class CompactIndexPart(object):
+    '''
+    View of one CompactIndex node with the FileIndex interface used by
+    the planning walk. Views are made on lookup and not kept.
+    '''
+    __slots__= ("index", "id")
+
+    def __init__(self, index, id):
+        self.index= index
+        self.id= id
+
+    @property
+    def name(self):
+        return self.index.names[self.index.name[self.id]]
+
+    @property
+    def CreationTime(self):
+        return _value(self.index.mtime[self.id])
+
+    @property
+    def Fingerprint(self):
+        return self.index.GetFingerprint(self.id)
+
+    @property
+    def Digest(self):
+        return self.index.digests.get(self.id)
+
+    def HasEntries(self):
+        return self.index.child_count[self.id]>0
+
+    def GetChildrenByName(self):
+        # Node answers get() by itself, so no mapping has to be made.
+        return self
+
+    def get(self, name, default= None):
+        child= self.index.Child(self.id, name)
+        if child==None:
+            return default
+        return CompactIndexPart(self.index, child)
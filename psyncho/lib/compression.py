@@ -0,0 +1,119 @@
+import bz2
+import zlib
+
+try:
+    import lzma
+except ImportError:
+    try:
+        from backports import lzma
+    except ImportError:
+        lzma= None
+
+#Payloads smaller than this are not worth compressing.
+MIN_SIZE= 512
+
+#Extensions of files, that are compressed already.
+COMPRESSED_EXTENSIONS= set("""
+    gz tgz bz2 tbz xz txz lz lzma lz4 zst zstd z 7z rar zip jar war apk deb rpm cab dmg iso
+    jpg jpeg png gif webp heic avif mp3 aac ogg opus flac m4a mp4 m4v mkv mov avi webm wmv
+    pdf docx xlsx pptx odt ods odp epub
+    """.split())
+
+class Codec(object):
+    '''
+    Compresses whole payloads, every payload can be decompressed alone.
+    '''
+    name= None
+
+    def Compress(self, data):
+        raise NotImplementedError()
+
+    def Decompress(self, data):
+        raise NotImplementedError()
+
+class ZlibCodec(Codec):
+    def __init__(self, level= 6):
+        self.level= level
+        self.name= "zlib:%d" % (level)
+
+    def Compress(self, data):
+        return zlib.compress(data, self.level)
+
+    def Decompress(self, data):
+        return zlib.decompress(data)
+
+class Bz2Codec(Codec):
+    def __init__(self, level= 9):
+        self.level= level
+        self.name= "bz2:%d" % (level)
+
+    def Compress(self, data):
+        return bz2.compress(data, self.level)
+
+    def Decompress(self, data):
+        return bz2.decompress(data)
+
+class LzmaCodec(Codec):
+    def __init__(self, level= 6):
+        self.level= level
+        self.name= "lzma:%d" % (level)
+
+    def Compress(self, data):
+        return lzma.compress(data, preset= self.level)
+
+    def Decompress(self, data):
+        return lzma.decompress(data)
+
+_codecs= {} # name: factory(level), level None is the default one.
+_levels= {} # name: (lowest, highest) level
+
+def register_codec(name, factory, levels= None):
+    '''
+    Makes codec available to get_codec and to agents, both ends of a
+    link must have it registered.
+    @param factory: function(level) returning Codec, level is None when
+                    spec has no level.
+    @param levels: (lowest, highest) level, that codec accepts, or None
+                   when get_codec does not check them.
+    '''
+    _codecs[name]= factory
+    _levels[name]= levels
+
+def codec_names():
+    return sorted(_codecs)
+
+def get_codec(spec):
+    '''
+    @param spec: "name" or "name:level", "none" or None for no compression
+    @return: Codec or None
+    '''
+    if spec==None or spec=="none":
+        return None
+    (name, sep, level)= spec.partition(":")
+    factory= _codecs.get(name)
+    if factory==None:
+        raise ValueError("Unknown compression %s" % (spec))
+    if level:
+        try:
+            level= int(level)
+        except ValueError:
+            raise ValueError("Bad compression level %s" % (spec))
+        levels= _levels.get(name)
+        if levels!=None and not levels[0]<=level<=levels[1]:
+            raise ValueError("Compression level of %s must be from %d to %d" % (spec, levels[0], levels[1]))
+        return factory(level)
+    return factory(None)
+
+def is_compressed_name(path):
+    '''
+    @return: True when extension of path is of a compressed format
+    '''
+    name= path.rsplit("/", 1)[-1]
+    if "." not in name:
+        return False
+    return name.rsplit(".", 1)[-1].lower() in COMPRESSED_EXTENSIONS
+
+register_codec("zlib", lambda level: ZlibCodec(6 if level==None else level), (0, 9))
+register_codec("bz2", lambda level: Bz2Codec(9 if level==None else level), (1, 9))
+if lzma!=None:
+    register_codec("lzma", lambda level: LzmaCodec(6 if level==None else level), (0, 9))
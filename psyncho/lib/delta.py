@@ -0,0 +1,217 @@
+import zlib
+import hashlib
+
+from math import sqrt
+
+from fs.errors import DestinationExistsError
+
+_MOD= 65521 # Modulo of adler32.
+
+def block_size_for(size):
+    '''
+    Block size similar to rsync, square root of file size.
+    '''
+    return max(4096, min(1<<17, int(sqrt(size)) & ~1023))
+
+def weak_checksum(data):
+    value= zlib.adler32(data) & 0xffffffff
+    return (value & 0xffff, value >> 16)
+
+def roll_checksum(weak, out_byte, in_byte, block_size):
+    #Moves adler32 window of block_size one byte forward.
+    (a, b)= weak
+    a= (a - out_byte + in_byte) % _MOD
+    b= (b + a - 1 - block_size*out_byte) % _MOD
+    return (a, b)
+
+def strong_checksum(data):
+    return hashlib.md5(data).digest()
+
+def signatures(fs, path, block_size):
+    '''
+    Checksums of all blocks of a file. Last block is shorter and can
+    only match at the end of the other file, so it is kept apart.
+    @return: ({weak: [(strong, block number)]}, (strong, block number, length) or None)
+    '''
+    sigs= {}
+    tail= None
+    f= fs.open(path, 'rb')
+    try:
+        number= 0
+        while True:
+            block= f.read(block_size)
+            if len(block)<block_size:
+                if block:
+                    tail= (strong_checksum(block), number, len(block))
+                break
+            sigs.setdefault(weak_checksum(block), []).append((strong_checksum(block), number))
+            number+= 1
+    finally:
+        f.close()
+    return (sigs, tail)
+
+def make_delta(fs, path, signatures, block_size, max_literal= 16*1024*1024):
+    '''
+    Finds blocks of other file in a file with rolling checksum.
+    @param signatures: Signatures of other file
+    @return: list of block numbers and literal strings, or None when
+             more than max_literal bytes differ.
+    '''
+    (sigs, tail)= signatures
+    ops= []
+    literal= bytearray()
+    literal_size= 0
+    f= fs.open(path, 'rb')
+    try:
+        buf= bytearray()
+        pos= 0
+        weak= None
+        while True:
+            if len(buf)-pos<block_size:
+                more= f.read(block_size*64)
+                if not more:
+                    break
+                buf= buf[pos:]+bytearray(more)
+                pos= 0
+                continue
+
+            if weak==None:
+                weak= weak_checksum(buffer(buf, pos, block_size))
+            match= None
+            candidates= sigs.get(weak)
+            if candidates:
+                strong= strong_checksum(buffer(buf, pos, block_size))
+                for other, number in candidates:
+                    if other==strong:
+                        match= number
+                        break
+            if match!=None:
+                if literal:
+                    ops.append(str(literal))
+                    literal= bytearray()
+                ops.append(match)
+                pos+= block_size
+                weak= None
+                continue
+
+            literal.append(buf[pos])
+            literal_size+= 1
+            if literal_size>max_literal:
+                return None
+            if pos+block_size<len(buf):
+                weak= roll_checksum(weak, buf[pos], buf[pos+block_size], block_size)
+            else:
+                weak= None
+            pos+= 1
+    finally:
+        f.close()
+
+    match= None
+    if tail and len(buf)-pos==tail[2] and strong_checksum(buffer(buf, pos))==tail[0]:
+        match= tail[1]
+    else:
+        literal+= buf[pos:]
+    if literal:
+        ops.append(str(literal))
+    if match!=None:
+        ops.append(match)
+    return ops
+
+def apply_delta(fs, path, ops, block_size):
+    '''
+    Rewrites file from its own blocks and literals. When every block
+    stays at its offset, only literals are written in place, otherwise
+    file is built in a temp file and moved over the old one.
+    '''
+    size= fs.getsize(path)
+    offset= 0
+    in_place= True
+    for op in ops:
+        if isinstance(op, str):
+            offset+= len(op)
+        else:
+            if op*block_size!=offset:
+                in_place= False
+                break
+            offset+= min(block_size, size-offset)
+
+    if in_place:
+        f= fs.open(path, 'r+b')
+        try:
+            offset= 0
+            for op in ops:
+                if isinstance(op, str):
+                    f.seek(offset)
+                    f.write(op)
+                    offset+= len(op)
+                else:
+                    offset+= min(block_size, size-offset)
+            f.truncate(offset)
+        finally:
+            f.close()
+        return
+
+    tmp_path= path+".psyncho-delta"
+    old= fs.open(path, 'rb')
+    try:
+        new= fs.open(tmp_path, 'wb')
+        try:
+            for op in ops:
+                if isinstance(op, str):
+                    new.write(op)
+                else:
+                    old.seek(op*block_size)
+                    new.write(old.read(block_size))
+        finally:
+            new.close()
+    finally:
+        old.close()
+    #Rename replaces the old file on POSIX, move would copy on most openers.
+    try:
+        fs.rename(tmp_path, path)
+    except DestinationExistsError:
+        fs.move(tmp_path, path, overwrite=True)
+
+def has_delta_requests(fs):
+    '''
+    Checks if opener computes signatures, deltas and patches on the side,
+    that has the file (AgentFS). Type is checked, so wrappers, that
+    forward unknown attributes, don't count.
+    '''
+    return hasattr(type(fs), "Patch")
+
+def _local(fs, path):
+    #Whole file can be read without going over a link.
+    return fs.getsyspath(path, allow_none=True)!=None or not fs.getmeta("network", False)
+
+def delta_copy(src, src_path, dst, dst_path, size, max_literal= 16*1024*1024):
+    '''
+    Makes dst file equal to src file by writing only changed blocks.
+    Files are only read where they are, so a side must be local or have
+    delta requests, otherwise delta would move more than a plain copy.
+    @param size: Size of src file
+    @return: Number of literal bytes written, or None if files differ
+             too much or a side is remote, and file was not changed.
+    '''
+    src_remote= has_delta_requests(src)
+    dst_remote= has_delta_requests(dst)
+    if not (src_remote or _local(src, src_path)) or not (dst_remote or _local(dst, dst_path)):
+        return None
+    block_size= block_size_for(size)
+    if dst_remote:
+        sigs= dst.Signatures(dst_path, block_size)
+    else:
+        sigs= signatures(dst, dst_path, block_size)
+    #Past half of the file a plain copy is cheaper.
+    max_literal= min(max_literal, size//2)
+    if src_remote:
+        ops= src.Delta(src_path, sigs, block_size, max_literal)
+    else:
+        ops= make_delta(src, src_path, sigs, block_size, max_literal)
+    if ops==None:
+        return None
+    if dst_remote:
+        dst.Patch(dst_path, ops, block_size)
+    else:
+        apply_delta(dst, dst_path, ops, block_size)
+    return sum(len(op) for op in ops if isinstance(op, str))
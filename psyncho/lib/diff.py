@@ -0,0 +1,81 @@
+from extra import Enumerate, is_file, is_lnk, is_dir
+
+ObjectKind= Enumerate("unknown file dir link")
+
+def get_kind(info):
+    if is_file(info): return ObjectKind.file
+    elif is_dir(info): return ObjectKind.dir
+    elif is_lnk(info): return ObjectKind.link
+    #If file/dir is something we don't know we just pass.
+    return ObjectKind.unknown
+
+class DirDiff(object):
+    '''
+    Actions needed to synch one directory.
+
+    Copy lists hold (name, info) tuples of objects that exist only on
+    one side. Update lists and type changes hold (name, src_info,
+    dst_info) tuples of objects that exist on both sides.
+    '''
+    def __init__(self):
+        #Src
+        self.copy_src_files= []
+        self.copy_src_dirs= []
+        self.make_src_links= []
+        #Dst
+        self.copy_dst_files= []
+        self.copy_dst_dirs= []
+        self.make_dst_links= []
+        #Src and dst
+        self.update_files= []
+        self.update_dirs= []
+        self.update_links= []
+        #Object is a file on one side and dir or link on the other.
+        self.type_changes= []
+
+def diff_dirs(src_entries, dst_entries):
+    '''
+    Compares listings of the same directory on both sides, in time
+    linear with number of entries.
+    @param src_entries: Source listing
+    @type src_entries: (name, info)[]
+    @param dst_entries: Destination listing
+    @type dst_entries: (name, info)[]
+    @return: DirDiff
+    '''
+    diff= DirDiff()
+
+    copy_lists= {ObjectKind.file: (diff.copy_src_files, diff.copy_dst_files),
+                 ObjectKind.dir: (diff.copy_src_dirs, diff.copy_dst_dirs),
+                 ObjectKind.link: (diff.make_src_links, diff.make_dst_links)}
+    update_lists= {ObjectKind.file: diff.update_files,
+                   ObjectKind.dir: diff.update_dirs,
+                   ObjectKind.link: diff.update_links}
+
+    dst_by_name= dict(dst_entries)
+    src_names= set()
+    for name, sinfo in src_entries:
+        src_names.add(name)
+        skind= get_kind(sinfo)
+        dinfo= dst_by_name.get(name)
+        if dinfo==None:
+            if skind!=ObjectKind.unknown:
+                copy_lists[skind][0].append((name, sinfo))
+            continue
+
+        dkind= get_kind(dinfo)
+        if skind==ObjectKind.unknown or dkind==ObjectKind.unknown:
+            continue
+        if skind==dkind:
+            update_lists[skind].append((name, sinfo, dinfo))
+        else:
+            diff.type_changes.append((name, sinfo, dinfo))
+
+    for name, dinfo in dst_entries:
+        if name in src_names:
+            continue
+        dkind= get_kind(dinfo)
+        if dkind!=ObjectKind.unknown:
+            copy_lists[dkind][1].append((name, dinfo))
+
+    return diff
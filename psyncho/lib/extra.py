@@ -1,10 +1,18 @@
 import stat
 
+from time import mktime
+
 class Enumerate(object):
     def __init__(self, names):
-        for number, name in enumerate(names.split()):
+        self._names= names.split()
+        for number, name in enumerate(self._names):
             setattr(self, name, number)
             
+    def Name(self, number):
+        return self._names[number]
+
+PathStatus= Enumerate("undef include ignore stop")
+            
 def is_file(info):
     return stat.S_ISREG( info["st_mode"] )
 
@@ -15,4 +23,42 @@ def is_lnk(info):
     return stat.S_ISLNK( info["st_mode"] )
 
 def get_fmod(info):
-    return info["st_mode"] & 0x00000FFF
\ No newline at end of file
+    return info["st_mode"] & 0x00000FFF
+
+def name_key(name):
+    #Same key for str and unicode names, keys are pickled in the db.
+    if isinstance(name, str):
+        try: return name.decode("utf-8")
+        except UnicodeDecodeError: pass
+    return name
+
+def _time_ns(info, name):
+    #Float times only keep microseconds reliably.
+    if name+"_ns" in info:
+        return info[name+"_ns"]
+    if name in info:
+        return int(round(info[name]*1000000))*1000
+    return None
+
+def get_mtime_ns(info):
+    mtime_ns= _time_ns(info, "st_mtime")
+    if mtime_ns==None:
+        # Openers without stat results.
+        mtime= info["modified_time"]
+        mtime_ns= int(mktime(mtime.timetuple()))*1000000000+mtime.microsecond*1000
+    return mtime_ns
+
+def get_hash_key(info):
+    #Stat key of file content digest, None when opener has no inodes.
+    if "st_ino" not in info or "st_dev" not in info:
+        return None
+    return (info["st_dev"], info["st_ino"], info["size"], get_mtime_ns(info))
+
+def get_file_fingerprint(info):
+    '''
+    Fingerprint that file indexes record after synch, file with the same
+    fingerprint is considered unchanged.
+    @return: (mtime_ns, size, inode, ctime_ns), inode and ctime_ns are
+             None when opener does not report them.
+    '''
+    return (get_mtime_ns(info), info["size"], info.get("st_ino"), _time_ns(info, "st_ctime"))
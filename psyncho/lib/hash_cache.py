@@ -0,0 +1,103 @@
+import hashlib
+
+from multiprocessing import Pool
+
+from extra import get_hash_key
+
+def hash_file(f, chunk_size= 1024*1024):
+    digest= hashlib.sha1()
+    while True:
+        chunk= f.read(chunk_size)
+        if not chunk:
+            break
+        digest.update(chunk)
+    return digest.hexdigest()
+
+def _hash_sys_path(sys_path):
+    #Runs in pool processes, so it only gets a plain path.
+    f= open(sys_path, 'rb')
+    try:
+        return hash_file(f)
+    finally:
+        f.close()
+
+class HashCache(object):
+    '''
+    Content digests of files on one side of a synch.
+
+    Digests are stored in IndexStore under stat key (device, inode,
+    size, mtime_ns) and are only computed again when key changes. Local
+    files of at least large_size bytes are hashed on a process pool.
+    '''
+    def __init__(self, store, sync, side, jobs= 4, large_size= 4*1024*1024):
+        self.store= store
+        self.sync= sync
+        self.side= side
+        self.jobs= jobs
+        self.large_size= large_size
+        self.pool= None
+
+    def _Hash(self, fs, path):
+        f= fs.open(path, 'rb')
+        try:
+            return hash_file(f)
+        finally:
+            f.close()
+
+    def Get(self, fs, path, info):
+        '''
+        @return: Hex sha1 digest of file content
+        '''
+        return self.GetMany(fs, [(path, info)])[path]
+
+    def GetMany(self, fs, files):
+        '''
+        @param files: (path, info)[]
+        @return: {path: digest}
+        '''
+        paths= [path for path, info in files]
+        return dict(zip(paths, self.GetAll([(fs, path, info) for path, info in files])))
+
+    def GetAll(self, files):
+        '''
+        Digests of files, that may be in different directories of side.
+        @param files: (fs, path, info)[]
+        @return: digest[] in order of files
+        '''
+        digests= [None]*len(files)
+        large= []
+        for number, (fs, path, info) in enumerate(files):
+            key= get_hash_key(info)
+            if key!=None:
+                digest= self.store.GetDigest(self.sync, self.side, key)
+                if digest!=None:
+                    digests[number]= digest
+                    continue
+
+            sys_path= None
+            if self.jobs>1 and info["size"]>=self.large_size:
+                sys_path= fs.getsyspath(path, allow_none= True)
+            if sys_path!=None:
+                large.append((number, key, sys_path))
+                continue
+
+            digests[number]= self._Hash(fs, path)
+            if key!=None:
+                self.store.PutDigest(self.sync, self.side, key, digests[number])
+
+        if large:
+            if self.pool==None:
+                self.pool= Pool(self.jobs)
+            results= self.pool.map(_hash_sys_path, [sys_path for number, key, sys_path in large])
+            for (number, key, sys_path), digest in zip(large, results):
+                digests[number]= digest
+                if key!=None:
+                    self.store.PutDigest(self.sync, self.side, key, digest)
+
+        return digests
+
+    def Close(self):
+        if self.pool:
+            self.pool.close()
+            self.pool.join()
+            self.pool= None
@@ -0,0 +1,463 @@
+import sqlite3
+import threading
+import Queue
+
+from time import time
+
+from extra import name_key
+
+_schema= '''
+CREATE TABLE IF NOT EXISTS file_index (
+    sync TEXT NOT NULL,
+    side INTEGER NOT NULL,
+    path TEXT NOT NULL,
+    parent TEXT NOT NULL,
+    mtime INTEGER,
+    size INTEGER,
+    mtime_ns INTEGER,
+    ino INTEGER,
+    ctime_ns INTEGER,
+    digest TEXT,
+    PRIMARY KEY (sync, side, path)
+);
+CREATE INDEX IF NOT EXISTS file_index_parent ON file_index (sync, side, parent);
+CREATE TABLE IF NOT EXISTS content_hash (
+    sync TEXT NOT NULL,
+    side INTEGER NOT NULL,
+    dev INTEGER NOT NULL,
+    ino INTEGER NOT NULL,
+    size INTEGER NOT NULL,
+    mtime_ns INTEGER NOT NULL,
+    digest TEXT NOT NULL,
+    PRIMARY KEY (sync, side, dev, ino)
+);
+'''
+
+#Columns added after the first version of the table.
+_added_columns= [("mtime_ns", "INTEGER"), ("ino", "INTEGER"), ("ctime_ns", "INTEGER"), ("digest", "TEXT")]
+
+_unloaded= object()
+
+def join_path(path):
+    return u"/".join(name_key(name) for name in path)
+
+def _open(file):
+    conn= sqlite3.connect(file)
+    conn.executescript(_schema)
+    columns= [row[1] for row in conn.execute("PRAGMA table_info(file_index)")]
+    for column, type in _added_columns:
+        if column not in columns:
+            conn.execute("ALTER TABLE file_index ADD COLUMN %s %s" % (column, type))
+    conn.commit()
+    return conn
+
+def _write(conn, pending, pending_digests):
+    #Batched upserts of buffered entries.
+    if pending:
+        rows= []
+        for (sync, side, path), (mtime, fingerprint, digest) in pending.iteritems():
+            (mtime_ns, size, ino, ctime_ns)= fingerprint or (None, None, None, None)
+            rows.append((sync, side, path, path.rsplit(u"/", 1)[0], mtime, size, mtime_ns, ino, ctime_ns, digest))
+        conn.executemany("INSERT OR REPLACE INTO file_index (sync, side, path, parent, mtime, size, mtime_ns, ino, ctime_ns, digest) VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?)", rows)
+    if pending_digests:
+        rows= [key+value for key, value in pending_digests.iteritems()]
+        conn.executemany("INSERT OR REPLACE INTO content_hash (sync, side, dev, ino, size, mtime_ns, digest) VALUES (?, ?, ?, ?, ?, ?, ?)", rows)
+
+class IndexWriter(object):
+    '''
+    Thread with its own connection, that writes and commits batches
+    handed over by IndexStore, so walk and copies don't wait for disk.
+
+    Batches stay in in_flight until they are committed, so readers can
+    still see them. Everything queued while a commit runs goes in the
+    next transaction together.
+    '''
+    def __init__(self, file):
+        self.file= file
+        self.queue= Queue.Queue()
+        self.lock= threading.Lock()
+        self.in_flight= [] # (pending, pending_digests) not committed yet.
+        self.error= None
+        self.thread= threading.Thread(target= self._Work, name= "index-writer")
+        self.thread.daemon= True
+        self.thread.start()
+
+    def _Work(self):
+        conn= sqlite3.connect(self.file)
+        while True:
+            ops= [self.queue.get()]
+            while True:
+                try: ops.append(self.queue.get_nowait())
+                except Queue.Empty: break
+            try:
+                for op in ops:
+                    if op==None:
+                        continue
+                    if op[0]=="write":
+                        _write(conn, op[1][0], op[1][1])
+                    else:
+                        conn.execute(op[1], op[2])
+                conn.commit()
+            except Exception, e:
+                conn.rollback()
+                self.error= e
+            with self.lock:
+                for op in ops:
+                    if op!=None and op[0]=="write":
+                        self.in_flight.remove(op[1])
+            for op in ops:
+                self.queue.task_done()
+            if None in ops:
+                conn.close()
+                return
+
+    def Write(self, pending, pending_digests):
+        batch= (pending, pending_digests)
+        with self.lock:
+            self.in_flight.append(batch)
+        self.queue.put(("write", batch))
+
+    def Execute(self, sql, params):
+        self.queue.put(("sql", sql, params))
+
+    def Batches(self):
+        '''
+        @return: Batches not committed yet, newest first.
+        '''
+        with self.lock:
+            return list(reversed(self.in_flight))
+
+    def Barrier(self):
+        '''
+        Waits until everything handed over is committed.
+        '''
+        self.queue.join()
+        if self.error!=None:
+            (error, self.error)= (self.error, None)
+            raise error
+
+    def Close(self):
+        self.queue.put(None)
+        self.thread.join()
+
+class IndexStore(object):
+    '''
+    File indexes of all synchs in one sqlite table, keyed by synch name,
+    side and path.
+
+    Writes are buffered and go in as batched upserts, reads see buffered
+    writes. Connection is opened on first use and, like pod, may only be
+    used by the thread that opened it.
+
+    With background set, batches are written and committed by an
+    IndexWriter thread. A batch is handed over when it has batch_size
+    entries or its oldest entry is latency seconds old, Commit is the
+    barrier that waits for all of them.
+    '''
+    def __init__(self, file, batch_size= 1000, background= False, latency= 1.0):
+        self.file= file
+        self.batch_size= batch_size
+        self.background= background
+        self.latency= latency
+        self.conn= None
+        self.writer= None
+        self.pending= {}
+        self.pending_digests= {}
+        self.pending_since= None
+
+    def _Connection(self):
+        if self.conn==None:
+            self.conn= _open(self.file)
+            if self.background:
+                # Readers don't block commits of the writer.
+                self.conn.execute("PRAGMA journal_mode=WAL")
+                self.writer= IndexWriter(self.file)
+        return self.conn
+
+    def _Buffered(self):
+        #Buffers, that are not in the table yet, newest first.
+        buffers= [(self.pending, self.pending_digests)]
+        if self.writer:
+            buffers+= self.writer.Batches()
+        return buffers
+
+    def _Added(self):
+        if self.pending_since==None:
+            self.pending_since= time()
+        if len(self.pending)+len(self.pending_digests)>=self.batch_size:
+            self.Flush()
+        elif self.writer and time()-self.pending_since>=self.latency:
+            self.Flush()
+
+    def Root(self, sync, side, name= "root"):
+        '''
+        @return: SqlIndexPart usable in place of root FileIndex
+        '''
+        return SqlIndexPart(self, sync, side, (name,))
+
+    def _Value(self, row):
+        #Row columns as (mtime, fingerprint, digest).
+        (mtime, size, mtime_ns, ino, ctime_ns, digest)= row
+        if digest!=None:
+            digest= str(digest)
+        if mtime_ns==None:
+            return (mtime, None, digest)
+        return (mtime, (mtime_ns, size, ino, ctime_ns), digest)
+
+    def Get(self, sync, side, path):
+        '''
+        @return: (mtime, fingerprint, digest) or None
+        '''
+        key= (sync, side, join_path(path))
+        for pending, pending_digests in self._Buffered():
+            if key in pending:
+                return pending[key]
+        row= self._Connection().execute("SELECT mtime, size, mtime_ns, ino, ctime_ns, digest FROM file_index WHERE sync=? AND side=? AND path=?", key).fetchone()
+        if row==None:
+            return None
+        return self._Value(row)
+
+    def GetChildren(self, sync, side, path):
+        '''
+        @return: {name: (mtime, fingerprint, digest)} of entries directly under path
+        '''
+        parent= join_path(path)
+        children= {}
+        rows= self._Connection().execute("SELECT path, mtime, size, mtime_ns, ino, ctime_ns, digest FROM file_index WHERE sync=? AND side=? AND parent=?", (sync, side, parent))
+        for row in rows:
+            children[row[0][len(parent)+1:]]= self._Value(row[1:])
+        for pending, pending_digests in reversed(self._Buffered()):
+            for (psync, pside, child), value in pending.iteritems():
+                if psync==sync and pside==side and child.rsplit(u"/", 1)[0]==parent and child!=parent:
+                    children[child[len(parent)+1:]]= value
+        return children
+
+    def Entries(self, sync, side, path):
+        '''
+        Iterates over path and entries under it, sorted by path parts.
+        String order of paths is not enough, "d.x" and "d-y" sort between
+        "d" and "d/in", so entries under a directory would not come one
+        after another.
+        @return: (path, mtime, fingerprint, digest) iterator
+        '''
+        self._Settle()
+        prefix= join_path(path)
+        rows= self._Connection().execute("SELECT path, mtime, size, mtime_ns, ino, ctime_ns, digest FROM file_index WHERE sync=? AND side=? AND (path=? OR (path>=? AND path<?))",
+                                         (sync, side, prefix, prefix+u"/", prefix+u"0"))
+        entries= [(tuple(row[0].split(u"/")), row[1:]) for row in rows]
+        entries.sort(key= lambda entry: entry[0])
+        for path, values in entries:
+            yield (path,)+self._Value(values)
+
+    def HasEntries(self, sync, side, path):
+        '''
+        @return: True when anything is indexed under path
+        '''
+        prefix= join_path(path)
+        for pending, pending_digests in self._Buffered():
+            for (psync, pside, child) in pending:
+                if psync==sync and pside==side and child.startswith(prefix+u"/"):
+                    return True
+        row= self._Connection().execute("SELECT 1 FROM file_index WHERE sync=? AND side=? AND path>=? AND path<? LIMIT 1",
+                                        (sync, side, prefix+u"/", prefix+u"0")).fetchone()
+        return row!=None
+
+    def Put(self, sync, side, path, mtime, fingerprint= None, digest= None):
+        '''
+        @param fingerprint: (mtime_ns, size, inode, ctime_ns) or None
+        @param digest: Subtree digest of a directory or None
+        '''
+        self.pending[(sync, side, join_path(path))]= (mtime, fingerprint, digest)
+        self._Added()
+
+    def GetDigest(self, sync, side, hash_key):
+        '''
+        @param hash_key: (dev, inode, size, mtime_ns) of a file
+        @return: Digest stored for the same key or None
+        '''
+        (dev, ino, size, mtime_ns)= hash_key
+        key= (sync, side, dev, ino)
+        for pending, pending_digests in self._Buffered():
+            if key in pending_digests:
+                row= pending_digests[key]
+                break
+        else:
+            row= self._Connection().execute("SELECT size, mtime_ns, digest FROM content_hash WHERE sync=? AND side=? AND dev=? AND ino=?", key).fetchone()
+        if row==None or row[0]!=size or row[1]!=mtime_ns:
+            return None
+        return row[2]
+
+    def PutDigest(self, sync, side, hash_key, digest):
+        (dev, ino, size, mtime_ns)= hash_key
+        self.pending_digests[(sync, side, dev, ino)]= (size, mtime_ns, digest)
+        self._Added()
+
+    def Flush(self):
+        '''
+        Writes buffered entries, without committing them. With background
+        writer they are only handed over to it.
+        '''
+        if self.pending or self.pending_digests:
+            conn= self._Connection()
+            if self.writer:
+                self.writer.Write(self.pending, self.pending_digests)
+            else:
+                _write(conn, self.pending, self.pending_digests)
+            self.pending= {}
+            self.pending_digests= {}
+        self.pending_since= None
+
+    def _Settle(self):
+        #Everything written so far is in the table.
+        self.Flush()
+        if self.writer:
+            self.writer.Barrier()
+
+    def _Execute(self, sql, params):
+        if self.writer:
+            self.writer.Execute(sql, params)
+            self.writer.Barrier()
+        else:
+            self._Connection().execute(sql, params)
+
+    def Commit(self):
+        '''
+        Writes and commits everything, also the final barrier for
+        background writes.
+        '''
+        if self.conn==None and not self.pending and not self.pending_digests:
+            return
+        self._Settle()
+        if not self.writer:
+            self.conn.commit()
+
+    def Close(self):
+        self.Commit()
+        if self.writer:
+            self.writer.Close()
+            self.writer= None
+
+    def DeleteTree(self, sync, side, path):
+        '''
+        Deletes path and everything under it.
+        '''
+        self._Settle()
+        prefix= join_path(path)
+        self._Execute("DELETE FROM file_index WHERE sync=? AND side=? AND (path=? OR (path>=? AND path<?))",
+                      (sync, side, prefix, prefix+u"/", prefix+u"0"))
+
+    def MoveTree(self, sync, side, path, new_path):
+        '''
+        Moves path and everything under it to new_path, replacing what
+        was there.
+        '''
+        self.DeleteTree(sync, side, new_path)
+        prefix= join_path(path)
+        new_prefix= join_path(new_path)
+        self._Execute("UPDATE file_index SET path=?||substr(path, ?), parent=CASE WHEN path=? THEN ? ELSE ?||substr(parent, ?) END "
+                      "WHERE sync=? AND side=? AND (path=? OR (path>=? AND path<?))",
+                      (new_prefix, len(prefix)+1, prefix, join_path(new_path[:-1]), new_prefix, len(prefix)+1,
+                       sync, side, prefix, prefix+u"/", prefix+u"0"))
+
+    def Clear(self, sync):
+        '''
+        Deletes indexes of both sides of a synch.
+        '''
+        self._Settle()
+        self._Execute("DELETE FROM file_index WHERE sync=?", (sync,))
+        self._Execute("DELETE FROM content_hash WHERE sync=?", (sync,))
+
+class SqlChildren(object):
+    def __init__(self, part, rows):
+        self.part= part
+        self.rows= rows
+
+    def get(self, name, default= None):
+        # Missing children are just parts without index time.
+        return SqlIndexPart(self.part.store, self.part.sync, self.part.side, self.part.path+(name,), self.rows.get(name))
+
+class SqlIndexPart(object):
+    '''
+    Adapter with the parts of FileIndex interface, that FileSync uses.
+
+    Directories have no rows until their Digest is set, every path
+    exists and has CreationTime, Fingerprint and Digest None until they
+    are set.
+    '''
+    def __init__(self, store, sync, side, path, row= _unloaded):
+        self.store= store
+        self.sync= sync
+        self.side= side
+        self.path= tuple(path)
+        self.name= path[-1]
+        self.row= row
+        self.children= None
+
+    def _Row(self):
+        if self.row is _unloaded:
+            self.row= self.store.Get(self.sync, self.side, self.path)
+        return self.row
+
+    @property
+    def CreationTime(self):
+        row= self._Row()
+        if row==None:
+            return None
+        return row[0]
+
+    def _Set(self, index, value):
+        row= list(self._Row() or (None, None, None))
+        row[index]= value
+        self.row= tuple(row)
+        self.store.Put(self.sync, self.side, self.path, *self.row)
+
+    @CreationTime.setter
+    def CreationTime(self, value):
+        self._Set(0, value)
+
+    @property
+    def Fingerprint(self):
+        row= self._Row()
+        if row==None:
+            return None
+        return row[1]
+
+    @Fingerprint.setter
+    def Fingerprint(self, value):
+        self._Set(1, value)
+
+    @property
+    def Digest(self):
+        row= self._Row()
+        if row==None:
+            return None
+        return row[2]
+
+    @Digest.setter
+    def Digest(self, value):
+        self._Set(2, value)
+
+    def HasEntries(self):
+        return self.store.HasEntries(self.sync, self.side, self.path)
+
+    def GetChildrenByName(self):
+        if self.children==None:
+            self.children= SqlChildren(self, self.store.GetChildren(self.sync, self.side, self.path))
+        return self.children
+
+    def GetPathPart(self, path, new=False):
+        if(path==[]):
+            return None
+        if(self.name!=path[0]):
+            return None
+        return SqlIndexPart(self.store, self.sync, self.side, self.path+tuple(path[1:]))
+
+    def DelPathPart(self, path):
+        if(self.name!=path[0]):
+            return
+        self.store.DeleteTree(self.sync, self.side, self.path+tuple(path[1:]))
+
+    def MovePathPart(self, path, new_path):
+        if(self.name!=path[0] or self.name!=new_path[0]):
+            return
+        self.store.MoveTree(self.sync, self.side, self.path+tuple(path[1:]), self.path+tuple(new_path[1:]))
@@ -0,0 +1,193 @@
+import random
+
+from time import time, sleep
+from threading import Lock
+
+from fs.wrapfs import WrapFS
+from fs.errors import RemoteConnectionError, NoSysPathError
+from fs.opener import opener, Opener, OpenerError
+
+#Opener calls, that are requests on a remote backend.
+DELAYED= ["listdir", "listdirinfo", "ilistdir", "ilistdirinfo", "getinfo", "exists", "isdir", "isfile",
+          "getsize", "open", "makedir", "remove", "removedir", "rename", "settimes", "copy", "move",
+          "chmod", "symlink", "readlink"]
+
+class Link(object):
+    '''
+    Bandwidth shared by all files of all views of one opener, parallel
+    transfers wait for each other like they would on one connection.
+    '''
+    def __init__(self, bandwidth, sleep= sleep):
+        '''
+        @param bandwidth: Bytes per second, None for no limit
+        '''
+        self.bandwidth= bandwidth
+        self.sleep= sleep
+        self.lock= Lock()
+        self.free= 0.0 # Time, when the last reserved transfer ends.
+
+    def Transfer(self, size):
+        if not self.bandwidth or not size:
+            return
+        with self.lock:
+            now= time()
+            self.free= max(self.free, now)+float(size)/self.bandwidth
+            wait= self.free-now
+        self.sleep(wait)
+
+class LatencyFile(object):
+    def __init__(self, f, link):
+        self.f= f
+        self.link= link
+
+    def read(self, *args):
+        data= self.f.read(*args)
+        self.link.Transfer(len(data))
+        return data
+
+    def write(self, data):
+        self.link.Transfer(len(data))
+        return self.f.write(data)
+
+    def __getattr__(self, name):
+        return getattr(self.f, name)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *args):
+        self.f.close()
+
+class _Settings(object):
+    #Shared by opener and views of its subdirectories.
+    def __init__(self, latency, latencies, error_rate, error_rates, link, seed, sleep):
+        self.latency= latency
+        self.latencies= latencies or {}
+        self.error_rate= error_rate
+        self.error_rates= error_rates or {}
+        self.link= link
+        self.random= random.Random(seed)
+        self.random_lock= Lock()
+        self.sleep= sleep
+
+    def Delay(self, name, path):
+        error_rate= self.error_rates.get(name, self.error_rate)
+        if error_rate:
+            with self.random_lock:
+                failed= self.random.random()<error_rate
+            if failed:
+                raise RemoteConnectionError(name, path, msg= "Unable to %(opname)s %(path)s: injected error")
+        latency= self.latencies.get(name, self.latency)
+        if latency:
+            self.sleep(latency)
+
+def _delayed(name):
+    def call(self, *args, **kwds):
+        self.settings.Delay(name, args[0] if args else kwds.get("path", ""))
+        return getattr(WrapFS, name)(self, *args, **kwds)
+    call.__name__= name
+    return call
+
+class LatencyFS(WrapFS):
+    '''
+    Makes any opener behave like a slow remote one: every request waits
+    for its latency and may fail with RemoteConnectionError, data of
+    opened files goes through a link of limited bandwidth.
+
+    System paths are hidden, so listing and copying can't go around it
+    through local disk. Subdirectories are views of the wrapped opener
+    subdirectory sharing latencies, link and random generator.
+    '''
+    def __init__(self, fs, latency= 0.0, bandwidth= None, error_rate= 0.0, latencies= None, error_rates= None,
+                 seed= None, sleep= sleep, settings= None):
+        '''
+        @param latency: Seconds every request waits
+        @param bandwidth: Bytes per second of file data, None for no limit
+        @param error_rate: Part of requests, that fail
+        @param latencies: {call name: seconds} overriding latency
+        @param error_rates: {call name: rate} overriding error_rate
+        @param sleep: function(seconds), tests can count waits instead
+        '''
+        WrapFS.__init__(self, fs)
+        self.settings= settings or _Settings(latency, latencies, error_rate, error_rates,
+                                             Link(bandwidth, sleep), seed, sleep)
+
+    def _file_wrap(self, f, mode):
+        return LatencyFile(f, self.settings.link)
+
+    def getsyspath(self, path, allow_none= False):
+        if allow_none:
+            return None
+        raise NoSysPathError(path)
+
+    def hassyspath(self, path):
+        return False
+
+    def opendir(self, path):
+        return LatencyFS(self.wrapped_fs.opendir(path), settings= self.settings)
+
+    def chmod(self, path, mode):
+        self.settings.Delay("chmod", path)
+        if hasattr(self.wrapped_fs, "chmod"):
+            self.wrapped_fs.chmod(path, mode)
+
+    def symlink(self, target, path):
+        self.settings.Delay("symlink", path)
+        self.wrapped_fs.symlink(target, path)
+
+    def readlink(self, path):
+        self.settings.Delay("readlink", path)
+        return self.wrapped_fs.readlink(path)
+
+for _name in DELAYED:
+    if _name not in LatencyFS.__dict__:
+        setattr(LatencyFS, _name, _delayed(_name))
+
+def parse_params(params):
+    '''
+    Parses opener parameters "name=value,...": latency, bandwidth,
+    errors and seed set defaults, a call name sets latency of the call
+    and call name with _errors suffix its error rate.
+    @return: Keyword arguments of LatencyFS
+    '''
+    kwds= {"latencies": {}, "error_rates": {}}
+    for pair in (params or "").split(","):
+        if not pair:
+            continue
+        (name, sep, value)= pair.partition("=")
+        try:
+            if name=="latency":
+                kwds["latency"]= float(value)
+            elif name=="bandwidth":
+                kwds["bandwidth"]= float(value)
+            elif name=="errors":
+                kwds["error_rate"]= float(value)
+            elif name=="seed":
+                kwds["seed"]= int(value)
+            elif name in DELAYED:
+                kwds["latencies"][name]= float(value)
+            elif name.endswith("_errors") and name[:-len("_errors")] in DELAYED:
+                kwds["error_rates"][name[:-len("_errors")]]= float(value)
+            else:
+                raise OpenerError("Unknown latency parameter %s" % (name))
+        except ValueError:
+            raise OpenerError("Bad latency parameter %s" % (pair))
+    return kwds
+
+class LatencyOpener(Opener):
+    names= ["latency"]
+    desc= """Wraps another opener, so it behaves like a slow remote one.
+
+    examples:
+    * latency#latency=0.02,bandwidth=1000000:osfs:///var/data (20ms per request, 1MB/s)
+    * latency#errors=0.01,listdir=0.2:mem:// (1% of requests fail, slow listings)"""
+
+    @classmethod
+    def get_fs(cls, registry, fs_name, fs_name_params, fs_path, writeable, create_dir):
+        kwds= parse_params(fs_name_params)
+        (fs, path)= registry.parse(fs_path, writeable= writeable, create_dir= create_dir)
+        if path:
+            fs= fs.opendir(path)
+        return (LatencyFS(fs, **kwds), None)
+
+opener.add(LatencyOpener)
@@ -0,0 +1,89 @@
+import os
+
+from datetime import datetime
+from threading import Lock
+from multiprocessing.pool import ThreadPool
+
+from fs.base import FS
+from fs.wrapfs import WrapFS
+
+try:
+    from os import scandir
+except ImportError:
+    try:
+        from scandir import scandir
+    except ImportError:
+        scandir= None
+
+def stat_to_info(stats):
+    '''
+    Makes info dict of the same shape as OSFS.getinfo returns.
+    '''
+    info= dict((k, getattr(stats, k)) for k in dir(stats) if k.startswith('st_'))
+    info['size']= info['st_size']
+    info['created_time']= datetime.fromtimestamp(info['st_ctime'])
+    info['accessed_time']= datetime.fromtimestamp(info['st_atime'])
+    info['modified_time']= datetime.fromtimestamp(info['st_mtime'])
+    return info
+
+def has_bulk_listing(fs):
+    '''
+    Checks if opener has it's own listdirinfo, which is usually one
+    request instead of getinfo for every entry.
+    '''
+    while isinstance(fs, WrapFS):
+        fs= fs.wrapped_fs
+    return type(fs).listdirinfo.im_func is not FS.listdirinfo.im_func
+
+class DirLister(object):
+    '''
+    Lists directories together with info of every entry.
+
+    Local directories are read directly with scandir (or listdir) and
+    one lstat per entry. Openers with bulk listing use listdirinfo, for
+    all other openers getinfo calls are spread over a thread pool.
+    '''
+    def __init__(self, jobs= 8):
+        self.jobs= jobs
+        self.pool= None
+        self.pool_lock= Lock()
+
+    def ListDir(self, fs):
+        '''
+        @return: (name, info)[]
+        '''
+        sys_path= fs.getsyspath("", allow_none= True)
+        if sys_path!=None:
+            return self._ListLocal(sys_path)
+        if has_bulk_listing(fs):
+            return fs.listdirinfo()
+
+        names= fs.listdir()
+        if self.jobs<=1 or len(names)<2:
+            return [(name, fs.getinfo(name)) for name in names]
+
+        with self.pool_lock:
+            if not self.pool:
+                self.pool= ThreadPool(self.jobs)
+        return zip(names, self.pool.map(fs.getinfo, names))
+
+    def _ListLocal(self, sys_path):
+        entries= []
+        if scandir:
+            for entry in scandir(sys_path):
+                try: stats= entry.stat(follow_symlinks= False)
+                except OSError: continue #Removed while we were listing.
+                entries.append((entry.name, stat_to_info(stats)))
+        else:
+            for name in os.listdir(sys_path):
+                try: stats= os.lstat(os.path.join(sys_path, name))
+                except OSError: continue #Removed while we were listing.
+                entries.append((name, stat_to_info(stats)))
+
+        return entries
+
+    def Close(self):
+        if self.pool:
+            self.pool.close()
+            self.pool.join()
+            self.pool= None
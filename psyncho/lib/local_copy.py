@@ -0,0 +1,197 @@
+import os
+import errno
+import fcntl
+import ctypes
+import ctypes.util
+
+from fs.utils import copyfile
+from fs.errors import convert_os_errors, ParentDirectoryMissingError
+
+FICLONE= 0x40049409
+SEEK_DATA= 3
+SEEK_HOLE= 4
+BUFFER_SIZE= 1024*1024
+#Chunk of one copy_file_range or sendfile call, they copy less at once anyway.
+CHUNK_SIZE= 1<<30
+
+#Errors, after which the next engine is tried for the rest of the file.
+_UNSUPPORTED= set([errno.ENOSYS, errno.EOPNOTSUPP, errno.ENOTTY, errno.EXDEV,
+                   errno.EINVAL, errno.EPERM, errno.EBADF, errno.ETXTBSY])
+
+_libc= None
+#Engines, that the kernel or libc does not have at all.
+_disabled= set()
+
+def _copy_libc():
+    global _libc
+    if _libc==None:
+        libc= ctypes.CDLL(ctypes.util.find_library("c"), use_errno=True)
+        if hasattr(libc, "copy_file_range"):
+            libc.copy_file_range.argtypes= [ctypes.c_int, ctypes.c_void_p, ctypes.c_int, ctypes.c_void_p,
+                                            ctypes.c_size_t, ctypes.c_uint]
+            libc.copy_file_range.restype= ctypes.c_ssize_t
+        libc.sendfile.argtypes= [ctypes.c_int, ctypes.c_int, ctypes.c_void_p, ctypes.c_size_t]
+        libc.sendfile.restype= ctypes.c_ssize_t
+        _libc= libc
+    return _libc
+
+def _unsupported(name, error):
+    #@return: True when next engine should be tried
+    if error==errno.ENOSYS:
+        _disabled.add(name)
+    return error in _UNSUPPORTED
+
+def reflink_copy(src_fd, dst_fd):
+    '''
+    Shares extents of source with destination (btrfs, xfs), so nothing
+    is copied until one of them is written. Holes stay holes.
+    @return: True when file was cloned
+    '''
+    try:
+        fcntl.ioctl(dst_fd, FICLONE, src_fd)
+    except IOError, e:
+        if _unsupported("reflink", e.errno):
+            return False
+        raise
+    return True
+
+def _kernel_copy(name, call, src_fd, dst_fd, count):
+    #Copies count bytes from current offsets.
+    while count>0:
+        copied= call(src_fd, dst_fd, min(count, CHUNK_SIZE))
+        if copied<0:
+            error= ctypes.get_errno()
+            if error==errno.EINTR:
+                continue
+            if _unsupported(name, error):
+                return False
+            raise OSError(error, os.strerror(error))
+        if copied==0:
+            break
+        count-= copied
+    return True
+
+def range_copy(src_fd, dst_fd, count):
+    '''
+    copy_file_range copies inside the kernel, on network and some local
+    filesystems without moving data at all.
+    @return: True when count bytes or the rest of file were copied
+    '''
+    libc= _copy_libc()
+    if not hasattr(libc, "copy_file_range"):
+        _disabled.add("copy_file_range")
+        return False
+    return _kernel_copy("copy_file_range", lambda src, dst, count: libc.copy_file_range(src, None, dst, None, count, 0),
+                        src_fd, dst_fd, count)
+
+def sendfile_copy(src_fd, dst_fd, count):
+    '''
+    sendfile copies between any two descriptors without user space buffers.
+    @return: True when count bytes or the rest of file were copied
+    '''
+    libc= _copy_libc()
+    return _kernel_copy("sendfile", lambda src, dst, count: libc.sendfile(dst, src, None, count),
+                        src_fd, dst_fd, count)
+
+def buffered_copy(src_fd, dst_fd, count):
+    while count>0:
+        data= os.read(src_fd, min(count, BUFFER_SIZE))
+        if not data:
+            break
+        count-= len(data)
+        while data:
+            written= os.write(dst_fd, data)
+            data= data[written:]
+    return True
+
+#Fastest first, every engine continues where the previous one stopped.
+ENGINES= [("copy_file_range", range_copy), ("sendfile", sendfile_copy), ("buffered", buffered_copy)]
+
+def is_sparse(stat):
+    '''
+    @return: True when file has less blocks allocated than its size needs
+    '''
+    return stat.st_blocks*512<stat.st_size
+
+def data_extents(fd, size):
+    '''
+    Finds parts of file, that are not holes.
+    @return: iterator of (start, end) offsets of data
+    '''
+    offset= 0
+    while offset<size:
+        try:
+            start= os.lseek(fd, offset, SEEK_DATA)
+        except OSError, e:
+            if e.errno==errno.ENXIO: # Only a hole is left.
+                return
+            if e.errno==errno.EINVAL and offset==0: # Filesystem does not know holes.
+                yield (0, size)
+                return
+            raise
+        end= min(os.lseek(fd, start, SEEK_HOLE), size)
+        yield (start, end)
+        offset= end
+
+def _copy_to(src_fd, dst_fd, end, engines):
+    #Copies from current offset of both files to end.
+    for name, engine in engines:
+        if name in _disabled:
+            continue
+        offset= os.lseek(src_fd, 0, os.SEEK_CUR)
+        if engine(src_fd, dst_fd, end-offset):
+            return name
+    raise OSError(errno.ENOTSUP, "No copy engine could copy file")
+
+def copy_fd(src_fd, dst_fd, size, engines= None, reflink= True):
+    '''
+    Copies source to empty destination with the first engine, that works.
+    Only data of sparse files is copied, holes are left out of destination.
+    @param engines: (name, function)[] to try, ENGINES by default
+    @return: Name of engine, that copied data, None when file is a hole.
+    '''
+    if reflink and "reflink" not in _disabled and reflink_copy(src_fd, dst_fd):
+        return "reflink"
+    engines= engines or ENGINES
+    if not is_sparse(os.fstat(src_fd)):
+        return _copy_to(src_fd, dst_fd, size, engines)
+    used= None
+    for start, end in data_extents(src_fd, size):
+        os.lseek(src_fd, start, os.SEEK_SET)
+        os.lseek(dst_fd, start, os.SEEK_SET)
+        used= _copy_to(src_fd, dst_fd, end, engines)
+    #Trailing hole.
+    os.ftruncate(dst_fd, size)
+    return used
+
+@convert_os_errors
+def copy_syspath(src_syspath, dst_syspath, engines= None, reflink= True):
+    '''
+    @return: Name of engine, that copied file
+    '''
+    src_fd= os.open(src_syspath, os.O_RDONLY)
+    try:
+        try:
+            dst_fd= os.open(dst_syspath, os.O_WRONLY | os.O_CREAT | os.O_TRUNC, 0666)
+        except OSError, e:
+            if e.errno==errno.ENOENT and not os.path.exists(os.path.dirname(dst_syspath)):
+                raise ParentDirectoryMissingError(dst_syspath)
+            raise
+        try:
+            return copy_fd(src_fd, dst_fd, os.fstat(src_fd).st_size, engines, reflink)
+        finally:
+            os.close(dst_fd)
+    finally:
+        os.close(src_fd)
+
+def local_copyfile(src_fs, src_path, dst_fs, dst_path):
+    '''
+    fs.utils.copyfile, that copies with kernel help when both files
+    are on local disk.
+    '''
+    src_syspath= src_fs.getsyspath(src_path, allow_none=True)
+    dst_syspath= dst_fs.getsyspath(dst_path, allow_none=True)
+    if src_syspath==None or dst_syspath==None:
+        copyfile(src_fs, src_path, dst_fs, dst_path)
+        return
+    copy_syspath(src_syspath, dst_syspath)
@@ -0,0 +1,87 @@
+import hashlib
+
+from extra import name_key, get_fmod, get_file_fingerprint
+from diff import ObjectKind, get_kind
+from listing import DirLister
+
+def entry_line(name, info, digest= None):
+    '''
+    Line of one directory entry in digest of its parent.
+    @param digest: Subtree digest, when entry is a directory
+    '''
+    kind= get_kind(info)
+    if kind==ObjectKind.dir:
+        state= digest
+    else:
+        state= ",".join(str(value) for value in get_file_fingerprint(info))
+    name= name_key(name)
+    if isinstance(name, unicode):
+        name= name.encode("utf-8")
+    return "%s\0%d\0%o\0%s\n" % (name, kind, get_fmod(info), state)
+
+def dir_digest(entries, subdir_digests):
+    '''
+    Merkle digest of a directory listing. Files and links are hashed by
+    fingerprint, directories by their own digest, so digest changes when
+    anything under directory changes.
+    @param entries: (name, info)[] listing of directory
+    @param subdir_digests: {name: digest} of subdirectories
+    @return: Hex sha1 digest, or None when a subdirectory has no digest.
+    '''
+    lines= []
+    for name, info in entries:
+        kind= get_kind(info)
+        if kind==ObjectKind.unknown:
+            continue
+        digest= None
+        if kind==ObjectKind.dir:
+            digest= subdir_digests.get(name)
+            if digest==None:
+                return None
+        lines.append(entry_line(name, info, digest))
+    lines.sort()
+    return hashlib.sha1("".join(lines)).hexdigest()
+
+class TreeDigester(object):
+    '''
+    Computes digests of one side as it is on disk now. Digest of a
+    subtree is the same, as synch stores in file index of that side,
+    when nothing under it has changed since.
+
+    It is meant to run close to files, so only digests have to be sent
+    to the synching side instead of full listings.
+    '''
+    def __init__(self, fs, lister= None, keep= False):
+        '''
+        @param keep: Keep digests of all directories under the first
+                     digested one, so walk asking for every directory
+                     lists each of them only once. Changes made after
+                     are not seen.
+        '''
+        self.fs= fs
+        self.lister= lister or DirLister()
+        self.digests= {} if keep else None
+
+    def Digest(self, path):
+        '''
+        @param path: Walk path of directory, starting with root name
+        @return: Hex digest of subtree
+        '''
+        key= tuple(path[1:])
+        if self.digests!=None and key in self.digests:
+            return self.digests[key]
+        fs= self.fs
+        if len(path)>1:
+            fs= fs.opendir("/".join(path[1:]))
+        return self._Digest(fs, key)
+
+    def _Digest(self, fs, key):
+        entries= self.lister.ListDir(fs)
+        subdir_digests= {}
+        for name, info in entries:
+            if get_kind(info)==ObjectKind.dir:
+                subdir_digests[name]= self._Digest(fs.opendir(name), key+(name,))
+        digest= dir_digest(entries, subdir_digests)
+        if self.digests!=None:
+            self.digests[key]= digest
+        return digest
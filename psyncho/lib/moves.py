@@ -0,0 +1,247 @@
+from extra import get_file_fingerprint
+from plan import ActionKind, Side, EMPTY_ONLY
+
+def _other_side(side):
+    if side==Side.dst:
+        return Side.src
+    return Side.dst
+
+class MoveCandidate(object):
+    '''
+    File, that walk plans to copy and might be a moved file instead.
+
+    fs and name locate the file on the side, where it exists now.
+    '''
+    __slots__= ("path", "info", "fingerprint", "fs", "name", "action")
+
+    def __init__(self, path, info, fingerprint, fs, name, action):
+        self.path= tuple(path)
+        self.info= info
+        self.fingerprint= fingerprint
+        self.fs= fs
+        self.name= name
+        self.action= action
+
+class MoveDetector(object):
+    '''
+    Finds files and directories moved on one side since last synch, so
+    plan renames them on the other side instead of copying.
+
+    A file moved on side X shows up twice in the plan, its new path is
+    copied from X and its old path, that only the other side still has,
+    is copied back to X. Pairs are matched by inode, size and mtime that
+    X index recorded for the old path, or by size and content digest.
+    Old path must be unchanged on the other side since last synch.
+    When everything under a new directory is a matched move from an
+    old directory, both subtrees become a single directory rename.
+    Otherwise old directory, that moves leave empty, is removed after
+    them, so the next synch does not make it again on the other side.
+    '''
+    def __init__(self, digest= None):
+        '''
+        @param digest: function(side, files) returning content digests
+                       of (fs, name, info)[] files in their order, or
+                       None to match by inode only.
+        '''
+        self.digest= digest
+        self.new= {Side.src: [], Side.dst: []}
+        self.missing= {Side.src: [], Side.dst: []}
+        self.mkdirs= {}
+        self.candidates= set() # Action numbers of New and Missing files.
+        self.mkdir_paths= set()
+
+    def New(self, side, path, info, fs, name, action):
+        '''
+        File is new on side and plan copies it to the other side.
+        @param action: Number of the copy action in plan
+        '''
+        self.new[side].append(MoveCandidate(path, info, get_file_fingerprint(info), fs, name, action))
+        self.candidates.add(action)
+
+    def Missing(self, side, path, fingerprint, info, fs, name, action, other_fingerprint):
+        '''
+        File was synched, but is gone from side and plan copies it back.
+        It can only be a moved file, when the other side did not change
+        it since, or its changes would be lost.
+        @param fingerprint: Fingerprint, that index of side recorded
+        @param info: Info of the file on the other side
+        @param other_fingerprint: Fingerprint, that index of the other
+                                  side recorded, or None
+        '''
+        if other_fingerprint==None or tuple(other_fingerprint)!=get_file_fingerprint(info):
+            return
+        self.missing[side].append(MoveCandidate(path, info, fingerprint, fs, name, action))
+        self.candidates.add(action)
+
+    def MakeDir(self, side, path, action):
+        self.mkdirs[(side, tuple(path))]= action
+        self.mkdir_paths.add(tuple(path))
+
+    def Holds(self, number, action):
+        '''
+        @param number: Number of action in plan
+        @return: True when Apply may replace or drop the action, so it
+                 can't be executed before the walk ends.
+        '''
+        if number in self.candidates:
+            return True
+        for end in range(2, len(action.path)+1):
+            if action.path[:end] in self.mkdir_paths:
+                return True
+        return False
+
+    def _Match(self, side):
+        #@return: (missing, new)[] of files moved on side
+        matches= []
+        by_inode= {}
+        by_size= {}
+        for missing in self.missing[side]:
+            if missing.fingerprint[2]!=None:
+                by_inode.setdefault(missing.fingerprint[2], []).append(missing)
+            by_size.setdefault(missing.info["size"], []).append(missing)
+
+        used= set()
+        unmatched= []
+        for new in self.new[side]:
+            for missing in by_inode.get(new.fingerprint[2], []):
+                # Inodes are reused, rename also keeps mtime and size.
+                if missing.action not in used and tuple(missing.fingerprint[:3])==new.fingerprint[:3]:
+                    used.add(missing.action)
+                    matches.append((missing, new))
+                    break
+            else:
+                unmatched.append(new)
+
+        if self.digest==None:
+            return matches
+        pending= [] # (new, candidates)[] of files compared by content
+        for new in unmatched:
+            candidates= [missing for missing in by_size.get(new.info["size"], []) if missing.action not in used]
+            # Files of a moved directory keep their names. Empty files
+            # all have the same digest, so only the name tells them apart.
+            candidates.sort(key= lambda missing: missing.path[-1]!=new.path[-1])
+            if not new.info["size"]:
+                candidates= [missing for missing in candidates if missing.path[-1]==new.path[-1]]
+            if candidates:
+                pending.append((new, candidates))
+        if not pending:
+            return matches
+
+        # Files of each side are hashed in one call, so large ones can be
+        # hashed in parallel. Digests are keyed by action number.
+        olds= []
+        seen= set()
+        for new, candidates in pending:
+            for missing in candidates:
+                if missing.action not in seen:
+                    seen.add(missing.action)
+                    olds.append(missing)
+        digests= {}
+        for files, files_side in [([new for new, candidates in pending], side), (olds, _other_side(side))]:
+            hashed= self.digest(files_side, [(file.fs, file.name, file.info) for file in files])
+            for file, digest in zip(files, hashed):
+                digests[file.action]= digest
+
+        for new, candidates in pending:
+            for missing in candidates:
+                if missing.action not in used and digests[missing.action]==digests[new.action]:
+                    used.add(missing.action)
+                    matches.append((missing, new))
+                    break
+        return matches
+
+    def _Subtree(self, plan, start):
+        #Actions from mkdir at start to the last one under its path.
+        path= plan.actions[start].path
+        end= start+1
+        while end<len(plan.actions) and plan.actions[end].path[:len(path)]==path:
+            end+= 1
+        return (start, end)
+
+    def _DirMove(self, plan, side, old, new, moved):
+        #@return: ((start, end), (start, end)) ranges of both subtrees, when
+        #         new directory is exactly old one moved on side.
+        other= _other_side(side)
+        if (side, old) not in self.mkdirs or (other, new) not in self.mkdirs:
+            return None
+        old_range= self._Subtree(plan, self.mkdirs[(side, old)])
+        new_range= self._Subtree(plan, self.mkdirs[(other, new)])
+        for (start, end), action_side, base, other_base in [(old_range, side, old, new), (new_range, other, new, old)]:
+            for action in plan.actions[start:end]:
+                if action.side!=action_side:
+                    return None
+                if action.kind==ActionKind.mkdir:
+                    continue
+                if action.kind!=ActionKind.copy or moved.get(action.path)!=other_base+action.path[len(base):]:
+                    return None
+        return (old_range, new_range)
+
+    def Apply(self, plan):
+        '''
+        Replaces copies of moved files and directories with moves.
+        @type plan: SyncPlan
+        @return: Number of moves
+        '''
+        moves= {} # Number of action replaced: move action
+        cancelled= set()
+        emptied= [] # (side, path) of old directories, that moves empty
+        for side in [Side.src, Side.dst]:
+            matches= self._Match(side)
+            # Paths of matched copies, to the path on the other end.
+            moved= {}
+            for missing, new in matches:
+                moved[missing.path]= new.path
+                moved[new.path]= missing.path
+
+            dir_pairs= set()
+            for missing, new in matches:
+                (old, path)= (missing.path, new.path)
+                while len(old)>1 and len(path)>1 and old[-1]==path[-1]:
+                    (old, path)= (old[:-1], path[:-1])
+                    dir_pairs.add((old, path))
+            collapsed= []
+            for old, path in sorted(dir_pairs, key= lambda pair: len(pair[1])):
+                if [done for done in collapsed if path[:len(done)]==done]:
+                    continue
+                ranges= self._DirMove(plan, side, old, path, moved)
+                if ranges==None:
+                    continue
+                collapsed.append(path)
+                for start, end in ranges:
+                    cancelled.update(range(start, end))
+                moves[ranges[1][0]]= (ActionKind.move, _other_side(side), path, None, "/".join(old))
+
+            for missing, new in matches:
+                if new.action in cancelled:
+                    continue
+                cancelled.add(missing.action)
+                moves[new.action]= (ActionKind.move, _other_side(side), new.path, new.fingerprint, "/".join(missing.path))
+
+            # Old directory, whose every file moved, is not made again
+            # and is removed where files moved out of it, deepest first.
+            for (mkdir_side, path), start in sorted(self.mkdirs.items(), key= lambda item: -len(item[0][1])):
+                if mkdir_side!=side or start in cancelled:
+                    continue
+                (start, end)= self._Subtree(plan, start)
+                if end>start+1 and all(number in cancelled for number in range(start+1, end)):
+                    cancelled.add(start)
+                    emptied.append((_other_side(side), path))
+
+        if not moves:
+            return 0
+        actions= plan.actions
+        plan.actions= []
+        plan.changes= 0
+        for number, action in enumerate(actions):
+            if number in moves:
+                (kind, side, path, fingerprint, target)= moves[number]
+                plan.Add(kind, side, path, None, None, fingerprint, fingerprint!=None, target)
+            elif number not in cancelled:
+                # Kept actions stay the same objects, so actions executed
+                # while walking can be told apart.
+                plan.actions.append(action)
+                if action.kind!=ActionKind.digest:
+                    plan.changes+= 1
+        for side, path in emptied:
+            plan.Add(ActionKind.removedir, side, path, target= EMPTY_ONLY)
+        return len(moves)
@@ -0,0 +1,132 @@
+import json
+
+from extra import Enumerate
+
+ActionKind= Enumerate("copy update mkdir symlink relink chmod remove removedir digest move")
+#Side that action changes, copies and links are made from the other side.
+Side= Enumerate("src dst both")
+
+#Target of removedir action, that only removes an empty directory.
+EMPTY_ONLY= "empty"
+
+#Actions that read from the other side.
+_directed= (ActionKind.copy, ActionKind.update, ActionKind.relink)
+
+class SyncAction(object):
+    '''
+    One change on disk, made by the execution phase.
+
+    Path is the same as walk path, so it starts with base path. When
+    index is set, file index of changed side gets fingerprint of the new
+    file and, if fingerprint is not None, index of the other side gets
+    fingerprint. Digest actions change nothing on disk, they only store
+    subtree digest (target) in directory index of one side. Move actions
+    rename target (walk path joined by "/") to path. Removedir actions
+    remove everything under path, with target EMPTY_ONLY only an empty
+    directory.
+    '''
+    __slots__= ("kind", "side", "path", "mode", "size", "fingerprint", "index", "target")
+
+    def __init__(self, kind, side, path, mode= None, size= None, fingerprint= None, index= False, target= None):
+        self.kind= kind
+        self.side= side
+        self.path= tuple(path)
+        self.mode= mode
+        self.size= size
+        self.fingerprint= fingerprint
+        if fingerprint!=None:
+            self.fingerprint= tuple(fingerprint)
+        self.index= index
+        self.target= target
+
+    def ToList(self):
+        return [ActionKind.Name(self.kind), Side.Name(self.side), list(self.path),
+                self.mode, self.size, self.fingerprint, self.index, self.target]
+
+    @classmethod
+    def FromList(cls, fields):
+        (kind, side, path, mode, size, fingerprint, index, target)= fields
+        return cls(getattr(ActionKind, kind), getattr(Side, side), path, mode, size, fingerprint, index, target)
+
+    def __str__(self):
+        if self.kind in _directed:
+            if self.side==Side.dst: side= "src->dst"
+            else: side= "dst->src"
+        else:
+            side= Side.Name(self.side)
+        out= "%-9s %-8s %s" % (ActionKind.Name(self.kind), side, "/".join(self.path))
+        if self.kind==ActionKind.move:
+            out= "%-9s %-8s %s -> %s" % (ActionKind.Name(self.kind), side, self.target, "/".join(self.path))
+        elif self.kind==ActionKind.removedir and self.target==EMPTY_ONLY:
+            out+= " (if empty)"
+        elif self.target!=None:
+            out+= " -> "+self.target
+        return out
+
+class SyncPlan(object):
+    '''
+    Ordered list of actions made by walking both sides.
+
+    Actions are in walk order, so directories are always made before
+    anything is copied into them.
+    '''
+    def __init__(self, base_path= ["root"]):
+        self.base_path= tuple(base_path)
+        self.actions= []
+        self.changes= 0 # Actions, that change files.
+
+    def Add(self, kind, side, path, mode= None, size= None, fingerprint= None, index= False, target= None):
+        self.actions.append(SyncAction(kind, side, path, mode, size, fingerprint, index, target))
+        if kind!=ActionKind.digest:
+            self.changes+= 1
+
+    def __iter__(self):
+        return iter(self.actions)
+
+    def __len__(self):
+        return len(self.actions)
+
+    def RelativePath(self, action):
+        '''
+        Path of action relative to root of synched directories.
+        '''
+        return "/".join(action.path[len(self.base_path):])
+
+    def Summary(self):
+        '''
+        @return: (count of actions by kind name, bytes to transfer)
+        '''
+        counts= {}
+        size= 0
+        for action in self.actions:
+            if action.kind==ActionKind.digest:
+                continue
+            name= ActionKind.Name(action.kind)
+            counts[name]= counts.get(name, 0)+1
+            if action.size:
+                size+= action.size
+        return (counts, size)
+
+    def Format(self):
+        lines= [str(action) for action in self.actions if action.kind!=ActionKind.digest]
+        (counts, size)= self.Summary()
+        lines.append("%d actions (%s), %d bytes to transfer" %
+                     (self.changes, ", ".join("%s: %d" % item for item in sorted(counts.items())), size))
+        return "\n".join(lines)
+
+    def Dump(self, out):
+        '''
+        Writes plan to file object, one json list per line.
+        '''
+        out.write(json.dumps(list(self.base_path))+"\n")
+        for action in self.actions:
+            out.write(json.dumps(action.ToList())+"\n")
+
+    @classmethod
+    def Load(cls, inp):
+        plan= cls(json.loads(inp.readline()))
+        for line in inp:
+            if line.strip():
+                action= SyncAction.FromList(json.loads(line))
+                plan.Add(action.kind, action.side, action.path, action.mode, action.size, action.fingerprint, action.index, action.target)
+        return plan
@@ -1,5 +1,6 @@
 import pod
 import pod.list
+import pod.dict
 import os
 import re
 import fs
@@ -8,13 +9,29 @@ import stat
 from fs.opener import fsopendir
 from fs.utils import copyfile
 from copy import deepcopy
+from functools import partial
 from datetime import timedelta
 from datetime import datetime
 from time import mktime
 
-from extra import Enumerate, is_file, is_lnk, is_dir, get_fmod
+from extra import Enumerate, PathStatus, is_file, is_lnk, is_dir, get_fmod, name_key, get_file_fingerprint
+from rules import CompiledConfigLayer, CompileConfigLayer, InvalidateRules
+from diff import diff_dirs
+from listing import DirLister
+from walker import SubtreePrefetcher
+from transfer import TransferJob, DeltaTransferJob, TransferQueue
+from plan import ActionKind, Side, SyncPlan, EMPTY_ONLY
+from compact_index import CompactIndex
+from hash_cache import HashCache
+from watch import TreeWatcher, synch_roots
+from merkle import dir_digest, TreeDigester
+from moves import MoveDetector
+from agent import AgentFS
+from latency import LatencyFS
 
-PathStatus= Enumerate("undef include ignore stop")
+# Attributes that path rules are compiled from.
+_PATH_RULE_ATTRS= ("name", "PathStatus", "parent", "depth")
+_LAYER_RULE_ATTRS= ("parent", "paths")
 
 class PathPart(pod.Object):
     def __init__(self, name, parent= None, pathStatus= PathStatus.undef, depth= 0):
@@ -24,14 +41,22 @@ class PathPart(pod.Object):
         self.PathStatus= pathStatus
         
         self.children= []
+        self.named= {} # First child with given name, for fast lookups.
         self.parent= parent
         if parent!=None:
             self.parent.children.append(self)
+            self.parent.GetChildrenByName().setdefault(name, self)
 
         # We must store depth to help while getting config layer with deepest path.
         self.depth= depth
 
         self.pathConfig=[] # Config as key->value store.
+
+    def __setattr__(self, attr, value):
+        pod.Object.__setattr__(self, attr, value)
+        # New parts and changed statuses make compiled rules stale.
+        if attr in _PATH_RULE_ATTRS:
+            InvalidateRules()
                 
     def CreatePath(self, path, pathStatus= PathStatus.undef):
         # If we are at the end of creation return self.
@@ -44,21 +69,33 @@ class PathPart(pod.Object):
         # Recursively call for full path creation
         return pathPart.CreatePath(path[1:])   
         
+    def GetChildrenByName(self):
+        try:
+            return self.named
+        except AttributeError:
+            # Path parts stored before children were hash-keyed.
+            named= {}
+            for child in self.children:
+                named.setdefault(child.name, child)
+            self.named= named
+            return named
+        
     def GetPathPart(self, path, new=False):
         if(path==[]):
             return self.parent
         if(self.name!=path[0]):
             return None
             
-        for child in self.children:
-            tpathPart= child.GetPathPart(path[1:], new)
-            if(tpathPart!=None):
-                return tpathPart
-            
-        if(new == True):
-            return self.CreatePath(path[1:])
+        pathPart= self
+        for id, name in enumerate(path[1:]):
+            child= pathPart.GetChildrenByName().get(name)
+            if(child==None):
+                if(new == True):
+                    return pathPart.CreatePath(path[id+1:])
+                return pathPart
+            pathPart= child
 
-        return self
+        return pathPart
 
     def PathExists(self, path):
         if(path==[]):
@@ -66,12 +103,13 @@ class PathPart(pod.Object):
         if(self.name!=path[0]):
             return False
             
-        for child in self.children:
-            tpathPart= child.PathExists(path[1:])
-            if(tpathPart):
-                return True
+        pathPart= self
+        for name in path[1:]:
+            pathPart= pathPart.GetChildrenByName().get(name)
+            if(pathPart==None):
+                return False
             
-        return False
+        return len(pathPart.children)>0
         
     def GetLastPart(self, path, report_truncated= False):
         if(path==[]):
@@ -133,8 +171,20 @@ class PathPart(pod.Object):
         if(tpathPart==None):
             return
         
-        tpathPart.parent.children.remove(tpathPart)
+        tpathPart.parent.RemoveChild(tpathPart)
         tpathPart.delete()
+        InvalidateRules()
+        
+    def RemoveChild(self, child):
+        self.children.remove(child)
+        named= self.GetChildrenByName()
+        if named.get(child.name) is child:
+            del named[child.name]
+            # Child with the same name can be next in line.
+            for other in self.children:
+                if other.name==child.name:
+                    named[child.name]= other
+                    break
         
     def SetPathConfig(self, path, key, value):
         # PathPart must already exist to set config.
@@ -182,8 +232,8 @@ class PathPart(pod.Object):
         return path 
         
     def pre_delete(self):
-        for child in self.children:
-            self.children.remove(child)
+        for child in self.children[:]:
+            self.RemoveChild(child)
             child.delete()
         
     def __deepcopy__(self, memo):
@@ -212,6 +262,12 @@ class ConfigLayer(pod.Object):
         self.FileAccess= FileAccess
         self.paths= PathPart("root")
         self.paths.PathStatus= lPathStatus
+
+    def __setattr__(self, attr, value):
+        pod.Object.__setattr__(self, attr, value)
+        # Compiled rules flatten the whole parent chain.
+        if attr in _LAYER_RULE_ATTRS:
+            InvalidateRules()
         
     def PathExists(self, lpath):
         path= self.paths
@@ -285,6 +341,13 @@ class ConfigLayer(pod.Object):
         
         return self.__GetPathStatus__(path, parent.parent, previousBest, depth, report_truncated, previous_truncated)
 
+    def Compiled(self):
+        '''
+        Gets compiled rules of this layer chain, they are shared and
+        cached until any path rule changes.
+        '''
+        return CompileConfigLayer(self)
+
     def GetConfigByPath(self, path):
         if self.name != path[0]:
             return None
@@ -319,7 +382,7 @@ class ConfigLayer(pod.Object):
         return last_parent
         
     def pre_delete(self):
-        for child in self.children:
+        for child in self.children[:]:
             self.children.remove(child)
             child.delete()
         
@@ -420,6 +483,7 @@ class ConfigLayerManager(pod.Object):
         if config in self.configs:
             self.configs.remove(config)
             config.delete()
+            InvalidateRules()
             
     def GetRootConfigs(self):
         return self.configs
@@ -428,7 +492,7 @@ class ConfigLayerManager(pod.Object):
         '''
         Erases all config layers.
         '''
-        for config in self.configs:
+        for config in self.configs[:]:
             self.configs.remove(config)
             config.delete()
         
@@ -441,12 +505,22 @@ class FileIndex(pod.Object):
         
         self.name= name
         self.CreationTime= CreationTime    
+        self.Fingerprint= None # (mtime_ns, size, inode, ctime_ns) after last synch.
+        self.Digest= None # Merkle digest of directory subtree after last synch.
         
         self.children= pod.list.List()
+        self.named= pod.dict.Dict() # Children by name, for fast lookups.
         self.parent= parent
         if parent!=None:
             self.parent.children.append(self)
+            self.parent.GetChildrenByName()[name_key(name)]= self
                 
+    def HasEntries(self):
+        '''
+        @return: True when anything is indexed under this one
+        '''
+        return len(self.children)>0
+        
     def AddPath(self, path, CreationTime= None):
         if(path==[]):
             return self
@@ -455,29 +529,72 @@ class FileIndex(pod.Object):
         
         return tpathPart.AddPath(path[1:])   
         
+    def GetChildrenByName(self):
+        try:
+            return self.named
+        except AttributeError:
+            # Indexes stored before children were hash-keyed.
+            named= pod.dict.Dict()
+            for child in self.children:
+                if name_key(child.name) not in named:
+                    named[name_key(child.name)]= child
+            self.named= named
+            return named
+        
     def GetPathPart(self, path, new=False):
         if(path==[]):
             return self.parent
         if(self.name!=path[0]):
             return None
             
-        for child in self.children:
-            tpathPart= child.GetPathPart(path[1:], new)
-            if(tpathPart!=None):
+        tpathPart= self
+        for id, name in enumerate(path[1:]):
+            child= tpathPart.GetChildrenByName().get(name_key(name))
+            if(child==None):
+                if(new == True):
+                    return tpathPart.AddPath(path[id+1:])
                 return tpathPart
-            
-        if(new == True):
-            return self.AddPath(path[1:])
+            tpathPart= child
         
-        return self
+        return tpathPart
         
     def DelPathPart(self, path):
         tpathPart= self.GetPathPart(path, False)
         if(tpathPart==None):
             return
         
-        tpathPart.parent.children.remove(tpathPart)
+        tpathPart.parent.RemoveChild(tpathPart)
         tpathPart.delete()
+        
+    def RemoveChild(self, child):
+        self.children.remove(child)
+        named= self.GetChildrenByName()
+        if named.get(name_key(child.name)) is child:
+            del named[name_key(child.name)]
+            
+    def MovePathPart(self, path, new_path):
+        '''
+        Moves index at path with its subtree to new_path, replacing
+        index that was there.
+        '''
+        if(self.name!=path[0] or self.name!=new_path[0]):
+            return
+        tpathPart= self
+        for name in path[1:]:
+            tpathPart= tpathPart.GetChildrenByName().get(name_key(name))
+            if(tpathPart==None):
+                return
+        
+        parent= self.GetPathPart(new_path[:-1], True)
+        existing= parent.GetChildrenByName().get(name_key(new_path[-1]))
+        if(existing!=None):
+            parent.RemoveChild(existing)
+            existing.delete()
+        tpathPart.parent.RemoveChild(tpathPart)
+        tpathPart.name= new_path[-1]
+        tpathPart.parent= parent
+        parent.children.append(tpathPart)
+        parent.GetChildrenByName()[name_key(tpathPart.name)]= tpathPart
     
     def __str__(self):
         absolute_path= '/'.join(self.AbsolutePath())
@@ -493,11 +610,13 @@ class FileIndex(pod.Object):
         return path 
         
     def pre_delete(self):
-        for child in self.children:
-            self.children.remove(child)
+        for child in list(self.children):
             child.delete()
 
         self.children.delete()
+        named= self.GetChildrenByName()
+        named.clear()
+        named.delete()
         
     def __deepcopy__(self, memo):
         not_there = []
@@ -514,7 +633,7 @@ class FileIndex(pod.Object):
         return dup
         
 class FileSyncConfig(pod.Object):
-    def __init__(self, source_path, dest_path, config_layer, name=None):
+    def __init__(self, source_path, dest_path, config_layer, name=None, index_backend="pod", compression=None):
         '''
         init
         @param source_path: Path to source used by pyfileaccess fsopendir
@@ -523,6 +642,12 @@ class FileSyncConfig(pod.Object):
         @type dest_path: String
         @param config_layer: Config layer to use
         @type config_layer: ConfigLayer
+        @param index_backend: "pod" keeps file indexes as FileIndex objects,
+                              "sqlite" keeps them in IndexStore table.
+        @type index_backend: String
+        @param compression: Codec spec, like "zlib:6", for links to sides
+                            served by psyncho-agent, or None.
+        @type compression: String
         '''
         pod.Object.__init__(self)
         
@@ -530,11 +655,55 @@ class FileSyncConfig(pod.Object):
         self.dest_path = dest_path
         self.config_layer = config_layer
         self.name= name
+        self.index_backend= index_backend
+        self.compression= compression
         
-        self.src_index= FileIndex("root")
-        self.dst_index= FileIndex("root")
+        self.src_index= None
+        self.dst_index= None
+        if index_backend=="pod":
+            self.src_index= FileIndex("root")
+            self.dst_index= FileIndex("root")
+        
+    def GetResume(self):
+        '''
+        @return: (plan file, actions done) of unfinished synch or None
+        '''
+        try:
+            # Cleared cursor is an empty tuple, pod can't store None
+            # over a tuple it loaded before.
+            return self.resume or None
+        except AttributeError:
+            return None
+        
+    def SetResume(self, plan_file, done):
+        self.resume= (plan_file, done)
+        
+    def ClearResume(self):
+        resume= self.GetResume()
+        if resume==None:
+            return
+        self.resume= ()
+        if os.path.exists(resume[0]):
+            os.remove(resume[0])
+        
+    def GetIndexBackend(self):
+        try:
+            return self.index_backend
+        except AttributeError:
+            # Configs stored before index backends were selectable.
+            return "pod"
+        
+    def GetCompression(self):
+        try:
+            return self.compression
+        except AttributeError:
+            return None
+        
+    def ClearIndexes(self, index_store= None):
+        if self.GetIndexBackend()=="sqlite":
+            index_store.Clear(self.name)
+            return
         
-    def ClearIndexes(self):
         self.src_index.delete()
         self.dst_index.delete()  
         self.src_index= FileIndex("root")
@@ -565,26 +734,82 @@ class FileSyncConfigManager(pod.Object):
             if config.name==name:
                 return config
         
+class _BudgetUsedUp(Exception):
+    #Stops the walk of a streamed synch.
+    pass
+
 class FileSync(object):
-    def __init__(self, file_sync_config, db= None):
+    def __init__(self, file_sync_config, db= None, index_store= None):
         '''
         init
         @param file_sync_config: Confg to use with synch.
         @type file_sync_config: FileSyncConfig
+        @param index_store: Store of indexes for synchs with sqlite backend.
+        @type index_store: IndexStore
         '''
         self.file_sync_config = file_sync_config
         self.cache_file_status= True
         self.db= db
-        
-    def SmallTime(self, time1, time2):
-        if abs(time1 - time2)<timedelta(seconds=1):
-            return True
-        
-        return False
-        
-    def sync(self, base_path= ["root"], verbose=True):
+        self.index_store= index_store
+        #Number of threads for getinfo calls on openers without bulk listing.
+        self.listing_jobs= 8
+        #Number of threads listing subdirectories ahead of the walk.
+        self.jobs= 1
+        #Number of threads copying files while walk goes on, with
+        #zero files are copied by the walk itself.
+        self.copy_jobs= 0
+        #Load indexes into CompactIndex before planning.
+        self.compact_index= False
+        #Updated files of at least this size only get changed blocks
+        #written, None turns delta transfer off.
+        self.delta_threshold= None
+        #Number of processes hashing large files.
+        self.hash_jobs= 4
+        #{side: object with Digest(path)}, that knows digests of side
+        #as it is now. Subtree is not walked, when both sides still have
+        #digests, that were stored after last synch. sync() adds agent
+        #sides and local sides synched with an agent.
+        self.digest_sources= {}
+        self.added_digest_sides= []
+        #Indexes are committed after this many actions or bytes.
+        self.checkpoint_actions= 1000
+        self.checkpoint_bytes= 256*1024*1024
+        #Seconds after which execution stops at a checkpoint, or None.
+        self.time_budget= None
+        self.start_time= datetime.now()
+        #File, where plan is kept until it is done, so synch can be
+        #resumed. With None synch can't be resumed.
+        self.resume_file= None
+        #Plan renames files and directories moved on one side, instead
+        #of copying them.
+        self.detect_moves= True
+        #Walk enters directories, that exist on both sides. Watch mode
+        #turns it off, because it walks every changed directory itself.
+        self.recursive= True
+        
+    def sync(self, base_path= ["root"], verbose=True, dry_run=False, resume=False):
+        '''
+        Synchs both sides. Actions are executed while the walk goes on,
+        so copy workers copy files, while the rest of the tree is listed.
+        Synch, that can be stopped by time budget and resumed, walks the
+        whole tree first and keeps the plan in resume_file.
+        @param dry_run: Only make the plan, nothing is changed on disk.
+        @type dry_run: bool
+        @param resume: Continue plan of a stopped synch from its last
+                       checkpoint, instead of walking again.
+        @type resume: bool
+        @return: SyncPlan
+        '''
         self.start_time= datetime.now()
         
+        plan= None
+        start= 0
+        if resume and not dry_run:
+            plan, start= self._resumed_plan()
+            if plan!=None:
+                base_path= list(plan.base_path)
+                if verbose: print "Resuming after %d of %d actions" % (start, len(plan))
+        
         if(self.file_sync_config.source_path):
             try:
                 src= fsopendir(self.file_sync_config.source_path)
@@ -600,9 +825,296 @@ class FileSync(object):
         else:
             return
         
-        #Make config as global var
-        self.config= self.file_sync_config.config_layer
-        self._synch_walk(src, dst, base_path, self.file_sync_config.src_index.GetPathPart(base_path, True), self.file_sync_config.dst_index.GetPathPart(base_path, True) )
+        compression= self.file_sync_config.GetCompression()
+        if compression:
+            for side_fs in [src, dst]:
+                if isinstance(side_fs, AgentFS) and not side_fs.SetCompression(compression) and verbose:
+                    print "Agent of %s can't compress with %s" % (side_fs, compression)
+        self._add_digest_sources(src, dst, base_path)
+
+        #Walk starts in base path, plan paths are relative to it.
+        if len(base_path)>1:
+            sub_path= "/".join(base_path[1:])
+            if not src.isdir(sub_path) or not dst.isdir(sub_path):
+                print "Path %s does not exist on both sides!" % (sub_path)
+                return
+            src= src.opendir(sub_path)
+            dst= dst.opendir(sub_path)
+        
+        if plan==None:
+            if not dry_run and not (self.resume_file and self.time_budget!=None):
+                self._stream(src, dst, base_path, verbose)
+                return self.plan
+            plan= self.Plan(src, dst, base_path, verbose)
+            if dry_run:
+                return plan
+            if self.resume_file:
+                with open(self.resume_file, "w") as out:
+                    plan.Dump(out)
+                self.file_sync_config.SetResume(self.resume_file, 0)
+        self.Execute(plan, src, dst, verbose, start)
+        return plan
+        
+    def _add_digest_sources(self, src, dst, base_path):
+        #Agents digest their side close to files. Local side of an agent
+        #is digested here by listing it, so walk can skip subtrees, that
+        #are unchanged on both sides. Sources set by caller are kept,
+        #the ones added by previous synch are replaced, their digests
+        #are old.
+        for side in self.added_digest_sides:
+            del self.digest_sources[side]
+        self.added_digest_sides= []
+        sides= {Side.src: src, Side.dst: dst}
+        agents= [side for side, side_fs in sides.items() if hasattr(side_fs, "Digest")]
+        if not agents:
+            return
+        for side, side_fs in sides.items():
+            if side in self.digest_sources:
+                continue
+            if side in agents:
+                self.digest_sources[side]= side_fs
+            elif side_fs.getsyspath("", allow_none= True)!=None:
+                self.digest_sources[side]= TreeDigester(side_fs, keep= True)
+            else:
+                continue
+            self.added_digest_sides.append(side)
+        #Once indexes have digests, agents list only directories, that
+        #walk enters, instead of scanning all of them first.
+        if len(self.digest_sources)==2 and None not in [self._digest(self._index_at(self._index_root(side), base_path)) for side in sides]:
+            for side in agents:
+                if hasattr(sides[side], "SetScan"):
+                    sides[side].SetScan(False)
+        
+    def _resumed_plan(self):
+        #@return: (plan, actions done) of stopped synch or (None, 0)
+        resume= self.file_sync_config.GetResume()
+        if resume==None or not os.path.exists(resume[0]):
+            return (None, 0)
+        with open(resume[0]) as inp:
+            return (SyncPlan.Load(inp), resume[1])
+        
+    def watch(self, settle= 1.0, verbose=True):
+        '''
+        Synchs both sides and then keeps synching directories, that
+        inotify reports as changed. Only local directories can be watched.
+        Directories are walked without entering subdirectories, changes
+        under them have their own events. When kernel drops events whole
+        tree is synched again.
+        @param settle: Seconds without events before changes are synched.
+        @type settle: float
+        '''
+        roots= []
+        for path in [self.file_sync_config.source_path, self.file_sync_config.dest_path]:
+            root= fsopendir(path).getsyspath("/", allow_none=True)
+            if root==None:
+                print "Can't watch %s, it is not a local directory!" % (path)
+                return
+            roots.append(root)
+        
+        #Watches go in before the first synch, so nothing is missed.
+        watcher= TreeWatcher(roots)
+        try:
+            self.sync(["root"], verbose)
+            self._commit_indexes()
+            while True:
+                changes= watcher.Wait(settle)
+                if changes==None:
+                    continue
+                (dirty, overflow)= changes
+                if overflow:
+                    if verbose: print "Events were lost, synching everything"
+                    self.sync(["root"], verbose)
+                else:
+                    self.recursive= False
+                    try:
+                        for path in synch_roots(dirty):
+                            self.sync(["root"]+list(path), verbose)
+                    finally:
+                        self.recursive= True
+                self._commit_indexes()
+        finally:
+            watcher.Close()
+            
+    def _commit_indexes(self):
+        #Index store goes first, pod commit also stores resume cursor.
+        if self.index_store:
+            self.index_store.Commit()
+        if self.db:
+            self.db.commit()
+        
+    def Plan(self, src, dst, base_path= ["root"], verbose=True, stream= None):
+        '''
+        Walks both sides and decides what has to be done, without
+        changing files or indexes.
+        @param stream: function(), that walk calls before listing every
+                       directory, so actions planned so far can be
+                       executed meanwhile
+        @return: SyncPlan
+        '''
+        self.stream= stream
+        #Make config as global var, compiled once so path status
+        #lookups don't have to walk pod objects for every file.
+        self.config= self.file_sync_config.config_layer.Compiled()
+        self.plan= SyncPlan(base_path)
+        self.lister= DirLister(self.listing_jobs)
+        self.prefetcher= None
+        if self.jobs>1:
+            self.prefetcher= SubtreePrefetcher(self.lister, self.jobs)
+        #Content digests for features that compare files by content.
+        self.hash_caches= None
+        if self.index_store:
+            self.hash_caches= {Side.src: HashCache(self.index_store, self.file_sync_config.name, Side.src, self.hash_jobs),
+                               Side.dst: HashCache(self.index_store, self.file_sync_config.name, Side.dst, self.hash_jobs)}
+        src_i= self._index_at(self._index_root(Side.src), base_path)
+        dst_i= self._index_at(self._index_root(Side.dst), base_path)
+        #Planning only reads indexes, so they can be kept compact.
+        if self.compact_index:
+            if src_i!=None: src_i= CompactIndex.FromIndex(src_i).Root()
+            if dst_i!=None: dst_i= CompactIndex.FromIndex(dst_i).Root()
+        self.known_digests= {}
+        self.moves= None
+        #Files can only move away from paths, that indexes know.
+        if self.detect_moves and ((src_i!=None and src_i.HasEntries()) or (dst_i!=None and dst_i.HasEntries())):
+            digest= None
+            if self.hash_caches:
+                digest= lambda side, files: self.hash_caches[side].GetAll(files)
+            self.moves= MoveDetector(digest)
+        try:
+            #Nothing is listed, when the whole tree is unchanged.
+            if self._current_digests(base_path, src_i, dst_i):
+                if verbose: print "Tree is unchanged"
+            else:
+                self._synch_walk(src, dst, base_path, src_i, dst_i, 0, None, verbose)
+            if self.moves:
+                moves= self.moves.Apply(self.plan)
+                if verbose and moves: print "%d moves found" % (moves)
+        finally:
+            if self.prefetcher:
+                self.prefetcher.Close()
+            if self.hash_caches:
+                for cache in self.hash_caches.values():
+                    cache.Close()
+            self.lister.Close()
+            
+        return self.plan
+        
+    def Execute(self, plan, src, dst, verbose=True, start= 0):
+        '''
+        Applies actions of a plan in plan order, files are copied by
+        copy workers when copy_jobs is set. Indexes are committed at
+        checkpoints together with number of actions done, so a stopped
+        synch can be resumed.
+        @type plan: SyncPlan
+        @param start: Number of actions done before
+        @type start: int
+        @return: True when all actions are done, False when time budget
+                 stopped execution at a checkpoint.
+        '''
+        self._start_execution(start)
+        try:
+            if not self._execute_actions(plan, plan.actions[start:], src, dst, verbose, start>0):
+                return False
+        finally:
+            self._finish_execution()
+        self.file_sync_config.ClearResume()
+        return True
+        
+    def _stream(self, src, dst, base_path, verbose):
+        '''
+        Plans and executes at once. Before every listing the walk
+        executes actions planned so far, except the ones move detection
+        may still change, those are executed after the walk.
+        @return: True when all actions are done, False when time budget
+                 stopped the synch.
+        '''
+        self._start_execution()
+        executed= set() # Actions done, they stay the same objects.
+        state= {"next": 0}
+        def stream():
+            actions= []
+            for number in range(state["next"], len(self.plan)):
+                action= self.plan.actions[number]
+                if not (self.moves and self.moves.Holds(number, action)):
+                    actions.append(action)
+            state["next"]= len(self.plan)
+            executed.update(actions)
+            if not self._execute_actions(self.plan, actions, src, dst, verbose):
+                raise _BudgetUsedUp()
+        try:
+            try:
+                self.Plan(src, dst, base_path, verbose, stream)
+                left= [action for action in self.plan if action not in executed]
+                if not self._execute_actions(self.plan, left, src, dst, verbose):
+                    return False
+            except _BudgetUsedUp:
+                return False
+        finally:
+            self.stream= None
+            self._finish_execution()
+        self.file_sync_config.ClearResume()
+        return True
+        
+    def _start_execution(self, done= 0):
+        self.transfers= None
+        if self.copy_jobs>0:
+            self.transfers= TransferQueue(self.copy_jobs)
+        self.done= done
+        #Actions and bytes since last checkpoint.
+        self.unsaved= (0, 0)
+        
+    def _execute_actions(self, plan, actions, src, dst, verbose, resumed= False):
+        '''
+        @param resumed: Actions might be done already, their errors are
+                        skipped.
+        @return: False when time budget stopped execution at a checkpoint
+        '''
+        for action in actions:
+            if self._over_budget():
+                self._checkpoint(self.done)
+                if verbose: print "Time budget is used up, stopped after %d of %d actions" % (self.done, len(plan))
+                return False
+            
+            if verbose and action.kind!=ActionKind.digest: print action
+            if resumed:
+                # Actions after checkpoint might be done already.
+                try:
+                    self._execute_action(plan, action, src, dst)
+                except (fs.errors.FSError, OSError), e:
+                    if verbose: print "Skipping: %s" % (e)
+            else:
+                self._execute_action(plan, action, src, dst)
+            if self.transfers:
+                self.transfers.ApplyCompleted()
+            self.done+= 1
+                
+            #Save file indexes to database from time to time.
+            (count, size)= self.unsaved
+            (count, size)= (count+1, size+(action.size or 0))
+            if count>=self.checkpoint_actions or size>=self.checkpoint_bytes:
+                self._checkpoint(self.done)
+                (count, size)= (0, 0)
+            self.unsaved= (count, size)
+        return True
+        
+    def _finish_execution(self):
+        if self.transfers:
+            self.transfers.Finish()
+        #Final barrier, all index writes are committed.
+        if self.index_store:
+            self.index_store.Commit()
+        
+    def _over_budget(self):
+        if self.time_budget==None:
+            return False
+        return datetime.now()-self.start_time>timedelta(seconds=self.time_budget)
+        
+    def _checkpoint(self, done):
+        #Every action before done has its index updates applied.
+        if self.transfers:
+            self.transfers.Wait()
+        if self.file_sync_config.GetResume()!=None:
+            self.file_sync_config.SetResume(self.file_sync_config.GetResume()[0], done)
+        self._commit_indexes()
         
     def dt2ut(self, date):
         return int(mktime(date.timetuple()))
@@ -610,62 +1122,77 @@ class FileSync(object):
     def ut2dt(self, date):
         return datetime.fromtimestamp(date)
         
+    def _by_side(self, side, a, b):
+        #Orders (from, to) pair of a copy to side as (src, dst) and
+        #(src, dst) back as (from, to).
+        if side==Side.dst:
+            return (a, b)
+        return (b, a)
+    
+    def _other_side(self, side):
+        if side==Side.dst:
+            return Side.src
+        return Side.dst
+        
+    def _index_child(self, index, name):
+        #Indexes are only read while planning, missing ones are None.
+        if index==None:
+            return None
+        return index.GetChildrenByName().get(name_key(name))
+    
+    def _index_at(self, index, path):
+        if index.name!=path[0]:
+            return None
+        for name in path[1:]:
+            index= self._index_child(index, name)
+            if index==None:
+                break
+        return index
+    
+    def _index_root(self, side):
+        if self.file_sync_config.GetIndexBackend()=="sqlite":
+            return self.index_store.Root(self.file_sync_config.name, side)
+        if side==Side.src:
+            return self.file_sync_config.src_index
+        return self.file_sync_config.dst_index
+    
+    def _index_for(self, side, path):
+        return self._index_root(side).GetPathPart(list(path), True)
+        
+    def _list(self, fs):
+        #Side, that does not exist yet, is empty.
+        if fs==None:
+            return []
+        return self.lister.ListDir(fs)
+        
     def _synch_walk(self, src, dst, path, src_i, dst_i, depth= 0, cached_status= None, verbose=True):
-        #Get list of files in dirs        
-        src_files= src.listdir()
-        dst_files= dst.listdir()
-        
-        #This operations are considered slow,
-        #so we want to do them only once.
-        src_info= [src.getinfo(i) for i in src_files]
-        dst_info= [dst.getinfo(i) for i in dst_files]
-        
-        src_f= []
-        src_d= []
-        src_l=[]
-        for id, i in enumerate(src_files):
-            if is_file( src_info[id] ): src_f.append( (i,src_info[id]) )
-            elif is_dir( src_info[id] ): src_d.append( (i,src_info[id]) )
-            elif is_lnk( src_info[id] ): src_l.append( (i,src_info[id]) )
-            else: pass #If file/dir is something we don't know we just pass.
+        '''
+        @return: (src digest, dst digest) of directory, or None when
+                 directory is changed by the plan or not fully walked.
+        '''
+        changes= self.plan.changes
+        if self.stream:
+            self.stream()
+        #Get list of files in dirs together with their info,
+        #this operations are considered slow, so we want to
+        #do them only once.
+        listing= None
+        if self.prefetcher:
+            listing= self.prefetcher.Take(tuple(path))
+        if listing:
+            (src_entries, dst_entries)= listing
+        else:
+            src_entries= self._list(src)
+            dst_entries= self._list(dst)
+        
+        #Sort objects by kind and side in one pass over both listings.
+        diff= diff_dirs(src_entries, dst_entries)
+        for file, sinfo, dinfo in diff.type_changes:
+            if verbose: print "\t"*depth+"Object type differs, skipping: "+file
+        
+        if self.prefetcher:
+            self._prefetch_subdirs(src, dst, path, src_i, dst_i, diff)
             
-        dst_f= []
-        dst_d= []
-        dst_l=[]
-        for id, i in enumerate(dst_files):
-            if is_file( dst_info[id] ): dst_f.append( (i,dst_info[id]) )
-            elif is_dir( dst_info[id] ): dst_d.append( (i,dst_info[id]) )
-            elif is_lnk( dst_info[id] ): dst_l.append( (i,dst_info[id]) )
-            else: pass #If file/dir is something we don't know we just pass.
-
-        #This operations are considered fast
-        #Src
-        copy_src_files = [(i,info) for i, info in src_f if i not in dst_files or (i, info) in dst_d]
-        copy_src_dirs = [(i, info) for i, info in src_d if i not in dst_files or (i, info) in dst_f]
-        make_src_links = [(i,info) for i, info in src_l if i not in dst_files]
-        #Dst
-        copy_dst_files = [(i,info) for i, info in dst_f if i not in src_files or (i, info) in src_d]
-        copy_dst_dirs = [i for i, info in dst_d if i not in src_files or (i, info) in src_f]
-        make_dst_links = [(i,info) for i, info in dst_l if i not in src_files]
-        
-        #Update files are in src and dst the same.
-        #Files that are not in those files we are about to copy.
-        update_files=[]
-        for i1, sinfo in src_f:
-            if (i1, sinfo) not in copy_src_files:
-                for i2, dinfo in dst_f:
-                    if i1==i2: update_files.append((i1, sinfo, dinfo))
-        print update_files
-        #Dirs that are not in those dirs we are about to copy.
-        update_dirs=[]
-        for i1, sinfo in src_d:
-            if (i1, dinfo) not in copy_src_dirs: update_dirs.append((i1,sinfo,dinfo))
-        update_links=[]
-        for i1, sinfo in src_l:
-            if (i1, sinfo) not in make_src_links:
-                for i2, dinfo in dst_l:
-                    if i1==i2: update_links.append((i1, sinfo, dinfo))
-                
         #Select truncated based on if we have chached_status or not,
         #this way we don't have to pass another variable around.
         if cached_status: truncated= True
@@ -673,27 +1200,55 @@ class FileSync(object):
         
         #Do all the hard work.
         #src->dst
-        self._copy_files(src, dst, path, src_i, dst_i, copy_src_files, truncated, depth, cached_status, verbose)
-        self._copy_dirs(src, dst, path, src_i, dst_i, copy_src_dirs, truncated, depth, cached_status, verbose)
-        self._make_links(src, dst, path, src_i, dst_i, make_src_links, truncated, depth, cached_status, verbose)
+        self._copy_files(src, dst, path, src_i, dst_i, diff.copy_src_files, Side.dst, truncated, depth, cached_status, verbose)
+        self._copy_dirs(src, dst, path, src_i, dst_i, diff.copy_src_dirs, Side.dst, truncated, depth, cached_status, verbose)
+        self._make_links(src, dst, path, src_i, dst_i, diff.make_src_links, Side.dst, truncated, depth, cached_status, verbose)
         #dst->src
-        self._copy_files(dst, src, path, dst_i, src_i, copy_dst_files, truncated, depth, cached_status, verbose)
-        self._copy_dirs(dst, src, path, dst_i, src_i, copy_dst_dirs, truncated, depth, cached_status, verbose)
-        self._make_links(dst, src, path, dst_i, src_i, make_dst_links, truncated, depth, cached_status, verbose)
+        self._copy_files(dst, src, path, dst_i, src_i, diff.copy_dst_files, Side.src, truncated, depth, cached_status, verbose)
+        self._copy_dirs(dst, src, path, dst_i, src_i, diff.copy_dst_dirs, Side.src, truncated, depth, cached_status, verbose)
+        self._make_links(dst, src, path, dst_i, src_i, diff.make_dst_links, Side.src, truncated, depth, cached_status, verbose)
         #dst<->src
-        self._update_files(src, dst, path, src_i, dst_i, update_files, truncated, depth, cached_status, verbose)
-        self._update_dirs(src, dst, path, src_i, dst_i, update_dirs, truncated, depth, cached_status, verbose)
-        self._update_links(src, dst, path, src_i, dst_i, update_links, truncated, depth, cached_status, verbose)
+        self._update_files(src, dst, path, src_i, dst_i, diff.update_files, truncated, depth, cached_status, verbose)
+        subdir_digests= self._update_dirs(src, dst, path, src_i, dst_i, diff.update_dirs, truncated, depth, cached_status, verbose)
+        self._update_links(src, dst, path, src_i, dst_i, diff.update_links, truncated, depth, cached_status, verbose)
         #We have to check if permissions have been changed on files links and dirs.
-        self._update_permissions(src, dst, update_files+update_dirs+update_links, truncated, depth, cached_status, verbose)
+        self._update_permissions(src, dst, path, diff.update_files+diff.update_dirs+diff.update_links, truncated, depth, cached_status, verbose)
         
-        #Save file indexes to database from time to time.
-        if datetime.now()-self.start_time>timedelta(seconds=100):
-            print "Commit CommitCommitCommitCommitCommitCommitCommitCommitCommitCommitCommit"
-            self.db.commit()
-            self.start_time= datetime.now()
+        if self.prefetcher:
+            self.prefetcher.Done(tuple(path))
+            
+        #Nothing under directory changes, so digests of listings are
+        #what indexes should know after synch.
+        if self.plan.changes!=changes or diff.type_changes or src==None or dst==None:
+            return None
+        digests= (dir_digest(src_entries, dict((name, pair[0]) for name, pair in subdir_digests.items())),
+                  dir_digest(dst_entries, dict((name, pair[1]) for name, pair in subdir_digests.items())))
+        if digests[0]==None or digests[1]==None:
+            return None
+        for side, index, digest in [(Side.src, src_i, digests[0]), (Side.dst, dst_i, digests[1])]:
+            if self._digest(index)!=digest:
+                self.plan.Add(ActionKind.digest, side, path, target= digest)
+        return digests
             
-    def _copy_files(self, src, dst, path, src_i, dst_i, files, truncated= False, depth= 0, cached_status= None,verbose=True):
+    def _prefetch_subdirs(self, src, dst, path, src_i, dst_i, diff):
+        #Same order as _synch_walk enters them. Status is only a hint
+        #here, listing a directory that walk skips is just wasted.
+        subdirs= []
+        for file, info in diff.copy_src_dirs:
+            if self._may_enter(path+[file]): subdirs.append((file, src.opendir(file), None))
+        for file, info in diff.copy_dst_dirs:
+            if self._may_enter(path+[file]): subdirs.append((file, None, dst.opendir(file)))
+        for file, sinfo, dinfo in diff.update_dirs:
+            if self.recursive and self._may_enter(path+[file]) and \
+               not self._current_digests(path+[file], self._index_child(src_i, file), self._index_child(dst_i, file)):
+                subdirs.append((file, src.opendir(file), dst.opendir(file)))
+        self.prefetcher.Schedule(tuple(path), subdirs)
+        
+    def _may_enter(self, path):
+        status= self.config.GetPathStatus(path)
+        return status==PathStatus.include or (status==PathStatus.ignore and self.config.PathExists(path))
+            
+    def _copy_files(self, src, dst, path, src_i, dst_i, files, side, truncated= False, depth= 0, cached_status= None,verbose=True):
         if verbose and files: print "\t"*depth+"Copy files"
         status= cached_status
         for file, info in files:
@@ -701,32 +1256,17 @@ class FileSync(object):
             if not cached_status or cached_status==PathStatus.ignore or not self.cache_file_status:
                 status= self.config.GetPathStatus(path+[file])
             if status==PathStatus.include:
-                src_index= None
-                dst_index= None
-                src_mtime= info["modified_time"]
-                src_filesize= info["size"]
-                
-                try:
-                    copyfile(src, file, dst, file)
-                    #Change mod of newly created file
-                    #to mod of a source file
-                    dst.chmod(file, get_fmod(info))
-                except:
-                    continue
-                if src_filesize>=0:
-                    print "Sync synch synch..............................."
-                    src_index= src_i.GetPathPart([src_i.name,file], True)
-                    dst_index= dst_i.GetPathPart([dst_i.name,file], True)
-                    src_index.CreationTime= self.dt2ut(src_mtime)
-                    dst_index.CreationTime= self.dt2ut(dst.getinfo(file)["modified_time"])   
+                if self.moves:
+                    self._move_candidate(src, path, src_i, dst_i, file, info, side)
+                self.plan.Add(ActionKind.copy, side, path+[file], get_fmod(info), info["size"], get_file_fingerprint(info), True)
             if status==PathStatus.stop:
                 if verbose: print "\t"*depth+"Removing file"
-                src.remove(file)    
+                self.plan.Add(ActionKind.remove, self._other_side(side), path+[file])
                 
-    def _copy_dirs(self, src, dst, path, src_i, dst_i, dirs, truncated= False, depth= 0, cached_status= None,verbose=True):
+    def _copy_dirs(self, src, dst, path, src_i, dst_i, dirs, side, truncated= False, depth= 0, cached_status= None,verbose=True):
         if verbose and dirs: print "\t"*depth+"Copy dirs"
         status= cached_status
-        for file, sinfo, dinfo in dirs:
+        for file, sinfo in dirs:
             if verbose: print "\t"*depth+"Object: "+file
             l_cached_status= None
             if not cached_status:
@@ -735,19 +1275,30 @@ class FileSync(object):
                 l_cached_status= status
             if status==PathStatus.include or (status==PathStatus.ignore and self.config.PathExists(path+[file])):
                 if verbose: print "\t"*depth+"dir_enter->"
-                new_src= src.makeopendir(file)
-                new_dst= dst.makeopendir(file)
-                #Change mod of newly created file
-                #to mod of a source file
-                dst.chmod(file, get_fmod(sinfo))
-                self._synch_walk(new_src, new_dst, path[:]+[file], src_i.GetPathPart([src_i.name,file], True), dst_i.GetPathPart([dst_i.name,file], True), depth+1, l_cached_status)
+                #New dir gets mod of a source dir.
+                if self.moves:
+                    self.moves.MakeDir(side, path+[file], len(self.plan))
+                self.plan.Add(ActionKind.mkdir, side, path+[file], get_fmod(sinfo))
+                (new_src, new_dst)= self._by_side(side, src.opendir(file), None)
+                (new_src_i, new_dst_i)= self._by_side(side, self._index_child(src_i, file), self._index_child(dst_i, file))
+                self._synch_walk(new_src, new_dst, path[:]+[file], new_src_i, new_dst_i, depth+1, l_cached_status, verbose)
                 if verbose: print "\t"*depth+"<-dir_leave"
             elif status==PathStatus.stop:
                 if verbose: print "\t"*depth+"Removing dir"
-                src.removedir(file, force=True)
+                self.plan.Add(ActionKind.removedir, self._other_side(side), path+[file])
             else:
                 pass
                 
+    def _move_candidate(self, src, path, src_i, dst_i, file, info, side):
+        #File, that is copied to side, is either new on the other side,
+        #or it was synched before and it is missing on side now.
+        fingerprint= self._fingerprint(self._index_child(dst_i, file))
+        if fingerprint!=None:
+            self.moves.Missing(side, path+[file], fingerprint, info, src, file, len(self.plan),
+                               self._fingerprint(self._index_child(src_i, file)))
+        else:
+            self.moves.New(self._other_side(side), path+[file], info, src, file, len(self.plan))
+                
     def _update_files(self, src, dst, path, src_i, dst_i, files, truncated= False, depth= 0, cached_status= None,verbose=True):
         if verbose and files: print "\t"*depth+"Update files"
         status= cached_status
@@ -757,111 +1308,90 @@ class FileSync(object):
                 (truncated, status)= self.config.GetPathStatus(path+[file], True)
                 
             if status==PathStatus.include:
-                src_index= None
-                dst_index= None
-                src_mtime= sinfo["modified_time"]
-                src_filesize= src.getsize(file)
-                dst_mtime= dinfo["modified_time"]
-                dst_filesize= dst.getsize(file)
+                src_fingerprint= get_file_fingerprint(sinfo)
+                dst_fingerprint= get_file_fingerprint(dinfo)
                 
                 if verbose: print "\t"*depth+"Synching file"
-                if src_filesize>1000 or dst_filesize>1000:
-                    src_index= src_i.GetPathPart([src_i.name,file], True)
-                    dst_index= dst_i.GetPathPart([dst_i.name,file], True)
-                #If we get error when getting indexes, just action based on scr or dst mtime
-                if src_index==None or dst_index==None:
-                    if src_mtime>dst_mtime:
-                        try:
-                            copyfile(src, file, dst, file)
-                        except:
-                            continue
-                    else:
-                        try:
-                            copyfile(dst, file, src, file)
-                        except:
-                            continue
-                #Create index time, if it does not exist yet.
-                elif src_index.CreationTime==None or dst_index.CreationTime==None:
-                    if verbose: print "\t"*depth+"No index time found."
-                    if src_mtime>dst_mtime:
-                        try:
-                            copyfile(src, file, dst, file)
-                        except:
-                            continue
-                        src_index.CreationTime= self.dt2ut(src_mtime)
-                        dst_index.CreationTime= self.dt2ut(dst.getinfo(file)["modified_time"])
+                src_index= self._index_child(src_i, file)
+                dst_index= self._index_child(dst_i, file)
+                src_unchanged= self._unchanged(src_index, sinfo, src_fingerprint)
+                dst_unchanged= self._unchanged(dst_index, dinfo, dst_fingerprint)
+                #both files are unchanged
+                if src_unchanged and dst_unchanged:
+                    if verbose: print "\t"*depth+"Both files are synched"
+                #src has changed and dst has not
+                elif dst_unchanged:
+                    if verbose: print "\t"*depth+"Src file has changed, but dst not"
+                    self.plan.Add(ActionKind.update, Side.dst, path+[file], None, sinfo["size"], src_fingerprint, True)
+                #dst has changed and src has not
+                elif src_unchanged:
+                    if verbose: print "\t"*depth+"Dst file has changed, but src not"
+                    self.plan.Add(ActionKind.update, Side.src, path+[file], None, dinfo["size"], dst_fingerprint, True)
+                #both files has changed or were never synched, newer wins
+                else:
+                    if verbose: print "\t"*depth+"Both files has changed."
+                    if src_fingerprint[0]>dst_fingerprint[0]:
+                        self.plan.Add(ActionKind.update, Side.dst, path+[file], None, sinfo["size"], src_fingerprint, True)
                     else:
-                        try:
-                            copyfile(dst, file, src, file)
-                        except:
-                            continue
-                        dst_index.CreationTime= self.dt2ut(dst_mtime)
-                        src_index.CreationTime= self.dt2ut(src.getinfo(file)["modified_time"])
-                #When indexes exist
-                else:    
-                    #both files are unchanged
-                    if self.SmallTime(src_mtime, self.ut2dt(src_index.CreationTime)) and self.SmallTime(dst_mtime, self.ut2dt(dst_index.CreationTime)):
-                        if verbose: print "\t"*depth+"Both files are synched"
-                    #src has changed and dst has not
-                    elif self.ut2dt(src_index.CreationTime)<src_mtime and self.SmallTime(dst_mtime, self.ut2dt(dst_index.CreationTime)):
-                        if verbose: print "\t"*depth+"Src file has changed, but dst not"
-                        try:
-                            copyfile(src, file, dst, file)
-                        except:
-                            continue
-                        dst_index.CreationTime= self.dt2ut(dst.getinfo(file)["modified_time"])
-                    #dst has changed and src has not
-                    elif self.ut2dt(dst_index.CreationTime)<dst_mtime and self.SmallTime(src_mtime, self.ut2dt(src_index.CreationTime)):
-                        if verbose: print "\t"*depth+"Dst file has changed, but src not"
-                        try:
-                            copyfile(dst, file, src, file)
-                        except:
-                            continue
-                        src_index.CreationTime= self.dt2ut(src.getinfo(file)["modified_time"])
-                    #both files has changed, update indexes 
-                    elif not self.SmallTime(src_mtime, self.ut2dt(src_index.CreationTime)) and not self.SmallTime(dst_mtime, self.ut2dt(dst_index.CreationTime)):
-                        if verbose: print "\t"*depth+"Both files has changed."
-                        if src_mtime>dst_mtime:
-                            try:
-                                copyfile(src, file, dst, file)
-                            except:
-                                continue
-                            src_index.CreationTime= self.dt2ut(src_mtime)
-                            dst_index.CreationTime= self.dt2ut(dst.getinfo(file)["modified_time"])
-                        else:
-                            try:
-                                copyfile(dst, file, src, file)
-                            except:
-                                continue
-                            dst_index.CreationTime= self.dt2ut(dst_mtime)
-                            src_index.CreationTime= self.dt2ut(src.getinfo(file)["modified_time"])
+                        self.plan.Add(ActionKind.update, Side.src, path+[file], None, dinfo["size"], dst_fingerprint, True)
             #If we have stop on file just delete it on both sides
             if status==PathStatus.stop:
                 if verbose: print "\t"*depth+"Removing file"
-                src.remove(file)
-                dst.remove(file)
+                self.plan.Add(ActionKind.remove, Side.both, path+[file])
                             
     def _update_dirs(self, src, dst, path, src_i, dst_i, dirs, truncated= False,depth= 0, cached_status= None,verbose=True):
+        '''
+        @return: {name: (src digest, dst digest)} of directories, that
+                 have digests after the walk.
+        '''
         if verbose and dirs: print "\t"*depth+"Update dirs"
+        subdir_digests= {}
         status= cached_status
-        for file in dirs:
+        for file, sinfo, dinfo in dirs:
             if verbose: print "\t"*depth+"Object: "+file
             if not cached_status or not self.cache_file_status:
                 (truncated, status)= self.config.GetPathStatus(path+[file], True)
             if truncated:
                 cached_status= status
+            if not self.recursive and status!=PathStatus.stop:
+                continue
             if status==PathStatus.include or (status==PathStatus.ignore and self.config.PathExists(path+[file])):
+                new_src_i= self._index_child(src_i, file)
+                new_dst_i= self._index_child(dst_i, file)
+                digests= self._current_digests(path+[file], new_src_i, new_dst_i)
+                if digests:
+                    if verbose: print "\t"*depth+"Subtree is unchanged"
+                    subdir_digests[file]= digests
+                    continue
                 if verbose: print "\t"*depth+"dir_enter->"
-                new_src= src.makeopendir(file)
-                new_dst= dst.makeopendir(file)
-                self._synch_walk(new_src, new_dst, path[:]+[file], src_i.GetPathPart([src_i.name,file], True), dst_i.GetPathPart([dst_i.name,file], True), depth+1, cached_status)
+                new_src= src.opendir(file)
+                new_dst= dst.opendir(file)
+                digests= self._synch_walk(new_src, new_dst, path[:]+[file], new_src_i, new_dst_i, depth+1, cached_status, verbose)
+                if digests:
+                    subdir_digests[file]= digests
                 if verbose: print "\t"*depth+"<-dir_leave"
             elif status==PathStatus.stop:
                 if verbose: print "\t"*depth+"Removing dir"
-                src.removedir(file, force=True) 
-                dst.removedir(file, force=True)
+                self.plan.Add(ActionKind.removedir, Side.both, path+[file])
+        return subdir_digests
                 
-    def _make_links(self, src, dst, path, src_i, dst_i, links, truncated= False,depth= 0, cached_status= None,verbose=True):
+    def _current_digests(self, path, src_i, dst_i):
+        #Stored digests, when digest sources of both sides still have them.
+        if Side.src not in self.digest_sources or Side.dst not in self.digest_sources:
+            return None
+        digests= (self._digest(src_i), self._digest(dst_i))
+        if digests[0]==None or digests[1]==None:
+            return None
+        #Prefetch asks before the walk, sources are asked once.
+        key= tuple(path)
+        if key not in self.known_digests:
+            self.known_digests[key]= (self.digest_sources[Side.src].Digest(path)==digests[0] and
+                                      self.digest_sources[Side.dst].Digest(path)==digests[1])
+        if not self.known_digests[key]:
+            return None
+        return digests
+                
+    def _make_links(self, src, dst, path, src_i, dst_i, links, side, truncated= False,depth= 0, cached_status= None,verbose=True):
         if verbose and links: print "\t"*depth+"Make links"
         status= cached_status
         for link, info in links:
@@ -873,16 +1403,14 @@ class FileSync(object):
             if status==PathStatus.include:
                 lnk= src.readlink(link)
                 if verbose: print "\t"*depth+"Creating link to"+lnk
-                dst.symlink(lnk, link)
-                #Change mod of newly created link
-                #to mod of a source link
-                dst.chmod(link, get_fmod(info))
+                #New link gets mod of a source link.
+                self.plan.Add(ActionKind.symlink, side, path+[link], get_fmod(info), None, None, False, lnk)
             elif status==PathStatus.stop:
                 if verbose: print "\t"*depth+"Removing link"
-                src.remove(link)
+                self.plan.Add(ActionKind.remove, self._other_side(side), path+[link])
                 
-    def _update_permissions(self, src, dst, files, truncated= False,depth= 0, cached_status= None,verbose=True):):
-        if verbose and links: print "\t"*depth+"Update permissions"
+    def _update_permissions(self, src, dst, path, files, truncated= False,depth= 0, cached_status= None,verbose=True):
+        if verbose and files: print "\t"*depth+"Update permissions"
         
         #Here we can't act based on modification time,
         #so we have to decide based on options.
@@ -890,9 +1418,8 @@ class FileSync(object):
             if verbose: print "\t"*depth+"Object: "+file
             #We update in case if st_modes are different
             #this should be sufficient detection.
-            if get_fmod(sinfo["st_mode"])!=get_fmod(dinfo["st_mode"]):
-                dst.chmod(file, get_fmod(sinfo))
-                #src.chmod(file, dmod)
+            if get_fmod(sinfo)!=get_fmod(dinfo):
+                self.plan.Add(ActionKind.chmod, Side.dst, path+[file], get_fmod(sinfo))
                 
     def _update_links(self, src, dst, path, src_i, dst_i, links, truncated= False,depth= 0, cached_status= None,verbose=True):
         if verbose and links: print "\t"*depth+"Update links"
@@ -912,86 +1439,151 @@ class FileSync(object):
                     continue
                 
                 #In case links are different use
-                src_index= None
-                dst_index= None
-                src_mtime= sinfo["modified_time"]
-                dst_mtime= dinfo["modified_time"]
+                src_fingerprint= get_file_fingerprint(sinfo)
+                dst_fingerprint= get_file_fingerprint(dinfo)
                 
                 if verbose: print "\t"*depth+"Synching links"
-                src_index= src_i.GetPathPart([src_i.name,file], True)
-                dst_index= dst_i.GetPathPart([dst_i.name,file], True)
-                #If we get error when getting indexes, just action based on scr or dst mtime
-                if src_index==None or dst_index==None:
-                    if src_mtime>dst_mtime:
-                        try:
-                            dst.remove(file)
-                            dst.symlink(slnk, file)
-                        except: continue
-                    else:
-                        try:
-                            src.remove(file)
-                            src.symlink(dlnk, file)
-                        except: continue
-                #Create index time, if it does not exist yet.
-                elif src_index.CreationTime==None or dst_index.CreationTime==None:
-                    if verbose: print "\t"*depth+"No index time found."
-                    if src_mtime>dst_mtime:
-                        try:
-                            dst.remove(file)
-                            dst.symlink(slnk, file)
-                        except: continue
-                        src_index.CreationTime= self.dt2ut(src_mtime)
-                        dst_index.CreationTime= self.dt2ut(dst.getinfo(file)["modified_time"])
+                src_index= self._index_child(src_i, file)
+                dst_index= self._index_child(dst_i, file)
+                src_unchanged= self._unchanged(src_index, sinfo, src_fingerprint)
+                dst_unchanged= self._unchanged(dst_index, dinfo, dst_fingerprint)
+                #both links are unchanged
+                if src_unchanged and dst_unchanged:
+                    if verbose: print "\t"*depth+"Links were created at the same time, use one of them."
+                    #We must copy one of the links.
+                    self.plan.Add(ActionKind.relink, Side.dst, path+[file], target= slnk)
+                #src has changed and dst has not
+                elif dst_unchanged:
+                    if verbose: print "\t"*depth+"Src link has changed, but dst not"
+                    self.plan.Add(ActionKind.relink, Side.dst, path+[file], None, None, src_fingerprint, True, slnk)
+                #dst has changed and src has not
+                elif src_unchanged:
+                    if verbose: print "\t"*depth+"Dst link has changed, but src not"
+                    self.plan.Add(ActionKind.relink, Side.src, path+[file], None, None, dst_fingerprint, True, dlnk)
+                #both links has changed or were never synched, newer wins
+                else:
+                    if verbose: print "\t"*depth+"Both links has changed."
+                    if src_fingerprint[0]>dst_fingerprint[0]:
+                        self.plan.Add(ActionKind.relink, Side.dst, path+[file], None, None, src_fingerprint, True, slnk)
                     else:
-                        try:
-                            src.remove(file)
-                            src.symlink(dlnk, file)
-                        except: continue
-                        dst_index.CreationTime= self.dt2ut(dst_mtime)
-                        src_index.CreationTime= self.dt2ut(src.getinfo(file)["modified_time"])
-                #When indexes exist
-                else:    
-                    #both files are unchanged
-                    if self.SmallTime(src_mtime, self.ut2dt(src_index.CreationTime)) and self.SmallTime(dst_mtime, self.ut2dt(dst_index.CreationTime)):
-                        if verbose: print "\t"*depth+"Links were created at the same time, use one of them."
-                        #We must copy one of the links.
-                        dst.remove(file)
-                        dst.symlink(slnk, file)
-                    #src has changed and dst has not
-                    elif self.ut2dt(src_index.CreationTime)<src_mtime and self.SmallTime(dst_mtime, self.ut2dt(dst_index.CreationTime)):
-                        if verbose: print "\t"*depth+"Src link has changed, but dst not"
-                        try:
-                            dst.remove(file)
-                            dst.symlink(slnk, file)
-                        except: continue
-                        dst_index.CreationTime= self.dt2ut(dst.getinfo(file)["modified_time"])
-                    #dst has changed and src has not
-                    elif self.ut2dt(dst_index.CreationTime)<dst_mtime and self.SmallTime(src_mtime, self.ut2dt(src_index.CreationTime)):
-                        if verbose: print "\t"*depth+"Dst link has changed, but src not"
-                        try:
-                            src.remove(file)
-                            src.symlink(dlnk, file)
-                        except: continue
-                        src_index.CreationTime= self.dt2ut(src.getinfo(file)["modified_time"])
-                    #both files has changed, update indexes 
-                    elif not self.SmallTime(src_mtime, self.ut2dt(src_index.CreationTime)) and not self.SmallTime(dst_mtime, self.ut2dt(dst_index.CreationTime)):
-                        if verbose: print "\t"*depth+"Both links has changed."
-                        if src_mtime>dst_mtime:
-                            try:
-                                dst.remove(file)
-                                dst.symlink(slnk, file)
-                            except: continue
-                            src_index.CreationTime= self.dt2ut(src_mtime)
-                            dst_index.CreationTime= self.dt2ut(dst.getinfo(file)["modified_time"])
-                        else:
-                            try:
-                                src.remove(file)
-                                src.symlink(dlnk, file)
-                            except: continue
-                            dst_index.CreationTime= self.dt2ut(dst_mtime)
-                            src_index.CreationTime= self.dt2ut(src.getinfo(file)["modified_time"])
+                        self.plan.Add(ActionKind.relink, Side.src, path+[file], None, None, dst_fingerprint, True, dlnk)
             #if we have stop on link just delete it on both sides
             elif status==PathStatus.stop:
                 if verbose: print "\t"*depth+"Removing link"
-                src.remove(file)
-                dst.remove(file)
+                self.plan.Add(ActionKind.remove, Side.both, path+[file])
+                
+    def _execute_action(self, plan, action, src, dst):
+        path= plan.RelativePath(action)
+        (from_fs, to_fs)= self._by_side(action.side, src, dst)
+        
+        if action.kind==ActionKind.copy or action.kind==ActionKind.update:
+            on_done= None
+            if action.index:
+                on_done= partial(self._index_copied, self._index_from(action), action.fingerprint, self._index_for(action.side, action.path))
+            if action.kind==ActionKind.update and self.delta_threshold!=None and action.size>=self.delta_threshold:
+                self._transfer(from_fs, to_fs, path, action.mode, on_done, action.size)
+            else:
+                self._transfer(from_fs, to_fs, path, action.mode, on_done)
+        elif action.kind==ActionKind.mkdir:
+            to_fs.makedir(path, allow_recreate=True)
+            to_fs.chmod(path, action.mode)
+        elif action.kind==ActionKind.symlink:
+            to_fs.symlink(action.target, path)
+            to_fs.chmod(path, action.mode)
+        elif action.kind==ActionKind.relink:
+            try:
+                to_fs.remove(path)
+                to_fs.symlink(action.target, path)
+            except: return
+            if action.index:
+                self._index_copied(self._index_from(action), action.fingerprint, self._index_for(action.side, action.path), to_fs.getinfo(path))
+        elif action.kind==ActionKind.chmod:
+            to_fs.chmod(path, action.mode)
+            self._index_chmoded(action.side, action.path, to_fs.getinfo(path))
+        elif action.kind==ActionKind.remove:
+            if action.side!=Side.dst: src.remove(path)
+            if action.side!=Side.src: dst.remove(path)
+        elif action.kind==ActionKind.removedir and action.target==EMPTY_ONLY:
+            #Files, that the walk skipped, keep directory.
+            try: to_fs.removedir(path)
+            except (fs.errors.DirectoryNotEmptyError, fs.errors.ResourceNotFoundError): pass
+        elif action.kind==ActionKind.removedir:
+            if action.side!=Side.dst: src.removedir(path, force=True)
+            if action.side!=Side.src: dst.removedir(path, force=True)
+        elif action.kind==ActionKind.digest:
+            self._index_for(action.side, action.path).Digest= action.target
+        elif action.kind==ActionKind.move:
+            old_path= tuple(action.target.split("/"))
+            to_fs.rename("/".join(old_path[len(plan.base_path):]), path)
+            for side in [Side.src, Side.dst]:
+                self._index_root(side).MovePathPart(list(old_path), list(action.path))
+            if action.index:
+                self._index_copied(self._index_from(action), action.fingerprint, self._index_for(action.side, action.path), to_fs.getinfo(path))
+            
+    def _index_from(self, action):
+        #Index of the side copied from, only when it needs new fingerprint.
+        if action.fingerprint==None:
+            return None
+        return self._index_for(self._other_side(action.side), action.path)
+                
+    def _transfer(self, src, dst, file, mode= None, on_done= None, delta_size= None):
+        #Copies file now or queues it for copy workers, on_done
+        #gets info of the copied file and updates indexes.
+        if delta_size!=None:
+            job= DeltaTransferJob(src, file, dst, file, delta_size, mode, on_done)
+        else:
+            job= TransferJob(src, file, dst, file, mode, on_done)
+        if self.transfers:
+            self.transfers.Put(job)
+            return
+        
+        try:
+            info= job.Run()
+        except:
+            return
+        if on_done:
+            on_done(info)
+            
+    def _index_copied(self, from_index, from_fingerprint, to_index, info):
+        #Copied file has fingerprint of it's own, source keeps
+        #fingerprint it had when walk saw it.
+        if from_index!=None:
+            from_index.Fingerprint= from_fingerprint
+            from_index.CreationTime= from_fingerprint[0]//1000000000
+        to_index.Fingerprint= get_file_fingerprint(info)
+        to_index.CreationTime= self.dt2ut(info["modified_time"])
+        
+    def _index_chmoded(self, side, path, info):
+        #Chmod only changes ctime, index still matches unchanged file.
+        index= self._index_at(self._index_root(side), list(path))
+        fingerprint= self._fingerprint(index)
+        if fingerprint!=None and fingerprint[:3]==get_file_fingerprint(info)[:3]:
+            index.Fingerprint= get_file_fingerprint(info)
+            
+    def _fingerprint(self, index):
+        if index==None:
+            return None
+        try:
+            return index.Fingerprint
+        except AttributeError:
+            # Indexes stored before fingerprints were recorded.
+            return None
+        
+    def _digest(self, index):
+        if index==None:
+            return None
+        try:
+            return index.Digest
+        except AttributeError:
+            return None
+        
+    def _unchanged(self, index, info, fingerprint):
+        #File is unchanged since last synch, when index has the same
+        #fingerprint. Content is never read to decide this.
+        if index==None:
+            return False
+        stored= self._fingerprint(index)
+        if stored!=None:
+            return tuple(stored)==fingerprint
+        #Older indexes only know mtime in seconds.
+        return index.CreationTime!=None and index.CreationTime==self.dt2ut(info["modified_time"])
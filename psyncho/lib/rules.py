@@ -0,0 +1,313 @@
+import re
+
+from collections import OrderedDict
+
+from extra import PathStatus
+
+# Same patterns PathPart.GetLastPart uses to recognise regex path parts.
+SEGMENT_REGEX= re.compile('^\{(?P<regex>\S+)\}$')
+SUBPATH_REGEX= re.compile('^\|(?P<regex>\S+)\|$')
+
+class CompiledPathPart(object):
+    '''
+    Read-only snapshot of one PathPart node.
+
+    Literal children are kept in a hash map, regex children are kept
+    in an ordered list together with their precompiled pattern. Order
+    of children is remembered, because PathPart.GetLastPart always
+    takes the first child that matches.
+    '''
+    __slots__= ("name", "status", "depth", "kind", "regex", "order",
+                "literals", "patterns", "by_name", "has_children")
+
+    LITERAL= 0
+    SEGMENT= 1 # {regex}, matches one path part
+    SUBPATH= 2 # |regex|, matches joined rest of the path
+
+    def __init__(self, path_part, order= 0):
+        self.name= path_part.name
+        self.status= path_part.PathStatus
+        self.depth= path_part.depth
+        self.order= order
+
+        self.kind= CompiledPathPart.LITERAL
+        self.regex= None
+        match= SEGMENT_REGEX.match(self.name)
+        if match:
+            self.kind= CompiledPathPart.SEGMENT
+            self.regex= re.compile(match.group('regex'))
+        else:
+            match= SUBPATH_REGEX.match(self.name)
+            if match:
+                self.kind= CompiledPathPart.SUBPATH
+                self.regex= re.compile(match.group('regex'))
+
+        self.literals= {}
+        self.patterns= []
+        self.by_name= {}
+        self.has_children= False
+        for child_order, child in enumerate(path_part.children):
+            compiled= CompiledPathPart(child, child_order)
+            self.has_children= True
+            # Only first child with the same name can ever be matched.
+            if compiled.name not in self.by_name:
+                self.by_name[compiled.name]= compiled
+            if compiled.kind==CompiledPathPart.LITERAL:
+                if compiled.name not in self.literals:
+                    self.literals[compiled.name]= compiled
+            else:
+                self.patterns.append(compiled)
+
+    def Consume(self, path):
+        '''
+        Matches this node against path[0] and returns rest of the path
+        for children, or None if node does not match.
+        '''
+        if self.kind==CompiledPathPart.LITERAL:
+            if self.name!=path[0]:
+                return None
+            return path[1:]
+        elif self.kind==CompiledPathPart.SEGMENT:
+            if not self.regex.match(path[0]):
+                return None
+            return path[1:]
+
+        # Regex of type2 matches whole string path from here on.
+        stringpath= '/'.join(path)
+        splited= self.regex.split(stringpath, 1)
+        if splited[0]!=stringpath and len(stringpath)>len(splited[1]):
+            return splited[1].split("/")[1:]
+        return None
+
+    def MatchChild(self, path):
+        '''
+        Returns (child, rest, stable) for the first child matching path
+        or (None, None, stable). Match is stable when no |regex| child
+        had to be tried, so it does not depend on parts after path[0].
+        '''
+        stable= True
+        literal= self.literals.get(path[0])
+        for pattern in self.patterns:
+            # Literal child that was added before is always preferred.
+            if literal and literal.order<pattern.order:
+                break
+            if pattern.kind==CompiledPathPart.SUBPATH:
+                stable= False
+            rest= pattern.Consume(path)
+            if rest!=None:
+                return (pattern, rest, stable)
+
+        if literal:
+            return (literal, path[1:], stable)
+
+        return (None, None, stable)
+
+    def GetLastPart(self, path):
+        '''
+        Same as PathPart.GetLastPart(path, True), but path must start
+        with name of this node. Returns (truncated, node, stable).
+        '''
+        rest= self.Consume(path)
+        if rest==None:
+            return (False, None, self.kind!=CompiledPathPart.SUBPATH)
+
+        return self.Walk(rest, self.kind!=CompiledPathPart.SUBPATH)
+
+    def Walk(self, rest, stable= True):
+        '''
+        Continues matching rest of the path from this node.
+        '''
+        node= self
+        while rest:
+            (child, child_rest, child_stable)= node.MatchChild(rest)
+            stable= stable and child_stable
+            if child==None:
+                # Searched path is longer than configured one.
+                return (True, node, stable)
+            node= child
+            rest= child_rest
+
+        return (False, node, stable)
+
+    def PathExists(self, path):
+        '''
+        Same as PathPart.PathExists, path parts are compared by name.
+        '''
+        if self.name!=path[0]:
+            return False
+
+        node= self
+        for name in path[1:]:
+            node= node.by_name.get(name)
+            if node==None:
+                return False
+
+        return node.has_children
+
+# Bumped whenever any path rule changes, so compiled rules and their
+# caches built before know they are stale.
+_rules_version= [0]
+_compiled_layers= {}
+
+def InvalidateRules():
+    _rules_version[0]+= 1
+    _compiled_layers.clear()
+
+def CompileConfigLayer(config_layer):
+    '''
+    Returns compiled rules for config layer chain. Compiled rules are
+    shared until any path rule changes.
+    '''
+    compiled= _compiled_layers.get(config_layer)
+    if compiled==None:
+        compiled= CompiledConfigLayer(config_layer)
+        _compiled_layers[config_layer]= compiled
+
+    return compiled
+
+class CompiledConfigLayer(object):
+    '''
+    Flattened config layer chain with precompiled path rules.
+
+    It answers path status queries the same way as ConfigLayer, without
+    touching pod objects. Resolved state of directories is kept in a
+    bounded LRU cache, so entries of the same directory only match
+    their own name. Rules are compiled again when they change.
+    '''
+    def __init__(self, config_layer, cache_size= 4096):
+        self.config_layer= config_layer
+        self.name= config_layer.name
+        self.cache_size= cache_size
+        self.Compile()
+
+    def Compile(self):
+        self.version= _rules_version[0]
+        self.dir_cache= OrderedDict()
+
+        # Layers ordered from this one to the root config layer.
+        self.layers= []
+        layer= self.config_layer
+        while layer:
+            self.layers.append(CompiledPathPart(layer.paths))
+            layer= layer.parent
+
+    def PathExists(self, path):
+        if self.version!=_rules_version[0]:
+            self.Compile()
+
+        # ConfigLayer.PathExists only checks paths of it's own layer.
+        return self.layers[0].PathExists(path)
+
+    def GetPathStatus(self, path, report_truncated= False):
+        if self.version!=_rules_version[0]:
+            self.Compile()
+
+        if len(path)>1:
+            dir_state= self._GetDirState(tuple(path[:-1]))
+            if dir_state.inherited:
+                result= dir_state.result
+            else:
+                result= self._Resolve(path, dir_state.GetLastParts(path, self.layers))
+        else:
+            result= self._Resolve(path, [layer.GetLastPart(path)[:2] for layer in self.layers])
+
+        if report_truncated:
+            return result
+        return result[1]
+
+    def _GetDirState(self, dir_path):
+        dir_state= self.dir_cache.pop(dir_path, None)
+        if dir_state==None:
+            parent_state= None
+            if len(dir_path)>1:
+                parent_state= self.dir_cache.get(dir_path[:-1])
+
+            if parent_state:
+                dir_state= parent_state.Enter(dir_path, self.layers)
+            else:
+                dir_state= DirState([layer.GetLastPart(list(dir_path)) for layer in self.layers])
+            if dir_state.inherited and dir_state.result==None:
+                dir_state.result= self._Resolve(dir_path, dir_state.GetLastParts(dir_path, self.layers))
+
+            if len(self.dir_cache)>=self.cache_size:
+                self.dir_cache.popitem(last= False)
+
+        self.dir_cache[dir_path]= dir_state
+        return dir_state
+
+    def _Resolve(self, path, last_parts):
+        '''
+        Merges last matched parts of all layers, same as
+        ConfigLayer.GetPathStatus and ConfigLayer.__GetPathStatus__.
+        '''
+        depth= len(path)
+        (previous_truncated, best)= last_parts[0]
+        if best.status==PathStatus.stop:
+            return (False, PathStatus.stop)
+        if best.status==PathStatus.undef:
+            best= self.layers[0]
+
+        for truncated, part in last_parts[1:]:
+            # If we must stop at speciffic path then return
+            # status to stop regardless if parent paths have
+            # any other plans.
+            if part.status==PathStatus.stop:
+                return (truncated, PathStatus.stop)
+            if part.status==PathStatus.undef:
+                continue
+
+            # If new path is closer store new one.
+            sum1= depth-best.depth
+            sum2= depth-part.depth
+            if sum2>0 and sum2<sum1:
+                best= part
+                previous_truncated= truncated
+
+        return (previous_truncated, best.status)
+
+class DirState(object):
+    '''
+    Per layer result of matching a directory path.
+
+    For every layer it stores (truncated, node) when matching was
+    stable, or None when it depends on names inside of the directory.
+    Directory is inherited when all layers stopped above it, so all
+    of it's entries resolve to the same status.
+    '''
+    __slots__= ("parts", "inherited", "result")
+
+    def __init__(self, last_parts):
+        self.parts= [(truncated, node) if stable and node else None for truncated, node, stable in last_parts]
+        self.inherited= all(part and part[0] for part in self.parts)
+        self.result= None
+
+    def GetLastParts(self, path, layers):
+        last_parts= []
+        for part, layer in zip(self.parts, layers):
+            if part==None:
+                last_parts.append(layer.GetLastPart(path)[:2])
+            elif part[0]:
+                last_parts.append(part)
+            else:
+                last_parts.append(part[1].Walk(path[-1:])[:2])
+
+        return last_parts
+
+    def Enter(self, dir_path, layers):
+        if self.inherited:
+            dir_state= DirState.__new__(DirState)
+            dir_state.parts= self.parts
+            dir_state.inherited= True
+            dir_state.result= self.result
+            return dir_state
+
+        last_parts= []
+        for part, layer in zip(self.parts, layers):
+            if part==None:
+                last_parts.append(layer.GetLastPart(list(dir_path)))
+            elif part[0]:
+                last_parts.append(part+(True,))
+            else:
+                last_parts.append(part[1].Walk(list(dir_path[-1:])))
+
+        return DirState(last_parts)
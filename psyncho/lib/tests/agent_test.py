@@ -0,0 +1,202 @@
+import os
+import sys
+import shutil
+import tempfile
+import unittest
+import pod
+
+from fs.osfs import OSFS
+from fs.errors import ResourceNotFoundError
+
+import agent
+from agent import AgentFS
+from psyncho import *
+from plan import ActionKind, Side
+from listing import DirLister
+from merkle import TreeDigester
+from extra import get_file_fingerprint
+from compression import register_codec
+from delta import delta_copy
+
+class TestAgent(unittest.TestCase):
+    @classmethod
+    def setUpClass(cls):
+        cls.db = pod.Db(file = 'AgentTest.db', dynamic_index = True)
+        
+    def setUp(self):
+        self.root= tempfile.mkdtemp()
+        self.src= os.path.join(self.root, "src")
+        self.dst= os.path.join(self.root, "dst")
+        os.makedirs(os.path.join(self.src, "dir", "sub"))
+        os.makedirs(os.path.join(self.dst, "other"))
+        open(os.path.join(self.src, "dir", "file"), "w").write("x"*10)
+        open(os.path.join(self.src, "dir", "sub", "file"), "w").write("x"*20)
+        open(os.path.join(self.dst, "other", "file"), "w").write("x"*30)
+        self.fs= AgentFS([sys.executable, agent.__file__.replace(".pyc", ".py"), self.src])
+        
+    def tearDown(self):
+        self.fs.close()
+        shutil.rmtree(self.root)
+        
+    def Listing(self, fs):
+        return sorted((name, get_file_fingerprint(info), info["st_mode"]) for name, info in DirLister().ListDir(fs))
+        
+    def test_Listing(self):
+        local= OSFS(self.src)
+        self.assertEqual(self.Listing(self.fs), self.Listing(local))
+        self.assertEqual(self.Listing(self.fs.opendir("dir")), self.Listing(local.opendir("dir")))
+        # Whole tree came with the first listing.
+        self.assertEqual(sorted(self.fs.connection.listings), ["dir/sub"])
+        self.assertEqual(self.fs.listdir("dir", files_only= True), ["file"])
+        self.assertTrue(self.fs.isdir("dir") and self.fs.isfile("dir/file") and not self.fs.exists("missing"))
+        self.assertRaises(ResourceNotFoundError, self.fs.listdir, "missing")
+        self.assertEqual(self.fs.opendir("dir").Digest(["root", "sub"]), TreeDigester(local).Digest(["root", "dir", "sub"]))
+        
+    def test_Files(self):
+        data= "".join(chr(id % 251) for id in range(3*agent.CHUNK_SIZE+17))
+        self.fs.setcontents("dir/big", data)
+        self.assertEqual(open(os.path.join(self.src, "dir", "big"), "rb").read(), data)
+        self.assertEqual(self.fs.getcontents("dir/big"), data)
+        self.assertEqual(self.fs.getinfo("dir/big")["size"], len(data))
+        
+        f= self.fs.open("dir/big", "r+b")
+        f.seek(agent.CHUNK_SIZE+5)
+        f.write("changed")
+        f.seek(10)
+        self.assertEqual(f.read(3), data[10:13])
+        f.truncate(agent.CHUNK_SIZE+12)
+        f.close()
+        self.assertEqual(open(os.path.join(self.src, "dir", "big"), "rb").read(), data[:agent.CHUNK_SIZE+5]+"changed")
+        
+        self.fs.makedir("new/deep", recursive= True)
+        self.fs.rename("dir/big", "new/deep/big")
+        self.fs.chmod("new/deep/big", 0600)
+        self.assertEqual(os.stat(os.path.join(self.src, "new", "deep", "big")).st_mode & 0777, 0600)
+        self.fs.symlink("deep/big", "new/link")
+        self.assertEqual(self.fs.readlink("new/link"), "deep/big")
+        self.fs.remove("new/link")
+        self.fs.removedir("new", force= True)
+        self.assertEqual(sorted(self.fs.listdir()), ["dir"])
+        self.assertRaises(ResourceNotFoundError, self.fs.remove, "new")
+        
+    def test_WriteErrors(self):
+        # Failed pipelined write is raised by its own file only.
+        # Large file stays open, writes to read only handle fail.
+        large= "x"*(agent.CHUNK_SIZE+1)
+        open(os.path.join(self.src, "dir", "large"), "w").write(large)
+        failing= self.fs.open("dir/large", "rb")
+        other= self.fs.open("dir/new", "wb")
+        failing.write("data")
+        failing.flush()
+        other.write("x")
+        other.close()
+        self.assertEqual(self.fs.getcontents("dir/new"), "x")
+        self.assertRaises(OSError, failing.flush)
+        failing.close()
+        
+        failing= self.fs.open("dir/large", "rb")
+        failing.write("data")
+        failing.flush()
+        self.assertEqual(self.fs.getcontents("dir/large"), large)
+        self.assertRaises(OSError, failing.close)
+        self.assertEqual(self.fs.connection.failed, {})
+        
+    def test_Delta(self):
+        data= os.urandom(2*1024*1024)
+        open(os.path.join(self.src, "dir", "big"), "wb").write(data)
+        local= OSFS(self.root)
+        local.setcontents("big", "inserted"+data)
+        connection= self.fs.connection
+        for src, src_path, dst, dst_path in [(local, "big", self.fs, "dir/big"), (self.fs, "dir/big", local, "big")]:
+            (sent, received)= (connection.sent, connection.received)
+            self.assertEqual(delta_copy(src, src_path, dst, dst_path, len(data)+8), 8)
+            # Only signatures and changed blocks go over the link.
+            self.assertTrue(connection.sent-sent+connection.received-received<len(data)/10)
+            self.assertEqual(dst.getcontents(dst_path), "inserted"+data)
+            src.setcontents(src_path, data)
+        self.assertEqual(sorted(self.fs.listdir("dir")), ["big", "file", "sub"])
+        self.assertRaises(ResourceNotFoundError, self.fs.Signatures, "missing", 4096)
+        
+    def test_Compression(self):
+        text= "".join("line %d of a text file\n" % id for id in range(100000))
+        noise= os.urandom(len(text))
+        connection= self.fs.connection
+        sent= []
+        for codec in [None, "zlib:6"]:
+            if codec:
+                self.assertTrue(self.fs.SetCompression(codec))
+            start= connection.sent
+            self.fs.setcontents("dir/text", text)
+            self.fs.setcontents("dir/noise.gz", noise)
+            sent.append(connection.sent-start)
+            self.assertEqual(self.fs.getcontents("dir/text"), text)
+            self.assertEqual(self.fs.getcontents("dir/noise.gz"), noise)
+        # Text shrinks several times, compressed file is sent as it is.
+        self.assertTrue(sent[1]<len(noise)+len(text)/5)
+        self.assertTrue(sent[0]>=len(noise)+len(text))
+        self.assertEqual(self.Listing(self.fs), self.Listing(OSFS(self.src)))
+        self.assertRaises(ValueError, self.fs.SetCompression, "missing")
+        # Codec, that only this end has, is refused and link stays as it was.
+        register_codec("local", lambda level: None)
+        self.assertFalse(self.fs.SetCompression("local"))
+        self.assertEqual(self.fs.getcontents("dir/text"), text)
+        self.assertRaises(ValueError, self.fs.SetCompression, "zlib:15")
+        
+        # Frame, that can't be decompressed, gets an error reply.
+        with connection.lock:
+            connection.process.stdin.write(agent._frame.pack(4 | agent.COMPRESSED)+"junk")
+            connection.process.stdin.flush()
+            self.assertRaises(OSError, connection._Result, connection._Receive())
+        self.assertEqual(self.fs.getcontents("dir/text"), text)
+        
+    def test_Plan(self):
+        # Agent side plans the same as the local one.
+        layer= ConfigLayer("agent", None, PathStatus.include)
+        plans= []
+        for src in [self.src, "agent://"+self.src]:
+            fsc= FileSyncConfig(src, self.dst, layer, "agent")
+            plan= FileSync(fsc, self.db).sync(["root"], False, True)
+            plans.append(sorted((ActionKind.Name(action.kind), Side.Name(action.side), "/".join(action.path), action.size) for action in plan))
+            fsc.delete()
+        self.assertEqual(plans[0], plans[1])
+        self.assertTrue(("copy", "dst", "root/dir/sub/file", 20) in plans[1])
+        layer.delete()
+        self.db.commit()
+
+    def test_Digest(self):
+        # Synch asks agents for digests and skips unchanged subtrees
+        # without listing them through the link.
+        for dir in range(10):
+            os.makedirs(os.path.join(self.src, "tree", "d%d" % dir))
+            for file in range(50):
+                open(os.path.join(self.src, "tree", "d%d" % dir, "file%d" % file), "w").write("x")
+        layer= ConfigLayer("agent-digest", None, PathStatus.include)
+        fsc= FileSyncConfig("agent://"+self.src, "agent://"+self.dst, layer, "agent-digest")
+        FileSync(fsc, self.db).sync(["root"], False)
+        # Changed subtrees get digests on the next synch.
+        fs= FileSync(fsc, self.db)
+        fs.sync(["root"], False)
+        traffic= lambda: sum(source.connection.sent+source.connection.received for source in fs.digest_sources.values())
+        scanned= traffic()
+        
+        listed= []
+        fs._list= lambda dir: listed.append(dir) or FileSync._list(fs, dir)
+        self.assertEqual(len(fs.sync(["root"], False, True)), 0)
+        self.assertEqual(listed, [])
+        self.assertEqual(sorted(fs.digest_sources), [Side.src, Side.dst])
+        self.assertTrue(traffic()<1000<scanned/10)
+        
+        open(os.path.join(self.src, "dir", "sub", "file"), "w").write("changed")
+        plan= fs.sync(["root"], False)
+        self.assertEqual([(ActionKind.Name(action.kind), "/".join(action.path)) for action in plan if action.kind!=ActionKind.digest],
+                         [("update", "root/dir/sub/file")])
+        self.assertEqual(len(listed), 2*len(["root", "dir", "dir/sub"]))
+        self.assertTrue(traffic()<scanned/10)
+        self.assertEqual(open(os.path.join(self.dst, "dir", "sub", "file")).read(), "changed")
+        
+        fsc.delete()
+        layer.delete()
+        self.db.commit()
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,75 @@
+import unittest
+import os
+import tempfile
+
+from compact_index import CompactIndex
+from index_store import IndexStore
+
+class TestCompactIndex(unittest.TestCase):
+    def test_Build(self):
+        entries= [(("root",), None, None, "digest"),
+                  (("root", "b-c", "x"), 1, (1000, 10, 7, None), None),
+                  (("root", "b", "y"), 2, (2000, 20, None, 5), None),
+                  (("root", "a"), 3, None, None)]
+        index= CompactIndex.Build(["root"], entries)
+        self.assertEqual(len(index), 6)
+        
+        root= index.Root()
+        self.assertEqual(root.CreationTime, None)
+        self.assertEqual(root.Digest, "digest")
+        self.assertEqual(root.get("b").Digest, None)
+        self.assertEqual(root.GetChildrenByName().get("b-c").get("x").CreationTime, 1)
+        self.assertEqual(root.get("b").get(u"y").CreationTime, 2)
+        self.assertEqual(root.get("b").get("y").Fingerprint, (2000, 20, None, 5))
+        self.assertEqual(root.get("b-c").get("x").Fingerprint, (1000, 10, 7, None))
+        self.assertEqual(root.get("a").Fingerprint, None)
+        self.assertEqual(root.get("a").CreationTime, 3)
+        self.assertEqual(root.get("b").CreationTime, None)
+        self.assertEqual(root.get("missing"), None)
+        self.assertEqual(root.get("a").get("x"), None)
+        self.assertTrue(root.HasEntries() and root.get("b").HasEntries())
+        self.assertFalse(root.get("a").HasEntries())
+        self.assertEqual([index.names[index.name[child]] for child in index.child_ids[index.child_start[0]:index.child_start[0]+index.child_count[0]]], ["a", "b", "b-c"])
+        
+    def test_FromStore(self):
+        (fd, file)= tempfile.mkstemp()
+        os.close(fd)
+        try:
+            store= IndexStore(file)
+            for id in range(1000):
+                store.Put("sync", 0, ["root", "base", "dir%d" % (id%7), "file%d" % id], id, (id, id, id, id))
+            store.Put("sync", 0, ["root", "other", "file"], 1)
+            
+            root= CompactIndex.FromIndex(store.Root("sync", 0).GetPathPart(["root", "base"])).Root()
+            self.assertEqual(root.name, "base")
+            self.assertEqual(root.get("dir3").get("file500").CreationTime, 500)
+            self.assertEqual(root.get("dir3").get("file500").Fingerprint, (500, 500, 500, 500))
+            self.assertEqual(root.get("dir3").get("file501"), None)
+            self.assertEqual(len(root.index), 1000+7+1)
+        finally:
+            os.remove(file)
+            
+    def test_SiblingNames(self):
+        # "d.x" and "d-y" sort between "d" and "d/in" as strings.
+        (fd, file)= tempfile.mkstemp()
+        os.close(fd)
+        try:
+            store= IndexStore(file)
+            store.Put("sync", 0, ["root", "d"], 1, None, "digest")
+            store.Put("sync", 0, ["root", "d.x"], 2, (2, 2, 2, 2))
+            store.Put("sync", 0, ["root", "d-y", "file"], 3, (3, 3, 3, 3))
+            store.Put("sync", 0, ["root", "d", "in"], 4, (4, 4, 4, 4))
+            store.Put("sync", 0, ["root", "d", "in.b"], 5, (5, 5, 5, 5))
+            
+            root= CompactIndex.FromIndex(store.Root("sync", 0).GetPathPart(["root"])).Root()
+            self.assertEqual(len(root.index), 7)
+            self.assertEqual(root.get("d").Digest, "digest")
+            self.assertEqual(root.get("d").get("in").CreationTime, 4)
+            self.assertEqual(root.get("d").get("in.b").CreationTime, 5)
+            self.assertEqual(root.get("d.x").Fingerprint, (2, 2, 2, 2))
+            self.assertEqual(root.get("d-y").get("file").CreationTime, 3)
+        finally:
+            os.remove(file)
+
+if __name__ == '__main__':
+    unittest.main()
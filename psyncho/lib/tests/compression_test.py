@@ -0,0 +1,43 @@
+import unittest
+
+from compression import get_codec, codec_names, register_codec, is_compressed_name, Codec
+
+class ReverseCodec(Codec):
+    name= "reverse"
+    
+    def Compress(self, data):
+        return data[::-1]
+    
+    def Decompress(self, data):
+        return data[::-1]
+
+class TestCompression(unittest.TestCase):
+    def test_Codecs(self):
+        data= "line of text %d\n"*1000 % tuple(range(1000))
+        for name in codec_names():
+            codec= get_codec(name)
+            compressed= codec.Compress(data)
+            self.assertTrue(len(compressed)<len(data)/4)
+            self.assertEqual(codec.Decompress(compressed), data)
+        self.assertEqual(get_codec("zlib:1").name, "zlib:1")
+        self.assertEqual(get_codec("zlib").level, 6)
+        self.assertEqual(get_codec("none"), None)
+        self.assertEqual(get_codec(None), None)
+        self.assertRaises(ValueError, get_codec, "missing")
+        self.assertRaises(ValueError, get_codec, "zlib:fast")
+        # Levels out of range fail here, not when the first frame is compressed.
+        for spec in ["zlib:15", "zlib:-1", "bz2:0", "bz2:10", "lzma:10"]:
+            self.assertRaises(ValueError, get_codec, spec)
+        self.assertEqual(get_codec("bz2:1").level, 1)
+        
+        register_codec("reverse", lambda level: ReverseCodec())
+        self.assertEqual(get_codec("reverse").Decompress("cba"), "abc")
+        
+    def test_Names(self):
+        self.assertTrue(is_compressed_name("dir/photo.JPG"))
+        self.assertTrue(is_compressed_name("backup.tar.gz"))
+        self.assertFalse(is_compressed_name("notes.txt"))
+        self.assertFalse(is_compressed_name("gz/README"))
+
+if __name__ == '__main__':
+    unittest.main()
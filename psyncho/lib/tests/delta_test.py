@@ -0,0 +1,62 @@
+import unittest
+import random
+
+from fs.memoryfs import MemoryFS
+
+from delta import weak_checksum, roll_checksum, delta_copy
+from transfer import DeltaTransferJob
+
+class TestDelta(unittest.TestCase):
+    def setUp(self):
+        rand= random.Random(1)
+        self.data= "".join(chr(rand.randint(0, 255)) for id in range(200000))
+        self.src= MemoryFS()
+        self.dst= MemoryFS()
+        
+    def Synch(self, new, old):
+        self.src.setcontents("file", new)
+        self.dst.setcontents("file", old)
+        written= delta_copy(self.src, "file", self.dst, "file", len(new))
+        if written!=None:
+            self.assertEqual(self.dst.getcontents("file"), new)
+        return written
+        
+    def test_Roll(self):
+        data= self.data[:5000]
+        weak= weak_checksum(data[0:4096])
+        for pos in range(500):
+            weak= roll_checksum(weak, ord(data[pos]), ord(data[pos+4096]), 4096)
+            self.assertEqual(weak, weak_checksum(data[pos+1:pos+4097]))
+            
+    def test_Append(self):
+        self.assertEqual(self.Synch(self.data+"appended", self.data), 3392+8)
+        self.assertEqual(self.Synch(self.data[:100000], self.data), 1696)
+        # Mostly new file is left for a plain copy.
+        self.assertEqual(self.Synch(self.data, self.data[:50000]), None)
+        
+    def test_Changes(self):
+        changed= self.data[:50000]+"x"*10+self.data[50010:]
+        self.assertTrue(self.Synch(changed, self.data)<=4096)
+        # Insert moves all later blocks, rolling checksum finds them again.
+        inserted= "inserted"+self.data
+        self.assertEqual(self.Synch(inserted, self.data), 8)
+        self.assertEqual(self.Synch(self.data, self.data[::-1]), None)
+        self.assertEqual(self.dst.getcontents("file"), self.data[::-1])
+        
+    def test_Remote(self):
+        # Remote side without delta requests would be read over the link.
+        self.dst.getmeta= lambda name, default= None: name=="network" or default
+        self.assertEqual(self.Synch("inserted"+self.data, self.data), None)
+        self.assertEqual(self.dst.getcontents("file"), self.data)
+        
+    def test_Job(self):
+        self.src.setcontents("file", "new"+self.data)
+        self.dst.setcontents("file", self.data)
+        DeltaTransferJob(self.src, "file", self.dst, "file", len(self.data)+3).Run()
+        self.assertEqual(self.dst.getcontents("file"), "new"+self.data)
+        self.src.setcontents("file", self.data[::-1])
+        DeltaTransferJob(self.src, "file", self.dst, "file", len(self.data)).Run()
+        self.assertEqual(self.dst.getcontents("file"), self.data[::-1])
+
+if __name__ == '__main__':
+    unittest.main()
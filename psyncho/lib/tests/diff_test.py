@@ -0,0 +1,49 @@
+import unittest
+import stat
+
+from time import time
+
+from diff import diff_dirs
+
+FILE= {"st_mode": stat.S_IFREG | 0644}
+DIR= {"st_mode": stat.S_IFDIR | 0755}
+LINK= {"st_mode": stat.S_IFLNK | 0777}
+FIFO= {"st_mode": stat.S_IFIFO | 0644}
+
+class TestDiff(unittest.TestCase):
+    def test_diff(self):
+        src= [("file", FILE), ("new_file", FILE), ("dir", DIR), ("new_dir", DIR),
+              ("link", LINK), ("new_link", LINK), ("changed", FILE), ("fifo", FIFO)]
+        dst= [("file", FILE), ("dst_file", FILE), ("dir", DIR), ("dst_dir", DIR),
+              ("link", LINK), ("dst_link", LINK), ("changed", DIR), ("fifo", FILE)]
+        diff= diff_dirs(src, dst)
+
+        self.assertEqual(diff.copy_src_files, [("new_file", FILE)])
+        self.assertEqual(diff.copy_src_dirs, [("new_dir", DIR)])
+        self.assertEqual(diff.make_src_links, [("new_link", LINK)])
+        self.assertEqual(diff.copy_dst_files, [("dst_file", FILE)])
+        self.assertEqual(diff.copy_dst_dirs, [("dst_dir", DIR)])
+        self.assertEqual(diff.make_dst_links, [("dst_link", LINK)])
+        self.assertEqual(diff.update_files, [("file", FILE, FILE)])
+        self.assertEqual(diff.update_dirs, [("dir", DIR, DIR)])
+        self.assertEqual(diff.update_links, [("link", LINK, LINK)])
+        self.assertEqual(diff.type_changes, [("changed", FILE, DIR)])
+
+    def test_wide_dir(self):
+        #Half of the files are on both sides, others only on one side.
+        count= 150000
+        src= [("file%d" % id, FILE) for id in xrange(count)]
+        dst= [("file%d" % id, FILE) for id in xrange(count/2, count+count/2)]
+
+        start= time()
+        diff= diff_dirs(src, dst)
+        self.assertTrue(time()-start<10)
+
+        self.assertEqual(len(diff.copy_src_files), count/2)
+        self.assertEqual(len(diff.copy_dst_files), count/2)
+        self.assertEqual(len(diff.update_files), count/2)
+        self.assertEqual(diff.copy_src_files[0][0], "file0")
+        self.assertEqual(diff.copy_dst_files[0][0], "file%d" % count)
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,81 @@
+import unittest
+import os
+import shutil
+import hashlib
+import tempfile
+
+from fs.osfs import OSFS
+from fs.memoryfs import MemoryFS
+
+from listing import DirLister
+from index_store import IndexStore
+from hash_cache import HashCache
+
+class TestHashCache(unittest.TestCase):
+    def setUp(self):
+        self.root= tempfile.mkdtemp()
+        os.mkdir(os.path.join(self.root, "files"))
+        self.store= IndexStore(os.path.join(self.root, "index.db"))
+        
+    def tearDown(self):
+        shutil.rmtree(self.root)
+        
+    def Write(self, name, data):
+        open(os.path.join(self.root, "files", name), "w").write(data)
+        
+    def test_Cache(self):
+        self.Write("small", "small")
+        self.Write("large", "x"*100000)
+        fs= OSFS(os.path.join(self.root, "files"))
+        cache= HashCache(self.store, "sync", 0, 2, 50000)
+        
+        entries= DirLister().ListDir(fs)
+        digests= cache.GetMany(fs, entries)
+        self.assertEqual(digests, {"small": hashlib.sha1("small").hexdigest(),
+                                   "large": hashlib.sha1("x"*100000).hexdigest()})
+        cache.Close()
+        self.store.Commit()
+        
+        # Digest comes from the store while stat key stays the same.
+        info= dict(entries)["small"]
+        self.assertEqual(IndexStore(self.store.file).GetDigest("sync", 0, (info["st_dev"], info["st_ino"], info["size"], int(round(info["st_mtime"]*1000000))*1000)), digests["small"])
+        cache= HashCache(self.store, "sync", 0, 1)
+        hashed= []
+        cache._Hash= lambda fs, path: hashed.append(path) or hashlib.sha1(fs.getcontents(path)).hexdigest()
+        self.assertEqual(cache.GetMany(fs, entries), digests)
+        self.assertEqual(hashed, [])
+        
+        self.Write("small", "other")
+        os.utime(os.path.join(self.root, "files", "small"), (1, 1))
+        entries= DirLister().ListDir(fs)
+        self.assertEqual(cache.GetMany(fs, entries)["small"], hashlib.sha1("other").hexdigest())
+        self.assertEqual(hashed, ["small"])
+        self.assertEqual(self.store.GetDigest("sync", 1, (info["st_dev"], info["st_ino"], info["size"], 0)), None)
+        
+    def test_GetAll(self):
+        # Large files of different directories go to the pool together.
+        os.mkdir(os.path.join(self.root, "files", "dir"))
+        self.Write("large", "x"*100)
+        self.Write("dir/large", "y"*100)
+        self.Write("small", "z")
+        fs= OSFS(os.path.join(self.root, "files"))
+        cache= HashCache(self.store, "sync", 0, 2, 50)
+        mapped= []
+        class Pool(object):
+            def map(self, function, paths):
+                mapped.append(len(paths))
+                return [function(path) for path in paths]
+        cache.pool= Pool()
+        files= [(fs, "large", fs.getinfo("large")), (fs.opendir("dir"), "large", fs.getinfo("dir/large")),
+                (fs, "small", fs.getinfo("small"))]
+        self.assertEqual(cache.GetAll(files), [hashlib.sha1(data).hexdigest() for data in ["x"*100, "y"*100, "z"]])
+        self.assertEqual(mapped, [2])
+        
+    def test_NoInodes(self):
+        fs= MemoryFS()
+        fs.setcontents("file", "data")
+        cache= HashCache(self.store, "sync", 0)
+        self.assertEqual(cache.Get(fs, "file", fs.getinfo("file")), hashlib.sha1("data").hexdigest())
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,98 @@
+import unittest
+import os
+import tempfile
+
+from index_store import IndexStore
+
+class TestIndexStore(unittest.TestCase):
+    def setUp(self):
+        (fd, self.file)= tempfile.mkstemp()
+        os.close(fd)
+        self.store= IndexStore(self.file, batch_size= 10)
+        
+    def tearDown(self):
+        os.remove(self.file)
+        
+    def test_Store(self):
+        for id in range(25):
+            self.store.Put("sync", 0, ["root", "dir", "file%d" % id], id, (id*1000, id*10, id, None))
+        self.store.Put("sync", 0, ["root", "dir", "sub", "file"], 100)
+        self.store.Put("sync", 0, ["root", "dir", "sub"], None, None, "digest")
+        self.store.Put("sync", 1, ["root", "dir", "file0"], 200)
+        self.store.Put("other", 0, ["root", "dir", "file0"], 300)
+        
+        # Buffered writes are visible before they are flushed.
+        self.assertEqual(self.store.Get("sync", 0, ["root", "dir", "file24"]), (24, (24000, 240, 24, None), None))
+        self.assertEqual(self.store.Get("sync", 0, ["root", "dir", "file1"]), (1, (1000, 10, 1, None), None))
+        self.assertEqual(len(self.store.GetChildren("sync", 0, ["root", "dir"])), 26)
+        self.assertEqual(self.store.GetChildren("sync", 0, ["root", "dir"])["sub"], (None, None, "digest"))
+        self.assertEqual(self.store.Get("sync", 0, ["root", "missing"]), None)
+        self.assertTrue(self.store.HasEntries("sync", 0, ["root"]))
+        self.assertFalse(self.store.HasEntries("sync", 0, ["root", "dir", "file1"]))
+        
+        self.store.Commit()
+        self.assertTrue(self.store.HasEntries("sync", 1, ["root", "dir"]))
+        self.assertFalse(self.store.HasEntries("sync", 1, ["root", "di"]))
+        self.assertFalse(self.store.HasEntries("missing", 0, ["root"]))
+        self.assertEqual(IndexStore(self.file).Get("sync", 1, ["root", "dir", "file0"]), (200, None, None))
+        
+        self.store.DeleteTree("sync", 0, ["root", "dir"])
+        self.assertEqual(self.store.GetChildren("sync", 0, ["root", "dir"]), {})
+        self.assertEqual(self.store.Get("sync", 0, ["root", "dir", "sub", "file"]), None)
+        self.assertEqual(self.store.Get("sync", 1, ["root", "dir", "file0"]), (200, None, None))
+        
+        self.store.Clear("sync")
+        self.assertEqual(self.store.Get("sync", 1, ["root", "dir", "file0"]), None)
+        self.assertEqual(self.store.Get("other", 0, ["root", "dir", "file0"]), (300, None, None))
+        
+    def test_Background(self):
+        store= IndexStore(self.file, 10, True, 60)
+        for id in range(25):
+            store.Put("sync", 0, ["root", "dir", "file%d" % id], id)
+        store.PutDigest("sync", 0, (1, 2, 3, 4), "digest")
+        
+        # Batches handed to the writer are visible until they are committed.
+        self.assertEqual((len(store.pending), len(store.pending_digests)), (5, 1))
+        self.assertEqual(store.Get("sync", 0, ["root", "dir", "file3"]), (3, None, None))
+        self.assertEqual(store.Get("sync", 0, ["root", "dir", "file24"]), (24, None, None))
+        self.assertEqual(len(store.GetChildren("sync", 0, ["root", "dir"])), 25)
+        self.assertEqual(store.GetDigest("sync", 0, (1, 2, 3, 4)), "digest")
+        
+        store.Commit()
+        self.assertEqual(store.writer.Batches(), [])
+        self.assertEqual(IndexStore(self.file).Get("sync", 0, ["root", "dir", "file24"]), (24, None, None))
+        self.assertEqual(IndexStore(self.file).GetDigest("sync", 0, (1, 2, 3, 4)), "digest")
+        
+        store.DeleteTree("sync", 0, ["root", "dir", "file1"])
+        self.assertEqual(store.Get("sync", 0, ["root", "dir", "file1"]), None)
+        self.assertEqual(IndexStore(self.file).Get("sync", 0, ["root", "dir", "file1"]), None)
+        
+        # Old changes are handed over without waiting for a full batch.
+        store.latency= 0
+        store.Put("sync", 0, ["root", "late"], 1)
+        self.assertEqual(store.pending, {})
+        store.Close()
+        self.assertEqual(IndexStore(self.file).Get("sync", 0, ["root", "late"]), (1, None, None))
+        
+    def test_Adapter(self):
+        root= self.store.Root("sync", 0)
+        root.GetPathPart(["root", "dir", "file"], True).CreationTime= 42
+        root.GetPathPart(["root", "dir", "dir.x"], True).CreationTime= 43
+        root.GetPathPart(["root", "dir", "file"], True).Fingerprint= (42000, 1, 2, 3)
+        root.GetPathPart(["root", "dir"], True).Digest= "digest"
+        self.store.Commit()
+        
+        dir_index= self.store.Root("sync", 0).GetChildrenByName().get(u"dir")
+        self.assertEqual(dir_index.CreationTime, None)
+        self.assertEqual(dir_index.Digest, "digest")
+        self.assertEqual(dir_index.GetChildrenByName().get(u"file").CreationTime, 42)
+        self.assertEqual(dir_index.GetChildrenByName().get(u"file").Fingerprint, (42000, 1, 2, 3))
+        self.assertEqual(dir_index.GetChildrenByName().get(u"dir.x").Fingerprint, None)
+        self.assertEqual(dir_index.GetChildrenByName().get(u"missing").CreationTime, None)
+        
+        root.DelPathPart(["root", "dir", "file"])
+        self.assertEqual(root.GetPathPart(["root", "dir", "file"]).CreationTime, None)
+        self.assertEqual(root.GetPathPart(["root", "dir", "dir.x"]).CreationTime, 43)
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,105 @@
+import os
+import shutil
+import tempfile
+import unittest
+import pod
+
+from fs.osfs import OSFS
+from fs.memoryfs import MemoryFS
+from fs.opener import fsopendir, OpenerError
+from fs.errors import RemoteConnectionError
+
+from latency import LatencyFS, Link, parse_params
+from listing import DirLister
+from psyncho import *
+
+class TestLatencyFS(unittest.TestCase):
+    @classmethod
+    def setUpClass(cls):
+        cls.db = pod.Db(file = 'LatencyTest.db', dynamic_index = True)
+
+    def setUp(self):
+        self.root= tempfile.mkdtemp()
+        self.src= os.path.join(self.root, "src")
+        self.dst= os.path.join(self.root, "dst")
+        os.makedirs(os.path.join(self.src, "dir", "sub"))
+        os.makedirs(self.dst)
+        open(os.path.join(self.src, "dir", "file"), "w").write("x"*10)
+        open(os.path.join(self.src, "dir", "sub", "file"), "w").write("x"*20)
+
+    def tearDown(self):
+        shutil.rmtree(self.root)
+
+    def test_Latency(self):
+        waits= []
+        fs= LatencyFS(OSFS(self.src), 0.01, latencies= {"listdir": 0.5}, sleep= waits.append)
+        self.assertEqual(fs.getsyspath("", allow_none= True), None)
+        self.assertFalse(fs.hassyspath(""))
+
+        self.assertEqual(fs.listdir(), ["dir"])
+        self.assertEqual(waits, [0.5])
+        # Subdirectory views share settings and keep their paths.
+        sub= fs.opendir("dir")
+        self.assertTrue(sub.isdir("sub"))
+        self.assertEqual(sub.getinfo("file")["size"], 10)
+        self.assertEqual(waits, [0.5, 0.01, 0.01])
+        # Listing can't go around the wrapper through local disk.
+        self.assertEqual(sorted(name for name, info in DirLister(1).ListDir(sub)), ["file", "sub"])
+        self.assertTrue(len(waits)>3)
+
+    def test_Bandwidth(self):
+        waits= []
+        fs= LatencyFS(OSFS(self.src), bandwidth= 10, sleep= waits.append)
+        self.assertEqual(fs.getcontents("dir/sub/file"), "x"*20)
+        self.assertEqual(len(waits), 1)
+        self.assertTrue(1.9<waits[0]<=2.0)
+
+        # Transfers share the link, next one waits for the previous.
+        waits= []
+        link= Link(100, waits.append)
+        link.Transfer(100)
+        link.Transfer(100)
+        self.assertTrue(waits[1]>waits[0]>0.9)
+
+    def test_Errors(self):
+        fs= LatencyFS(MemoryFS(), error_rates= {"listdir": 1.0}, seed= 1)
+        fs.makedir("dir")
+        self.assertRaises(RemoteConnectionError, fs.listdir)
+        self.assertTrue(fs.isdir("dir"))
+
+        fs= LatencyFS(MemoryFS(), error_rate= 0.5, seed= 1)
+        failed= 0
+        for i in range(200):
+            try:
+                fs.exists("dir")
+            except RemoteConnectionError:
+                failed+= 1
+        self.assertTrue(50<failed<150)
+
+    def test_Opener(self):
+        self.assertEqual(parse_params("latency=0.02,bandwidth=1000,listdir=0.1,open_errors=0.5,seed=3"),
+                         {"latency": 0.02, "bandwidth": 1000.0, "latencies": {"listdir": 0.1},
+                          "error_rates": {"open": 0.5}, "seed": 3})
+        self.assertRaises(OpenerError, parse_params, "unknown=1")
+        self.assertRaises(OpenerError, parse_params, "latency=fast")
+
+        fs= fsopendir("latency#latency=0.001:osfs://"+self.src)
+        self.assertTrue(isinstance(fs, LatencyFS))
+        self.assertEqual(sorted(fs.listdir("dir")), ["file", "sub"])
+
+    def test_Synch(self):
+        layer= ConfigLayer("latency", None, PathStatus.include)
+        fsc= FileSyncConfig("latency#latency=0.001,bandwidth=100000:osfs://"+self.src,
+                            "latency#latency=0.001:osfs://"+self.dst, layer, "latency")
+        FileSync(fsc, self.db).sync(["root"], False)
+        self.assertEqual(open(os.path.join(self.dst, "dir", "sub", "file")).read(), "x"*20)
+        # Stock OSFS can't chmod, so only copies are compared.
+        (counts, size)= FileSync(fsc, self.db).sync(["root"], False, True).Summary()
+        self.assertEqual((counts.get("copy"), counts.get("mkdir"), size), (None, None, 0))
+
+        layer.delete()
+        fsc.delete()
+        self.db.commit()
+
+if __name__ == '__main__':
+    unittest.main()
@@ -55,7 +55,151 @@ class TestConfigLayer(unittest.TestCase):
         
         self.assertEqual(self.RecursiveLen(ConfigLayerManager), 1)
         self.assertEqual(self.RecursiveLen(ConfigLayer), 0)
-        self.assertEqual(self.RecursiveLen(PathPart), 0) 
+        self.assertEqual(self.RecursiveLen(PathPart), 0)
+
+    def test_CompiledPathStatus(self):
+        layer1=ConfigLayer("compiled1", None, PathStatus.include, None)
+        layer1.paths.SetPathStatus(["root","jaka"], PathStatus.ignore)
+        layer1.paths.SetPathStatus(["root","jaka","{hudoklin|micka}","{cba|cde}"], PathStatus.stop)
+        layer1.paths.SetPathStatus(["root","jaka","micka","cde"], PathStatus.include)
+        layer2=ConfigLayer("compiled2", None, PathStatus.ignore, layer1)
+        layer2.paths.SetPathStatus(["root","jaka","|hudoklin/micka/cba|cde|","jure"], PathStatus.stop)
+        layer2.paths.SetPathStatus(["root","jaka","|\w+\.txt|"], PathStatus.include)
+        layer2.paths.SetPathStatus(["root","micka"], PathStatus.include)
+        layer3=ConfigLayer("compiled3", None, PathStatus.include, layer2)
+        layer3.paths.SetPathStatus(["root","micka","file.mfd"], PathStatus.ignore)
+        layer3.paths.SetPathStatus(["root","other"], PathStatus.undef)
+
+        paths= [["root"],
+                ["root","jaka"],
+                ["root","jaka","file.txt"],
+                ["root","jaka","file.mfd"],
+                ["root","jaka","test","file.txt"],
+                ["root","jaka","hudoklin","cba"],
+                ["root","jaka","micka","cde"],
+                ["root","jaka","hudoklin","micka","cde","jure"],
+                ["root","micka"],
+                ["root","micka","file.mfd"],
+                ["root","micka","a","b","c"],
+                ["root","other","x"],
+                ["root","unknown"]]
+
+        for layer in [layer1, layer2, layer3]:
+            compiled= CompiledConfigLayer(layer)
+            for path in paths:
+                self.assertEqual(compiled.GetPathStatus(path), layer.GetPathStatus(path))
+                self.assertEqual(compiled.GetPathStatus(path, True), layer.GetPathStatus(path, True))
+                self.assertEqual(compiled.PathExists(path), layer.PathExists(path))
+
+        layer1.delete()
+        self.db.commit()
+
+    def test_CompiledCacheInvalidation(self):
+        layer1=ConfigLayer("cached1", None, PathStatus.include, None)
+        layer1.paths.SetPathStatus(["root","jaka"], PathStatus.ignore)
+        layer2=ConfigLayer("cached2", None, PathStatus.include, layer1)
+
+        compiled= layer2.Compiled()
+        self.assertTrue(compiled is layer2.Compiled())
+        self.assertEqual(compiled.GetPathStatus(["root","jaka","a","file"], True), (True, PathStatus.ignore))
+        self.assertTrue(compiled.dir_cache[("root","jaka","a")].inherited)
+
+        layer2.paths.SetPathStatus(["root","jaka","a","file"], PathStatus.stop)
+        self.assertEqual(compiled.GetPathStatus(["root","jaka","a","file"]), PathStatus.stop)
+        self.assertEqual(compiled.GetPathStatus(["root","jaka","a","other"]), PathStatus.ignore)
+
+        layer2.paths.DelPathPart(["root","jaka"])
+        self.assertEqual(compiled.GetPathStatus(["root","jaka","a","file"]), PathStatus.ignore)
+
+        layer1.delete()
+        self.db.commit()
+
+    def test_CompiledStatusAssigned(self):
+        layer1=ConfigLayer("assigned1", None, PathStatus.include, None)
+        layer1.paths.SetPathStatus(["root","jaka"], PathStatus.ignore)
+
+        compiled= layer1.Compiled()
+        self.assertEqual(compiled.GetPathStatus(["root","jaka","a","file"]), PathStatus.ignore)
+
+        layer1.paths.GetPathPart(["root","jaka"]).PathStatus= PathStatus.stop
+        self.assertEqual(compiled.GetPathStatus(["root","jaka","a","file"]), PathStatus.stop)
+        self.assertFalse(compiled is layer1.Compiled())
+
+        layer1.delete()
+        self.db.commit()
+
+    def test_CompiledPathCreated(self):
+        layer1=ConfigLayer("created1", None, PathStatus.include, None)
+
+        compiled= layer1.Compiled()
+        self.assertEqual(compiled.GetPathStatus(["root","jaka","a","file"]), PathStatus.include)
+
+        PathPart("jaka", layer1.paths, PathStatus.ignore, 1)
+        self.assertEqual(compiled.GetPathStatus(["root","jaka","a","file"]), PathStatus.ignore)
+
+        layer1.paths.CreatePath(["micka","a"], PathStatus.stop)
+        self.assertEqual(compiled.GetPathStatus(["root","micka","b"]), PathStatus.stop)
+
+        layer1.delete()
+        self.db.commit()
+
+    def test_CompiledParentChanged(self):
+        layer1=ConfigLayer("parent1", None, PathStatus.include, None)
+        layer1.paths.SetPathStatus(["root","jaka"], PathStatus.ignore)
+        layer2=ConfigLayer("parent2", None, PathStatus.include, None)
+
+        compiled= layer2.Compiled()
+        self.assertEqual(compiled.GetPathStatus(["root","jaka","a","file"]), PathStatus.include)
+
+        layer2.parent= layer1
+        self.assertEqual(compiled.GetPathStatus(["root","jaka","a","file"]), PathStatus.ignore)
+
+        layer2.delete()
+        layer1.delete()
+        self.db.commit()
+
+    def test_ChildrenByName(self):
+        index= FileIndex("root")
+        for id in range(200):
+            index.GetPathPart(["root", "dir", u"file%d" % id], True).CreationTime= id
+        self.db.commit()
+
+        self.assertEqual(index.GetPathPart(["root", "dir", "file150"]).CreationTime, 150)
+        self.assertEqual(index.GetPathPart(["root", "dir", "missing"]).name, "dir")
+        index.DelPathPart(["root", "dir", "file150"])
+        self.assertEqual(index.GetPathPart(["root", "dir", "file150"]).name, "dir")
+
+        # Indexes and paths saved by older versions have no hash-keyed children.
+        dir_index= index.GetPathPart(["root", "dir"])
+        dir_index.named.delete()
+        del dir_index.named
+        self.assertEqual(index.GetPathPart(["root", "dir", "file42"]).CreationTime, 42)
+        self.assertEqual(self.RecursiveLen(dir_index.named.keys()), 199)
+
+        paths= PathPart("root")
+        paths.SetPathStatus(["root", "a", "b"], PathStatus.stop)
+        del paths.named
+        self.assertEqual(paths.GetPathPart(["root", "a", "b"]).PathStatus, PathStatus.stop)
+        self.assertTrue(paths.PathExists(["root", "a"]))
+
+        index.delete()
+        paths.delete()
+        self.db.commit()
         
+    def test_CompactIndex(self):
+        index= FileIndex("root")
+        for id in range(50):
+            index.GetPathPart(["root", "dir%d" % (id%5), "file%d" % id], True).CreationTime= id
+        self.db.commit()
+        
+        compact= CompactIndex.FromIndex(index.GetPathPart(["root", "dir2"])).Root()
+        self.assertEqual(compact.name, "dir2")
+        self.assertEqual(compact.GetChildrenByName().get("file12").CreationTime, 12)
+        self.assertEqual(compact.GetChildrenByName().get("file13"), None)
+        self.assertEqual(len(compact.index), 11)
+        
+        index.delete()
+        self.db.commit()
+
 if __name__ == '__main__':
     unittest.main()
\ No newline at end of file
@@ -0,0 +1,55 @@
+import unittest
+import os
+import shutil
+import tempfile
+
+from fs.osfs import OSFS
+from fs.memoryfs import MemoryFS
+
+from extra import is_file, is_lnk, is_dir
+from listing import DirLister
+
+class TestListing(unittest.TestCase):
+    def setUp(self):
+        self.lister= DirLister(4)
+        
+    def tearDown(self):
+        self.lister.Close()
+        
+    def test_local(self):
+        root= tempfile.mkdtemp()
+        try:
+            open(os.path.join(root, "file"), "w").write("12345")
+            os.mkdir(os.path.join(root, "dir"))
+            os.symlink("file", os.path.join(root, "link"))
+            
+            osfs= OSFS(root)
+            entries= dict(self.lister.ListDir(osfs))
+            self.assertEqual(sorted(entries.keys()), ["dir", "file", "link"])
+            self.assertTrue(is_file(entries["file"]))
+            self.assertTrue(is_dir(entries["dir"]))
+            self.assertTrue(is_lnk(entries["link"]))
+            for name in ["file", "dir"]:
+                info= osfs.getinfo(name)
+                self.assertEqual(entries[name]["st_mode"], info["st_mode"])
+                self.assertEqual(entries[name]["size"], info["size"])
+                self.assertEqual(entries[name]["modified_time"], info["modified_time"])
+                
+            entries= dict(self.lister.ListDir(osfs.opendir("dir")))
+            self.assertEqual(entries, {})
+        finally:
+            shutil.rmtree(root)
+            
+    def test_getinfo_pool(self):
+        memfs= MemoryFS()
+        for id in range(50):
+            memfs.setcontents("file%d" % id, "x"*id)
+        memfs.makedir("dir")
+        
+        entries= dict(self.lister.ListDir(memfs))
+        self.assertEqual(len(entries), 51)
+        self.assertEqual(entries["file42"]["size"], 42)
+        self.assertEqual(entries["dir"], memfs.getinfo("dir"))
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,71 @@
+import os
+import shutil
+import tempfile
+import unittest
+
+from fs.osfs import OSFS
+from fs.memoryfs import MemoryFS
+from fs.errors import ParentDirectoryMissingError
+
+from local_copy import ENGINES, copy_syspath, local_copyfile
+
+class TestLocalCopy(unittest.TestCase):
+    def setUp(self):
+        self.root= tempfile.mkdtemp()
+        self.data= "".join(chr(id % 251) for id in range(3*1024*1024+17))
+        self.src= os.path.join(self.root, "src")
+        open(self.src, "wb").write(self.data)
+
+    def tearDown(self):
+        shutil.rmtree(self.root)
+
+    def test_Engines(self):
+        for id, (name, engine) in enumerate(ENGINES):
+            dst= os.path.join(self.root, "dst%d" % id)
+            used= copy_syspath(self.src, dst, [(name, engine), ENGINES[-1]], False)
+            self.assertTrue(used in (name, "buffered"))
+            self.assertEqual(open(dst, "rb").read(), self.data)
+        
+    def test_Fallback(self):
+        #Engine, that copies part of file and gives up, is continued by the next one.
+        def partial(src_fd, dst_fd, count):
+            os.write(dst_fd, os.read(src_fd, 1000))
+            return False
+        dst= os.path.join(self.root, "dst")
+        self.assertEqual(copy_syspath(self.src, dst, [("partial", partial), ENGINES[-1]], False), "buffered")
+        self.assertEqual(open(dst, "rb").read(), self.data)
+        self.assertRaises(ParentDirectoryMissingError, copy_syspath, self.src, os.path.join(self.root, "missing", "dst"))
+        
+    def test_Sparse(self):
+        sparse= os.path.join(self.root, "sparse")
+        f= open(sparse, "wb")
+        f.truncate(64*1024*1024)
+        f.seek(8*1024*1024)
+        f.write("data"*4096)
+        f.seek(40*1024*1024)
+        f.write("more")
+        f.truncate(64*1024*1024)
+        f.close()
+        for id, (name, engine) in enumerate(ENGINES):
+            dst= os.path.join(self.root, "dst%d" % id)
+            self.assertTrue(copy_syspath(sparse, dst, [(name, engine), ENGINES[-1]], False) in (name, "buffered"))
+            self.assertEqual(os.path.getsize(dst), 64*1024*1024)
+            self.assertEqual(open(dst, "rb").read(), open(sparse, "rb").read())
+            # Only data extents are allocated, whatever filesystem block size is.
+            self.assertTrue(os.stat(dst).st_blocks*512<=os.stat(sparse).st_blocks*512+64*1024)
+        
+        hole= os.path.join(self.root, "hole")
+        open(hole, "wb").truncate(1024*1024)
+        self.assertEqual(copy_syspath(hole, os.path.join(self.root, "hole_copy"), None, False), None)
+        self.assertEqual(open(os.path.join(self.root, "hole_copy"), "rb").read(), "\0"*1024*1024)
+        
+    def test_Filesystems(self):
+        osfs= OSFS(self.root)
+        memory= MemoryFS()
+        local_copyfile(osfs, "src", osfs, "copy")
+        local_copyfile(osfs, "copy", memory, "copy")
+        local_copyfile(memory, "copy", osfs, "back")
+        self.assertEqual(open(os.path.join(self.root, "back"), "rb").read(), self.data)
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,56 @@
+import unittest
+import os
+import shutil
+import tempfile
+
+from fs.osfs import OSFS
+
+from merkle import TreeDigester, dir_digest
+
+class TestTreeDigester(unittest.TestCase):
+    def setUp(self):
+        self.root= tempfile.mkdtemp()
+        os.makedirs(os.path.join(self.root, "a", "b"))
+        os.makedirs(os.path.join(self.root, "c"))
+        open(os.path.join(self.root, "a", "b", "file"), "w").write("x")
+        open(os.path.join(self.root, "c", "file"), "w").write("y")
+        self.digester= TreeDigester(OSFS(self.root))
+        
+    def tearDown(self):
+        shutil.rmtree(self.root)
+        
+    def test_Digest(self):
+        root= self.digester.Digest(["root"])
+        a= self.digester.Digest(["root", "a"])
+        c= self.digester.Digest(["root", "c"])
+        self.assertEqual(self.digester.Digest(["root"]), root)
+        
+        # Change deep in a tree changes digests of all parents only.
+        open(os.path.join(self.root, "a", "b", "file"), "w").write("changed")
+        self.assertNotEqual(self.digester.Digest(["root", "a"]), a)
+        self.assertNotEqual(self.digester.Digest(["root"]), root)
+        self.assertEqual(self.digester.Digest(["root", "c"]), c)
+        
+        os.chmod(os.path.join(self.root, "c"), 0700)
+        self.assertEqual(self.digester.Digest(["root", "c"]), c)
+        self.assertNotEqual(self.digester.Digest(["root"]), root)
+        
+    def test_Keep(self):
+        digester= TreeDigester(OSFS(self.root), keep= True)
+        root= digester.Digest(["root"])
+        self.assertEqual(sorted(digester.digests), [(), ("a",), ("a", "b"), ("c",)])
+        # Kept digests are answered without listing again.
+        open(os.path.join(self.root, "a", "b", "file"), "w").write("changed")
+        digester.fs= None
+        self.assertEqual(digester.Digest(["root", "a", "b"]), digester.digests[("a", "b")])
+        self.assertEqual(digester.Digest(["root"]), root)
+        self.assertNotEqual(self.digester.Digest(["root"]), root)
+        
+    def test_dir_digest(self):
+        info= {"st_mode": 040755}
+        self.assertEqual(dir_digest([("dir", info)], {}), None)
+        self.assertEqual(dir_digest([("dir", info)], {"dir": "x"}), dir_digest([("dir", info)], {"dir": "x"}))
+        self.assertNotEqual(dir_digest([("dir", info)], {"dir": "x"}), dir_digest([("dir", info)], {"dir": "y"}))
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,109 @@
+import unittest
+
+from moves import MoveDetector
+from extra import get_file_fingerprint
+from plan import ActionKind, Side, SyncPlan
+
+def _info(ino, size, mtime):
+    return {"st_ino": ino, "size": size, "st_mtime": mtime, "st_ctime": mtime}
+
+class TestMoveDetector(unittest.TestCase):
+    def test_Inode(self):
+        plan= SyncPlan()
+        detector= MoveDetector()
+        # Inode of a deleted file reused by a different new file.
+        detector.Missing(Side.src, ["root", "old"], (1000000000, 5, 7, None), _info(70, 5, 1), None, "old", len(plan), get_file_fingerprint(_info(70, 5, 1)))
+        plan.Add(ActionKind.copy, Side.src, ["root", "old"], 0644, 5)
+        detector.New(Side.src, ["root", "new"], _info(7, 6, 2), None, "new", len(plan))
+        plan.Add(ActionKind.copy, Side.dst, ["root", "new"], 0644, 6)
+        
+        self.assertEqual(detector.Apply(plan), 0)
+        self.assertEqual(len(plan), 2)
+        
+    def test_Digest(self):
+        contents= {("dst", "old"): "a", ("src", "new"): "a", ("src", "other"): "b"}
+        digest= lambda side, files: [contents[(fs, name)] for fs, name, info in files]
+        plan= SyncPlan()
+        detector= MoveDetector(digest)
+        detector.Missing(Side.src, ["root", "old"], (1000000000, 5, None, None), _info(70, 5, 1), "dst", "old", len(plan), get_file_fingerprint(_info(70, 5, 1)))
+        plan.Add(ActionKind.copy, Side.src, ["root", "old"], 0644, 5)
+        detector.New(Side.src, ["root", "other"], _info(8, 5, 2), "src", "other", len(plan))
+        plan.Add(ActionKind.copy, Side.dst, ["root", "other"], 0644, 5)
+        detector.New(Side.src, ["root", "new"], _info(7, 5, 2), "src", "new", len(plan))
+        plan.Add(ActionKind.copy, Side.dst, ["root", "new"], 0644, 5)
+        
+        self.assertEqual(detector.Apply(plan), 1)
+        self.assertEqual([str(action) for action in plan], ["copy      src->dst root/other", "move      dst      root/old -> root/new"])
+        self.assertEqual(plan.Summary(), ({"copy": 1, "move": 1}, 5))
+
+    def test_ChangedOld(self):
+        # Old file changed on the other side since last synch is not a move source.
+        plan= SyncPlan()
+        detector= MoveDetector()
+        detector.Missing(Side.src, ["root", "old"], (1000000000, 5, 7, None), _info(70, 9, 3), None, "old", len(plan),
+                         get_file_fingerprint(_info(70, 5, 1)))
+        plan.Add(ActionKind.copy, Side.src, ["root", "old"], 0644, 9)
+        detector.New(Side.src, ["root", "new"], _info(7, 5, 1), None, "new", len(plan))
+        plan.Add(ActionKind.copy, Side.dst, ["root", "new"], 0644, 5)
+        
+        self.assertEqual(detector.Apply(plan), 0)
+        self.assertEqual(len(plan), 2)
+        
+    def test_Holds(self):
+        plan= SyncPlan()
+        detector= MoveDetector()
+        detector.MakeDir(Side.dst, ["root", "new"], len(plan))
+        plan.Add(ActionKind.mkdir, Side.dst, ["root", "new"], 0755)
+        detector.New(Side.src, ["root", "file"], _info(7, 5, 2), None, "file", len(plan))
+        plan.Add(ActionKind.copy, Side.dst, ["root", "file"], 0644, 5)
+        plan.Add(ActionKind.copy, Side.dst, ["root", "new", "file"], 0644, 5)
+        plan.Add(ActionKind.copy, Side.dst, ["root", "newer"], 0644, 5)
+        # Walk can't execute actions, that Apply may still change.
+        self.assertEqual([detector.Holds(number, action) for number, action in enumerate(plan)], [True, True, True, False])
+        
+    def test_Batch(self):
+        # All candidates of a side are hashed in one call.
+        contents= {("dst", "a/old"): "a", ("dst", "b/old"): "b", ("src", "c/new"): "b", ("src", "d/new"): "a"}
+        calls= []
+        digest= lambda side, files: calls.append((side, sorted(name for fs, name, info in files))) or [contents[(fs, name)] for fs, name, info in files]
+        plan= SyncPlan()
+        detector= MoveDetector(digest)
+        for name in ["a", "b"]:
+            detector.Missing(Side.src, ["root", name, "old"], (1000000000, 5, None, None), _info(70, 5, 1), "dst", name+"/old", len(plan), get_file_fingerprint(_info(70, 5, 1)))
+            plan.Add(ActionKind.copy, Side.src, ["root", name, "old"], 0644, 5)
+        for name in ["c", "d"]:
+            detector.New(Side.src, ["root", name, "new"], _info(8, 5, 2), "src", name+"/new", len(plan))
+            plan.Add(ActionKind.copy, Side.dst, ["root", name, "new"], 0644, 5)
+        
+        self.assertEqual(detector.Apply(plan), 2)
+        self.assertEqual(calls, [(Side.src, ["c/new", "d/new"]), (Side.dst, ["a/old", "b/old"])])
+        self.assertEqual([str(action) for action in plan], ["move      dst      root/b/old -> root/c/new",
+                                                            "move      dst      root/a/old -> root/d/new"])
+
+    def test_Partial(self):
+        # Directory with a new file can't be one move, but its old copy is not made
+        # again and it is removed, where files moved out of it.
+        contents= {("dst", "old/a"): "a", ("src", "new/a"): "a", ("dst", "old/empty"): "", ("src", "new/empty"): "", ("src", "new/other"): ""}
+        digest= lambda side, files: [contents[(fs, name)] for fs, name, info in files]
+        plan= SyncPlan()
+        detector= MoveDetector(digest)
+        detector.MakeDir(Side.src, ["root", "old"], len(plan))
+        plan.Add(ActionKind.mkdir, Side.src, ["root", "old"], 0755)
+        for name, size in [("a", 5), ("empty", 0)]:
+            detector.Missing(Side.src, ["root", "old", name], (1000000000, size, None, None), _info(70, size, 1), "dst", "old/"+name, len(plan), get_file_fingerprint(_info(70, size, 1)))
+            plan.Add(ActionKind.copy, Side.src, ["root", "old", name], 0644, size)
+        detector.MakeDir(Side.dst, ["root", "new"], len(plan))
+        plan.Add(ActionKind.mkdir, Side.dst, ["root", "new"], 0755)
+        for name, size in [("a", 5), ("other", 0), ("empty", 0)]:
+            detector.New(Side.src, ["root", "new", name], _info(7, size, 2), "src", "new/"+name, len(plan))
+            plan.Add(ActionKind.copy, Side.dst, ["root", "new", name], 0644, size)
+        
+        self.assertEqual(detector.Apply(plan), 2)
+        self.assertEqual([str(action) for action in plan], ["mkdir     dst      root/new",
+                                                            "move      dst      root/old/a -> root/new/a",
+                                                            "copy      src->dst root/new/other",
+                                                            "move      dst      root/old/empty -> root/new/empty",
+                                                            "removedir dst      root/old (if empty)"])
+
+if __name__ == '__main__':
+    unittest.main()
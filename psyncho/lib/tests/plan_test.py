@@ -0,0 +1,337 @@
+import unittest
+import os
+import sys
+import shutil
+import subprocess
+import tempfile
+import pod
+
+from StringIO import StringIO
+
+from psyncho import *
+from plan import ActionKind, Side, SyncPlan
+from listing import stat_to_info
+from extra import get_file_fingerprint
+from merkle import TreeDigester
+from fs.osfs import OSFS
+
+class TestSyncPlan(unittest.TestCase):
+    @classmethod
+    def setUpClass(cls):
+        cls.db = pod.Db(file = 'PlanTest.db', dynamic_index = True)
+        
+    def setUp(self):
+        self.root= tempfile.mkdtemp()
+        self.src= os.path.join(self.root, "src")
+        self.dst= os.path.join(self.root, "dst")
+        os.makedirs(os.path.join(self.src, "dir", "sub"))
+        os.makedirs(os.path.join(self.dst, "other"))
+        open(os.path.join(self.src, "dir", "file"), "w").write("x"*10)
+        open(os.path.join(self.src, "dir", "sub", "file"), "w").write("x"*20)
+        open(os.path.join(self.dst, "other", "file"), "w").write("x"*30)
+        open(os.path.join(self.dst, "stopped"), "w").write("x")
+        
+    def tearDown(self):
+        shutil.rmtree(self.root)
+        
+    def Snapshot(self, path):
+        out= []
+        for dirpath, dirnames, filenames in os.walk(path):
+            out+= [os.path.join(dirpath, name) for name in dirnames+filenames]
+        return sorted(out)
+        
+    def test_DryRun(self):
+        layer= ConfigLayer("plan", None, PathStatus.include)
+        layer.paths.SetPathStatus(["root", "stopped"], PathStatus.stop)
+        fsc= FileSyncConfig(self.src, self.dst, layer, "plan")
+        before= (self.Snapshot(self.src), self.Snapshot(self.dst))
+        
+        plan= FileSync(fsc, self.db).sync(["root"], False, True)
+        self.assertEqual((self.Snapshot(self.src), self.Snapshot(self.dst)), before)
+        self.assertEqual(fsc.dst_index.GetPathPart(["root", "dir"]).name, "root")
+        
+        actions= [(ActionKind.Name(action.kind), Side.Name(action.side), "/".join(action.path)) for action in plan]
+        self.assertEqual(sorted(actions), sorted([("mkdir", "dst", "root/dir"),
+                                                  ("copy", "dst", "root/dir/file"),
+                                                  ("mkdir", "dst", "root/dir/sub"),
+                                                  ("copy", "dst", "root/dir/sub/file"),
+                                                  ("mkdir", "src", "root/other"),
+                                                  ("copy", "src", "root/other/file"),
+                                                  ("remove", "dst", "root/stopped")]))
+        # Directories are made before anything is copied into them.
+        self.assertTrue(actions.index(("mkdir", "dst", "root/dir/sub"))<actions.index(("copy", "dst", "root/dir/sub/file")))
+        self.assertEqual(plan.Summary(), ({"mkdir": 3, "copy": 3, "remove": 1}, 60))
+        
+        layer.delete()
+        fsc.delete()
+        self.db.commit()
+        
+    def test_Shallow(self):
+        os.makedirs(os.path.join(self.dst, "dir", "sub"))
+        layer= ConfigLayer("shallow", None, PathStatus.include)
+        fsc= FileSyncConfig(self.src, self.dst, layer, "shallow")
+        
+        fs= FileSync(fsc, self.db)
+        fs.recursive= False
+        plan= fs.sync(["root", "dir"], False, True)
+        actions= [(ActionKind.Name(action.kind), Side.Name(action.side), plan.RelativePath(action)) for action in plan]
+        # Directory on both sides is left for its own synch.
+        self.assertEqual(actions, [("copy", "dst", "file")])
+        self.assertEqual(FileSync(fsc, self.db).sync(["root", "missing"], False, True), None)
+        
+        layer.delete()
+        fsc.delete()
+        self.db.commit()
+        
+    def test_Digest(self):
+        layer= ConfigLayer("digest", None, PathStatus.include)
+        fsc= FileSyncConfig(self.src, self.dst, layer, "digest")
+        FileSync(fsc, self.db).sync(["root"], False, True)
+        # Changed subtrees get digests on the next synch.
+        self.assertEqual(fsc.src_index.GetPathPart(["root", "dir"]).Digest, None)
+        
+        for side in [self.src, self.dst]:
+            os.makedirs(os.path.join(side, "same", "sub", "deeper"))
+        plan= FileSync(fsc, self.db).sync(["root"], False, True)
+        # Only index updates are applied, files stay as they are.
+        digests= SyncPlan(plan.base_path)
+        for action in plan:
+            if action.kind==ActionKind.digest:
+                digests.Add(action.kind, action.side, action.path, target= action.target)
+        FileSync(fsc, self.db).Execute(digests, OSFS(self.src), OSFS(self.dst), False)
+        self.assertNotEqual(fsc.src_index.GetPathPart(["root", "same", "sub"]).Digest, None)
+        self.assertNotEqual(fsc.dst_index.GetPathPart(["root", "same"]).Digest, None)
+        self.assertEqual(fsc.src_index.GetPathPart(["root"]).Digest, None)
+        
+        listed= []
+        fs= FileSync(fsc, self.db)
+        fs.digest_sources= {Side.src: TreeDigester(OSFS(self.src)), Side.dst: TreeDigester(OSFS(self.dst))}
+        fs._list= lambda dir: listed.append(dir) or FileSync._list(fs, dir)
+        plan= fs.sync(["root"], False, True)
+        # Subtree, that is the same as after last synch, is not walked.
+        self.assertEqual(len(listed), 2*len(["root", "dir", "dir/sub", "other"]))
+        self.assertFalse([dir for dir in listed if dir and "same" in dir.getsyspath("")])
+        
+        open(os.path.join(self.dst, "same", "sub", "deeper", "file"), "w").write("new")
+        plan= fs.sync(["root"], False, True)
+        copies= [(ActionKind.Name(action.kind), Side.Name(action.side), "/".join(action.path)) for action in plan if action.kind==ActionKind.copy and "same" in action.path]
+        self.assertEqual(copies, [("copy", "src", "root/same/sub/deeper/file")])
+        
+        layer.delete()
+        fsc.delete()
+        self.db.commit()
+        
+    def StoredResume(self, name):
+        #Commits and reads resume cursor back in another process, pod
+        #allows only one Db in this one.
+        self.db.commit()
+        script= ("import sys, pod; sys.path.insert(0, %r); from psyncho import *; "
+                 "db= pod.Db(file= 'PlanTest.db', dynamic_index= True); "
+                 "print repr([config.GetResume() for config in FileSyncConfig if config.name==%r])"
+                 % (os.path.dirname(os.path.dirname(os.path.abspath(__file__))), name))
+        output= subprocess.check_output([sys.executable, "-c", script])
+        return eval(output.strip().splitlines()[-1])[0]
+        
+    def Reload(self, name):
+        #Config loaded from disk, like the next run of command line gets it.
+        self.db.commit(clear_cache= True)
+        for config in FileSyncConfig:
+            if config.name==name:
+                return config
+        
+    def test_Resume(self):
+        shutil.rmtree(self.src)
+        shutil.rmtree(self.dst)
+        os.makedirs(self.src)
+        os.makedirs(self.dst)
+        for id in range(5):
+            open(os.path.join(self.src, "file%d" % id), "w").write("x"*id)
+        layer= ConfigLayer("resume", None, PathStatus.include)
+        fsc= FileSyncConfig(self.src, self.dst, layer, "resume")
+        resume_file= os.path.join(self.root, "resume.plan")
+        
+        fs= FileSync(fsc, self.db)
+        fs.resume_file= resume_file
+        # Synch, that budget can stop, plans everything first.
+        fs.time_budget= 3600
+        fs.checkpoint_actions= 2
+        checks= []
+        # Budget runs out before the fourth action.
+        fs._over_budget= lambda: checks.append(1) or len(checks)>3
+        plan= fs.sync(["root"], False)
+        self.assertEqual(fsc.GetResume(), (resume_file, 3))
+        self.assertEqual(len(os.listdir(self.dst)), 3)
+        self.assertEqual(self.StoredResume("resume"), (resume_file, 3))
+        fsc= self.Reload("resume")
+        layer= fsc.config_layer
+        
+        fs= FileSync(fsc, self.db)
+        fs.resume_file= resume_file
+        fs.Plan= lambda *args: self.fail("Resumed synch walks again")
+        fs.sync(["root"], False, False, True)
+        self.assertEqual(sorted(os.listdir(self.dst)), ["file%d" % id for id in range(5)])
+        self.assertEqual(fsc.GetResume(), None)
+        self.assertFalse(os.path.exists(resume_file))
+        # Cleared cursor must be stored too, with the rest of commit.
+        self.assertEqual(self.StoredResume("resume"), None)
+        
+        layer.delete()
+        fsc.delete()
+        self.db.commit()
+        
+    def IndexTree(self, fsc):
+        for index, side in [(fsc.src_index, self.src), (fsc.dst_index, self.dst)]:
+            for dirpath, dirnames, filenames in os.walk(side):
+                for name in filenames:
+                    path= os.path.join(dirpath, name)
+                    part= index.GetPathPart(["root"]+os.path.relpath(path, side).split(os.sep), True)
+                    part.Fingerprint= get_file_fingerprint(stat_to_info(os.lstat(path)))
+                    
+    def test_Moves(self):
+        for side in [self.src, self.dst]:
+            shutil.rmtree(side)
+            os.makedirs(os.path.join(side, "old", "sub"))
+            open(os.path.join(side, "old", "sub", "file"), "w").write("x")
+            open(os.path.join(side, "old", "file"), "w").write("y")
+            open(os.path.join(side, "a"), "w").write("z")
+        layer= ConfigLayer("moves", None, PathStatus.include)
+        fsc= FileSyncConfig(self.src, self.dst, layer, "moves")
+        self.IndexTree(fsc)
+        os.rename(os.path.join(self.src, "old"), os.path.join(self.src, "new"))
+        os.rename(os.path.join(self.src, "a"), os.path.join(self.src, "b"))
+        
+        fs= FileSync(fsc, self.db)
+        plan= fs.sync(["root"], False, True)
+        self.assertEqual([str(action) for action in plan if action.kind!=ActionKind.digest],
+                         ["move      dst      root/a -> root/b", "move      dst      root/old -> root/new"])
+        
+        fs.Execute(plan, OSFS(self.src), OSFS(self.dst), False)
+        self.assertEqual(self.Snapshot(self.dst), [os.path.join(self.dst, path) for path in ["b", "new", "new/file", "new/sub", "new/sub/file"]])
+        self.assertEqual(fsc.dst_index.GetPathPart(["root", "new", "sub", "file"]).name, "file")
+        self.assertEqual(fsc.src_index.GetChildrenByName().get("old"), None)
+        self.assertEqual(FileSync(fsc, self.db).sync(["root"], False, True).changes, 0)
+        
+        layer.delete()
+        fsc.delete()
+        self.db.commit()
+        
+    def test_PartialMove(self):
+        for side in [self.src, self.dst]:
+            shutil.rmtree(side)
+            os.makedirs(os.path.join(side, "old", "sub"))
+            open(os.path.join(side, "old", "sub", "file"), "w").write("x")
+            open(os.path.join(side, "old", "file"), "w").write("y")
+        layer= ConfigLayer("partial", None, PathStatus.include)
+        # Wrapper without delays, so stock OSFS can make directories without chmod.
+        fsc= FileSyncConfig("latency:osfs://"+self.src, "latency:osfs://"+self.dst, layer, "partial")
+        self.IndexTree(fsc)
+        # Files move to a directory, that also gets a new file.
+        os.rename(os.path.join(self.src, "old"), os.path.join(self.src, "new"))
+        open(os.path.join(self.src, "new", "extra"), "w").write("z")
+        
+        plan= FileSync(fsc, self.db).sync(["root"], False)
+        self.assertEqual([str(action) for action in plan if action.kind!=ActionKind.digest],
+                         ["mkdir     dst      root/new",
+                          "move      dst      root/old/file -> root/new/file",
+                          "copy      src->dst root/new/extra",
+                          "move      dst      root/old/sub -> root/new/sub",
+                          "removedir dst      root/old (if empty)"])
+        snapshot= [os.path.join(self.dst, path) for path in ["new", "new/extra", "new/file", "new/sub", "new/sub/file"]]
+        self.assertEqual(self.Snapshot(self.dst), snapshot)
+        # Emptied old directory is not made again on the side it moved from.
+        FileSync(fsc, self.db).sync(["root"], False)
+        self.assertEqual(self.Snapshot(self.dst), snapshot)
+        self.assertEqual(self.Snapshot(self.src), [path.replace(self.dst, self.src) for path in snapshot])
+        
+        layer.delete()
+        fsc.delete()
+        self.db.commit()
+        
+    def test_Stream(self):
+        # Files are copied while the walk lists the rest of the tree.
+        for name in ["a", "b", "c"]:
+            os.makedirs(os.path.join(self.src, "tree", name))
+            open(os.path.join(self.src, "tree", name, "file"), "w").write(name)
+        layer= ConfigLayer("stream", None, PathStatus.include)
+        fsc= FileSyncConfig("latency:osfs://"+self.src, "latency:osfs://"+self.dst, layer, "stream")
+        fs= FileSync(fsc, self.db)
+        copied= []
+        def listed(dir):
+            copied.append(len([path for path in self.Snapshot(self.dst) if os.path.isfile(path)]))
+            return FileSync._list(fs, dir)
+        fs._list= listed
+        fs.sync(["root"], False)
+        # Files of walked directories are there before the last listing.
+        self.assertEqual(copied[0], 2)
+        self.assertTrue(copied[-1]>copied[0])
+        self.assertEqual(open(os.path.join(self.dst, "tree", "b", "file")).read(), "b")
+        
+        layer.delete()
+        fsc.delete()
+        self.db.commit()
+        
+    def test_RenameEdited(self):
+        # Old path renamed on one side and edited on the other is not a move.
+        for side in [self.src, self.dst]:
+            shutil.rmtree(side)
+            os.makedirs(os.path.join(side, "a"))
+            open(os.path.join(side, "a", "f.txt"), "w").write("original")
+        layer= ConfigLayer("edited", None, PathStatus.include)
+        fsc= FileSyncConfig("latency:osfs://"+self.src, "latency:osfs://"+self.dst, layer, "edited")
+        self.IndexTree(fsc)
+        os.rename(os.path.join(self.src, "a", "f.txt"), os.path.join(self.src, "a", "g.txt"))
+        open(os.path.join(self.dst, "a", "f.txt"), "w").write("EDITED on dst, longer")
+        
+        plan= FileSync(fsc, self.db).sync(["root"], False)
+        self.assertEqual(sorted(str(action) for action in plan if action.kind!=ActionKind.digest),
+                         ["copy      dst->src root/a/f.txt", "copy      src->dst root/a/g.txt"])
+        FileSync(fsc, self.db).sync(["root"], False)
+        for side in [self.src, self.dst]:
+            self.assertEqual(open(os.path.join(side, "a", "f.txt")).read(), "EDITED on dst, longer")
+            self.assertEqual(open(os.path.join(side, "a", "g.txt")).read(), "original")
+        
+        layer.delete()
+        fsc.delete()
+        self.db.commit()
+        
+    def test_Fingerprint(self):
+        for side in [self.src, self.dst]:
+            for name in ["same", "changed"]:
+                open(os.path.join(side, name), "w").write("data")
+                os.utime(os.path.join(side, name), (1000, 1000))
+        layer= ConfigLayer("fingerprint", None, PathStatus.include)
+        fsc= FileSyncConfig(self.src, self.dst, layer, "fingerprint")
+        for index, side in [(fsc.src_index, self.src), (fsc.dst_index, self.dst)]:
+            for name in ["same", "changed"]:
+                info= stat_to_info(os.lstat(os.path.join(side, name)))
+                index.GetPathPart(["root", name], True).Fingerprint= get_file_fingerprint(info)
+                
+        # Same size and the same second, only fingerprint sees the change.
+        open(os.path.join(self.src, "changed"), "w").write("DATA")
+        os.utime(os.path.join(self.src, "changed"), (1000.5, 1000.5))
+        
+        plan= FileSync(fsc, self.db).sync(["root"], False, True)
+        updates= [(ActionKind.Name(action.kind), Side.Name(action.side), "/".join(action.path)) for action in plan if action.kind==ActionKind.update]
+        self.assertEqual(updates, [("update", "dst", "root/changed")])
+        
+        layer.delete()
+        fsc.delete()
+        self.db.commit()
+        
+    def test_Serialize(self):
+        plan= SyncPlan(["root", "base"])
+        plan.Add(ActionKind.copy, Side.dst, ["root", "base", "a"], 0644, 10, (1000, 10, 5, None), True)
+        plan.Add(ActionKind.relink, Side.src, ["root", "base", "l"], target= "a")
+        plan.Add(ActionKind.removedir, Side.both, ["root", "base", "d"])
+        
+        out= StringIO()
+        plan.Dump(out)
+        loaded= SyncPlan.Load(StringIO(out.getvalue()))
+        
+        self.assertEqual(loaded.base_path, ("root", "base"))
+        self.assertEqual([action.ToList() for action in loaded], [action.ToList() for action in plan])
+        self.assertEqual(loaded.RelativePath(loaded.actions[0]), "a")
+        self.assertEqual(str(loaded.actions[1]), "relink    dst->src root/base/l -> a")
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,30 @@
+import unittest
+import threading
+
+from fs.memoryfs import MemoryFS
+
+from transfer import TransferJob, TransferQueue
+
+class TestTransferQueue(unittest.TestCase):
+    def test_transfer(self):
+        src= MemoryFS()
+        dst= MemoryFS()
+        for id in range(100):
+            src.setcontents("file%d" % id, "x"*id)
+            
+        done= []
+        def on_done(name, info):
+            done.append((name, info["size"], threading.current_thread().name))
+            
+        transfers= TransferQueue(4, 8)
+        for id in range(100):
+            transfers.Put(TransferJob(src, "file%d" % id, dst, "file%d" % id, None, lambda info, name="file%d" % id: on_done(name, info)))
+        transfers.Put(TransferJob(src, "missing", dst, "missing", None, lambda info: on_done("missing", info)))
+        transfers.Finish()
+        
+        self.assertEqual(sorted(done), sorted([("file%d" % id, id, threading.current_thread().name) for id in range(100)]))
+        self.assertEqual(transfers.failed, 1)
+        self.assertEqual(dst.getcontents("file42"), "x"*42)
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,38 @@
+import unittest
+
+from fs.memoryfs import MemoryFS
+
+from listing import DirLister
+from walker import SubtreePrefetcher
+
+class TestPrefetcher(unittest.TestCase):
+    def test_prefetch(self):
+        src= MemoryFS()
+        dst= MemoryFS()
+        for id in range(20):
+            src.makedir("dir%d" % id)
+            src.setcontents("dir%d/file" % id, "data")
+        dst.makedir("dir0")
+        dst.setcontents("dir0/other", "data")
+        
+        lister= DirLister(1)
+        prefetcher= SubtreePrefetcher(lister, 2)
+        subdirs= [("dir0", src.opendir("dir0"), dst.opendir("dir0"))]
+        subdirs+= [("dir%d" % id, src.opendir("dir%d" % id), None) for id in range(1, 20)]
+        prefetcher.Schedule(("root",), subdirs)
+        
+        (src_entries, dst_entries)= prefetcher.Take(("root", "dir0"))
+        self.assertEqual([name for name, info in src_entries], ["file"])
+        self.assertEqual([name for name, info in dst_entries], ["other"])
+        (src_entries, dst_entries)= prefetcher.Take(("root", "dir1"))
+        self.assertEqual([name for name, info in src_entries], ["file"])
+        self.assertEqual(dst_entries, [])
+        self.assertEqual(prefetcher.Take(("root", "missing")), None)
+        
+        prefetcher.Done(("root",))
+        self.assertEqual(prefetcher.results, {})
+        self.assertEqual(prefetcher.pending, [])
+        prefetcher.Close()
+
+if __name__ == '__main__':
+    unittest.main()
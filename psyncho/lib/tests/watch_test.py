@@ -0,0 +1,48 @@
+import unittest
+import os
+import shutil
+import struct
+import tempfile
+
+from watch import TreeWatcher, parse_events, synch_roots, IN_CREATE, IN_ISDIR, IN_Q_OVERFLOW
+
+def _raw_event(wd, mask, name):
+    padded= name+"\0"*(16-len(name)%16)
+    return struct.pack("iIII", wd, mask, 0, len(padded))+padded
+
+class TestTreeWatcher(unittest.TestCase):
+    def setUp(self):
+        self.root= tempfile.mkdtemp()
+        os.makedirs(os.path.join(self.root, "a", "b"))
+        try:
+            self.watcher= TreeWatcher([self.root])
+        except OSError:
+            shutil.rmtree(self.root)
+            raise unittest.SkipTest("inotify is not available")
+        
+    def tearDown(self):
+        self.watcher.Close()
+        shutil.rmtree(self.root)
+        
+    def test_parse(self):
+        data= _raw_event(1, IN_CREATE, "file")+_raw_event(2, IN_CREATE | IN_ISDIR, "dir")+_raw_event(-1, IN_Q_OVERFLOW, "")
+        self.assertEqual(parse_events(data), [(1, IN_CREATE, 0, "file"), (2, IN_CREATE | IN_ISDIR, 0, "dir"), (-1, IN_Q_OVERFLOW, 0, "")])
+        
+    def test_Wait(self):
+        self.assertEqual(self.watcher.Wait(0.1, 0), None)
+        
+        open(os.path.join(self.root, "a", "b", "file"), "w").write("x")
+        open(os.path.join(self.root, "top"), "w").write("x")
+        self.assertEqual(self.watcher.Wait(0.1, 1), (set([("a", "b"), ()]), False))
+        
+        # New directory is watched as soon as its creation is read.
+        os.makedirs(os.path.join(self.root, "a", "new"))
+        self.assertEqual(self.watcher.Wait(0.1, 1), (set([("a",)]), False))
+        open(os.path.join(self.root, "a", "new", "file"), "w").write("x")
+        self.assertEqual(self.watcher.Wait(0.1, 1), (set([("a", "new")]), False))
+        
+    def test_synch_roots(self):
+        self.assertEqual(synch_roots(set([("a", "b"), ("b",), (), ("a",)])), [(), ("a",), ("b",), ("a", "b")])
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,118 @@
+import threading
+import Queue
+
+from local_copy import local_copyfile
+
+from delta import delta_copy
+
+class TransferJob(object):
+    '''
+    Copy of one file. on_done is called with info of the copied file
+    and is always called on the walking thread.
+    '''
+    __slots__= ("src", "src_path", "dst", "dst_path", "mode", "on_done")
+
+    def __init__(self, src, src_path, dst, dst_path, mode= None, on_done= None):
+        self.src= src
+        self.src_path= src_path
+        self.dst= dst
+        self.dst_path= dst_path
+        self.mode= mode
+        self.on_done= on_done
+
+    def Run(self):
+        local_copyfile(self.src, self.src_path, self.dst, self.dst_path)
+        #Change mod of newly created file
+        #to mod of a source file
+        if self.mode!=None:
+            self.dst.chmod(self.dst_path, self.mode)
+
+        return self.dst.getinfo(self.dst_path)
+
+class DeltaTransferJob(TransferJob):
+    '''
+    Update of existing file, that only writes changed blocks. Falls back
+    to a full copy when most of the file has changed.
+    '''
+    __slots__= ("size",)
+
+    def __init__(self, src, src_path, dst, dst_path, size, mode= None, on_done= None):
+        TransferJob.__init__(self, src, src_path, dst, dst_path, mode, on_done)
+        self.size= size
+
+    def Run(self):
+        if delta_copy(self.src, self.src_path, self.dst, self.dst_path, self.size)==None:
+            local_copyfile(self.src, self.src_path, self.dst, self.dst_path)
+        if self.mode!=None:
+            self.dst.chmod(self.dst_path, self.mode)
+
+        return self.dst.getinfo(self.dst_path)
+
+class TransferQueue(object):
+    '''
+    Bounded queue of file copies drained by worker threads.
+
+    Walk puts jobs in and continues scanning, it only blocks when the
+    queue is full. Completed jobs are collected and their on_done
+    callbacks run when walk calls ApplyCompleted, so FileIndex objects
+    are only changed by the walking thread.
+    '''
+    def __init__(self, jobs, size= None):
+        if size==None:
+            size= jobs*16
+        self.queue= Queue.Queue(size)
+        self.completed= Queue.Queue()
+        self.failed= 0
+        self.workers= []
+        for id in range(jobs):
+            worker= threading.Thread(target= self._Work, name= "transfer-%d" % id)
+            worker.daemon= True
+            worker.start()
+            self.workers.append(worker)
+
+    def _Work(self):
+        while True:
+            job= self.queue.get()
+            try:
+                if job==None:
+                    return
+                try:
+                    self.completed.put((job, job.Run()))
+                except Exception:
+                    self.completed.put((job, None))
+            finally:
+                self.queue.task_done()
+
+    def Put(self, job):
+        self.queue.put(job)
+
+    def ApplyCompleted(self):
+        '''
+        Runs callbacks of completed jobs, must be called by the walk.
+        '''
+        while True:
+            try:
+                (job, info)= self.completed.get_nowait()
+            except Queue.Empty:
+                return
+            if info==None:
+                self.failed+= 1
+            elif job.on_done:
+                job.on_done(info)
+
+    def Wait(self):
+        '''
+        Waits for all queued jobs and applies them, workers keep running.
+        '''
+        self.queue.join()
+        self.ApplyCompleted()
+
+    def Finish(self):
+        '''
+        Waits for all queued jobs, applies them and stops workers.
+        '''
+        self.Wait()
+        for worker in self.workers:
+            self.queue.put(None)
+        for worker in self.workers:
+            worker.join()
@@ -0,0 +1,78 @@
+from multiprocessing.pool import ThreadPool
+
+class SubtreePrefetcher(object):
+    '''
+    Lists subdirectories on a worker pool ahead of the walk.
+
+    Only listings are made in parallel. All decisions, copies and index
+    updates stay on the walking thread and happen in the same order as
+    in a sequential walk, so pod objects are never touched by workers.
+    Directories scheduled last are listed first, because depth first
+    walk enters them sooner.
+    '''
+    def __init__(self, lister, jobs):
+        self.lister= lister
+        self.pool= ThreadPool(jobs)
+        self.window= jobs*4 # Max listings done, but not taken yet.
+
+        self.pending= [] # Stack of (path, src, dst) not submitted yet.
+        self.results= {}
+        self.children= {}
+
+    def _List(self, src, dst):
+        if dst==None:
+            return (self.lister.ListDir(src), [])
+        if src==None:
+            return ([], self.lister.ListDir(dst))
+        return (self.lister.ListDir(src), self.lister.ListDir(dst))
+
+    def _Fill(self):
+        while self.pending and len(self.results)<self.window:
+            path, src, dst= self.pending.pop()
+            self.results[path]= self.pool.apply_async(self._List, (src, dst))
+
+    def Schedule(self, path, subdirs):
+        '''
+        Schedules listing of subdirectories, that walk will enter.
+        @param path: Path of parent directory
+        @param subdirs: (name, src, dst)[], src or dst is None when directory
+                        exists only on one side.
+        '''
+        paths= []
+        for name, src, dst in reversed(subdirs):
+            paths.append(path+(name,))
+            self.pending.append((path+(name,), src, dst))
+        self.children[path]= paths
+        self._Fill()
+
+    def Take(self, path):
+        '''
+        Gets listings of both sides for directory, or None if it was not
+        listed ahead.
+        '''
+        result= self.results.pop(path, None)
+        if result==None:
+            return None
+
+        self._Fill()
+        try:
+            return result.get()
+        except Exception:
+            # Let the walk list it again and report the error itself.
+            return None
+
+    def Done(self, path):
+        '''
+        Forgets listings of subdirectories, that walk did not enter.
+        '''
+        paths= set(self.children.pop(path, []))
+        if not paths:
+            return
+        for child in paths:
+            self.results.pop(child, None)
+        self.pending= [item for item in self.pending if item[0] not in paths]
+        self._Fill()
+
+    def Close(self):
+        self.pool.close()
+        self.pool.join()
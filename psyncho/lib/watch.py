@@ -0,0 +1,198 @@
+import os
+import errno
+import select
+import struct
+import ctypes
+import ctypes.util
+
+from time import time
+
+IN_MODIFY= 0x00000002
+IN_ATTRIB= 0x00000004
+IN_CLOSE_WRITE= 0x00000008
+IN_MOVED_FROM= 0x00000040
+IN_MOVED_TO= 0x00000080
+IN_CREATE= 0x00000100
+IN_DELETE= 0x00000200
+IN_DELETE_SELF= 0x00000400
+IN_MOVE_SELF= 0x00000800
+IN_Q_OVERFLOW= 0x00004000
+IN_IGNORED= 0x00008000
+IN_ONLYDIR= 0x01000000
+IN_DONT_FOLLOW= 0x02000000
+IN_ISDIR= 0x40000000
+IN_CLOEXEC= 0o2000000
+IN_NONBLOCK= 0o4000
+
+#Events that change what a synch of parent directory sees.
+WATCH_MASK= (IN_MODIFY | IN_ATTRIB | IN_CLOSE_WRITE | IN_MOVED_FROM | IN_MOVED_TO |
+             IN_CREATE | IN_DELETE | IN_DELETE_SELF | IN_MOVE_SELF | IN_ONLYDIR | IN_DONT_FOLLOW)
+
+_event= struct.Struct("iIII")
+
+_libc= None
+
+def _inotify_libc():
+    global _libc
+    if _libc==None:
+        libc= ctypes.CDLL(ctypes.util.find_library("c"), use_errno=True)
+        if not hasattr(libc, "inotify_init1"):
+            raise OSError(errno.ENOSYS, "inotify is not available")
+        libc.inotify_add_watch.argtypes= [ctypes.c_int, ctypes.c_char_p, ctypes.c_uint32]
+        _libc= libc
+    return _libc
+
+def parse_events(data):
+    '''
+    Splits buffer read from inotify descriptor.
+    @return: (wd, mask, cookie, name)[]
+    '''
+    events= []
+    pos= 0
+    while pos+_event.size<=len(data):
+        (wd, mask, cookie, length)= _event.unpack_from(data, pos)
+        pos+= _event.size
+        name= data[pos:pos+length].rstrip("\0")
+        pos+= length
+        events.append((wd, mask, cookie, name))
+    return events
+
+class Inotify(object):
+    '''
+    Thin ctypes wrapper of Linux inotify descriptor.
+    '''
+    def __init__(self):
+        self.libc= _inotify_libc()
+        self.fd= self.libc.inotify_init1(IN_CLOEXEC | IN_NONBLOCK)
+        if self.fd<0:
+            error= ctypes.get_errno()
+            raise OSError(error, os.strerror(error))
+
+    def AddWatch(self, path, mask= WATCH_MASK):
+        '''
+        @return: watch descriptor, or None when path is gone or not a directory
+        '''
+        if isinstance(path, unicode):
+            path= path.encode("utf-8")
+        wd= self.libc.inotify_add_watch(self.fd, path, mask)
+        if wd<0:
+            error= ctypes.get_errno()
+            if error in (errno.ENOENT, errno.ENOTDIR):
+                return None
+            raise OSError(error, os.strerror(error), path)
+        return wd
+
+    def Read(self, timeout= None):
+        '''
+        Waits at most timeout seconds for events.
+        @return: (wd, mask, cookie, name)[], empty on timeout
+        '''
+        try:
+            (readable, writable, failed)= select.select([self.fd], [], [], timeout)
+        except select.error, e:
+            # Interrupted by a signal, its handler runs next.
+            if e.args[0]==errno.EINTR:
+                return []
+            raise
+        if not readable:
+            return []
+        try:
+            return parse_events(os.read(self.fd, 64*1024))
+        except OSError, e:
+            if e.errno==errno.EAGAIN:
+                return []
+            raise
+
+    def Close(self):
+        if self.fd>=0:
+            os.close(self.fd)
+            self.fd= -1
+
+class TreeWatcher(object):
+    '''
+    Watches every directory under a set of roots and collects paths of
+    directories, whose content has changed.
+
+    Paths are relative to roots, so changes on both sides of a synch end
+    up in one set. Directories made while watching get watches as soon
+    as their creation is read.
+    '''
+    def __init__(self, roots):
+        self.inotify= Inotify()
+        self.watches= {} # wd: (root, relative path)
+        for root in roots:
+            self.AddTree(root, ())
+
+    def AddTree(self, root, path):
+        '''
+        Adds watches to directory and all directories under it.
+        '''
+        for dir_path, dirs, files in os.walk(os.path.join(root, *path)):
+            rel= tuple(os.path.relpath(dir_path, root).split(os.sep))
+            if rel==(".",):
+                rel= ()
+            wd= self.inotify.AddWatch(dir_path)
+            if wd!=None:
+                self.watches[wd]= (root, rel)
+
+    def Rescan(self):
+        '''
+        Watches directories, whose creation might have been lost.
+        '''
+        for root in set(root for root, path in self.watches.values()):
+            self.AddTree(root, ())
+
+    def _Dirty(self, events, dirty):
+        #@return: True when kernel dropped events
+        overflow= False
+        for wd, mask, cookie, name in events:
+            if mask & IN_Q_OVERFLOW:
+                overflow= True
+                continue
+            watch= self.watches.get(wd)
+            if watch==None:
+                continue
+            (root, path)= watch
+            if mask & IN_IGNORED:
+                del self.watches[wd]
+                continue
+            if not name:
+                # Directory itself was changed, its entry is in parent.
+                if path:
+                    dirty.add(path[:-1])
+                continue
+            dirty.add(path)
+            if mask & IN_ISDIR and mask & (IN_CREATE | IN_MOVED_TO):
+                self.AddTree(root, path+(name,))
+        return overflow
+
+    def Wait(self, settle= 1.0, timeout= None):
+        '''
+        Waits for changes and keeps collecting them until nothing happens
+        for settle seconds, so a burst of writes ends up in one synch.
+        @return: (set of dirty directory paths, overflow) or None on timeout
+        '''
+        events= self.inotify.Read(timeout)
+        if not events:
+            return None
+        dirty= set()
+        overflow= self._Dirty(events, dirty)
+        start= time()
+        #Busy trees never settle, so wait at most a few settle periods.
+        while time()-start<settle*10:
+            events= self.inotify.Read(settle)
+            if not events:
+                break
+            overflow= self._Dirty(events, dirty) or overflow
+        if overflow:
+            self.Rescan()
+        return (dirty, overflow)
+
+    def Close(self):
+        self.inotify.Close()
+
+def synch_roots(dirty):
+    '''
+    Orders dirty directories so parents are synched before children.
+    '''
+    return sorted(dirty, key= lambda path: (len(path), path))
@@ -30,5 +30,6 @@ setup(
     entry_points="""
     [console_scripts]
     psyncho = psyncho.cli:main
+    psyncho-agent = psyncho.lib.agent:main
     """,
 )